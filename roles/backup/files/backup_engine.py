@@ -0,0 +1,412 @@
+#!/usr/bin/env python3
+"""
+Incremental Backup Engine
+Builds hardlinked snapshots with rsync --link-dest in a bounded parallel pool
+and keeps a manifest index so unchanged trees are cloned without rsync and
+restores can look up a file's snapshots directly
+"""
+
+import os
+import re
+import stat
+import time
+import shlex
+import shutil
+import hashlib
+import logging
+import sqlite3
+import argparse
+import subprocess
+from datetime import datetime, timedelta
+from concurrent.futures import ThreadPoolExecutor
+
+logger = logging.getLogger('backup_engine')
+
+# Configuration
+RSYNC_OPTIONS = '-a --delete'
+PARALLEL_JOBS = 4
+RETENTION_DAYS = 7
+INDEX_NAME = 'index.db'
+SNAPSHOT_FORMAT = '%Y%m%d_%H%M%S'
+SNAPSHOT_PATTERN = re.compile(r'^\d{8}_\d{6}$')
+HASH_CHUNK_BYTES = 1024 * 1024
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS snapshots (
+    id INTEGER PRIMARY KEY,
+    name TEXT UNIQUE NOT NULL,
+    started REAL,
+    finished REAL
+);
+CREATE TABLE IF NOT EXISTS sources (
+    snapshot_id INTEGER NOT NULL,
+    dest TEXT NOT NULL,
+    source TEXT NOT NULL
+);
+-- One row per file version; it is present in snapshots first_snapshot..last_snapshot
+CREATE TABLE IF NOT EXISTS entries (
+    unit TEXT NOT NULL,
+    path TEXT NOT NULL,
+    kind TEXT NOT NULL,
+    size INTEGER,
+    mtime INTEGER,
+    mode INTEGER,
+    uid INTEGER,
+    gid INTEGER,
+    sha256 TEXT,
+    first_snapshot INTEGER NOT NULL,
+    last_snapshot INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS entries_unit ON entries (unit, last_snapshot);
+CREATE INDEX IF NOT EXISTS entries_path ON entries (path);
+"""
+
+def _kind(st_mode):
+    if stat.S_ISREG(st_mode):
+        return 'f'
+    if stat.S_ISDIR(st_mode):
+        return 'd'
+    if stat.S_ISLNK(st_mode):
+        return 'l'
+    return 'o'
+
+def _signature(st):
+    # Seconds, like rsync's quick check, so copies compare equal to their source
+    return (_kind(st.st_mode), st.st_size if not stat.S_ISDIR(st.st_mode) else 0,
+            int(st.st_mtime), stat.S_IMODE(st.st_mode), st.st_uid, st.st_gid)
+
+def scan_tree(root, top_level_only=False):
+    """relative path -> (kind, size, mtime, mode, uid, gid) for root and everything below it
+
+    With top_level_only, subdirectories are left out (they are separate units)
+    """
+    entries = {'': _signature(os.lstat(root))}
+    pending = [('', root)]
+    while pending:
+        relative, directory = pending.pop()
+        with os.scandir(directory) as iterator:
+            for entry in iterator:
+                path = f"{relative}/{entry.name}" if relative else entry.name
+                is_dir = entry.is_dir(follow_symlinks=False)
+                if is_dir and top_level_only:
+                    continue
+                entries[path] = _signature(entry.stat(follow_symlinks=False))
+                if is_dir:
+                    pending.append((path, entry.path))
+    return entries
+
+def file_sha256(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK_BYTES), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def link_tree(src, dst, entries):
+    """Recreate the scanned entries of src at dst with every file hard-linked (cp -al)"""
+    directories = []
+    for relative in sorted(entries):
+        source = os.path.join(src, relative) if relative else src
+        target = os.path.join(dst, relative) if relative else dst
+        kind = entries[relative][0]
+        if kind == 'd':
+            os.makedirs(target, exist_ok=True)
+            directories.append((source, target))
+        elif kind == 'l':
+            os.symlink(os.readlink(source), target)
+            if os.geteuid() == 0:
+                os.lchown(target, entries[relative][4], entries[relative][5])
+        else:
+            os.link(source, target)
+    # Parents last, so creating children does not reset their mtime
+    for source, target in reversed(directories):
+        shutil.copystat(source, target)
+        if os.geteuid() == 0:
+            st = os.stat(source)
+            os.chown(target, st.st_uid, st.st_gid)
+
+def run_rsync(source, dest, link_dest=None, options=RSYNC_OPTIONS, top_level_only=False):
+    command = ['rsync'] + shlex.split(options)
+    if link_dest:
+        command.append(f"--link-dest={link_dest}")
+    if top_level_only:
+        # Subdirectories are transferred as their own units
+        command.append('--exclude=/*/')
+    command += [source.rstrip('/') + '/', dest.rstrip('/') + '/']
+    result = subprocess.run(command, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, universal_newlines=True)
+    if result.returncode != 0:
+        raise RuntimeError(f"rsync exited with {result.returncode}: {result.stdout.strip()[-2000:]}")
+
+def dest_names(sources):
+    """Snapshot directory per source: its basename unless two sources share one"""
+    basenames = [os.path.basename(os.path.normpath(source)) for source in sources]
+    names = {}
+    for source, basename in zip(sources, basenames):
+        if basenames.count(basename) > 1:
+            names[source] = os.path.normpath(source).strip('/').replace('/', '_')
+        else:
+            names[source] = basename
+    return names
+
+class BackupIndex:
+    """Manifest index of every snapshot stored next to the snapshots"""
+
+    def __init__(self, path):
+        self.path = path
+        self.connection = sqlite3.connect(path)
+        self.connection.executescript(SCHEMA)
+
+    def reader(self):
+        # Workers read the previous manifest over their own connection
+        return sqlite3.connect(f"file:{self.path}?mode=ro", uri=True)
+
+    def snapshot_id(self, name):
+        row = self.connection.execute("SELECT id FROM snapshots WHERE name = ?", (name,)).fetchone()
+        return row[0] if row else None
+
+    def record(self, name, started, sources, results, previous_id):
+        """Add a snapshot; unchanged rows are extended instead of copied"""
+        cursor = self.connection.execute("INSERT INTO snapshots (name, started, finished) VALUES (?, ?, ?)",
+                                         (name, started, time.time()))
+        snapshot_id = cursor.lastrowid
+        self.connection.executemany("INSERT INTO sources (snapshot_id, dest, source) VALUES (?, ?, ?)",
+                                    [(snapshot_id, dest, source) for source, dest in sources.items()])
+        for result in results:
+            if result['unchanged']:
+                self.connection.execute("UPDATE entries SET last_snapshot = ? WHERE unit = ? AND last_snapshot = ?",
+                                        (snapshot_id, result['unit'], previous_id))
+                continue
+            self.connection.executemany("UPDATE entries SET last_snapshot = ? WHERE rowid = ?",
+                                        [(snapshot_id, rowid) for rowid in result['kept']])
+            self.connection.executemany(
+                "INSERT INTO entries (unit, path, kind, size, mtime, mode, uid, gid, sha256, first_snapshot, "
+                "last_snapshot) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                [(result['unit'], path) + signature + (sha256, snapshot_id, snapshot_id)
+                 for path, signature, sha256 in result['added']])
+        return snapshot_id
+
+    def forget(self, names):
+        """Drop snapshots and the file versions no remaining snapshot holds"""
+        for name in names:
+            snapshot_id = self.snapshot_id(name)
+            if snapshot_id is not None:
+                self.connection.execute("DELETE FROM snapshots WHERE id = ?", (snapshot_id,))
+                self.connection.execute("DELETE FROM sources WHERE snapshot_id = ?", (snapshot_id,))
+        oldest = self.connection.execute("SELECT MIN(id) FROM snapshots").fetchone()[0]
+        if oldest is None:
+            self.connection.execute("DELETE FROM entries")
+        else:
+            self.connection.execute("DELETE FROM entries WHERE last_snapshot < ?", (oldest,))
+        self.connection.commit()
+
+    def find(self, path):
+        """Snapshots holding a path; absolute source paths are mapped to their snapshot location"""
+        candidates = {path.strip('/')}
+        if path.startswith('/'):
+            for dest, source in self.connection.execute("SELECT DISTINCT dest, source FROM sources"):
+                source = source.rstrip('/')
+                if path == source or path.startswith(source + '/'):
+                    candidates.add(dest + path[len(source):])
+        placeholders = ','.join('?' * len(candidates))
+        return self.connection.execute(
+            "SELECT s.name, e.path, e.kind, e.size, e.mtime, e.sha256 FROM entries e "
+            "JOIN snapshots s ON s.id BETWEEN e.first_snapshot AND e.last_snapshot "
+            f"WHERE e.path IN ({placeholders}) ORDER BY s.id", sorted(candidates)).fetchall()
+
+    def manifest(self, name):
+        snapshot_id = self.snapshot_id(name)
+        if snapshot_id is None:
+            return []
+        return self.connection.execute(
+            "SELECT path, kind, size, mtime, sha256 FROM entries "
+            "WHERE ? BETWEEN first_snapshot AND last_snapshot ORDER BY path", (snapshot_id,)).fetchall()
+
+    def close(self):
+        self.connection.close()
+
+class BackupEngine:
+    """Snapshots a set of source directories into base_dir/<timestamp>"""
+
+    def __init__(self, base_dir, rsync_options=RSYNC_OPTIONS, jobs=PARALLEL_JOBS, transfer=run_rsync):
+        self.base_dir = base_dir
+        self.rsync_options = rsync_options
+        self.jobs = jobs
+        self.transfer = transfer
+        self.latest = os.path.join(base_dir, 'latest')
+        os.makedirs(base_dir, exist_ok=True)
+        self.index = BackupIndex(os.path.join(base_dir, INDEX_NAME))
+
+    def previous_snapshot(self):
+        if not os.path.islink(self.latest):
+            return None
+        path = os.path.realpath(self.latest)
+        return path if os.path.isdir(path) else None
+
+    def _previous_entries(self, unit, previous_id):
+        if previous_id is None:
+            return {}
+        connection = self.index.reader()
+        try:
+            rows = connection.execute(
+                "SELECT rowid, path, kind, size, mtime, mode, uid, gid, sha256 FROM entries "
+                "WHERE unit = ? AND last_snapshot = ?", (unit, previous_id)).fetchall()
+        finally:
+            connection.close()
+        prefix = len(unit) + 1
+        return {row[1][prefix:]: (tuple(row[2:8]), row[8], row[0]) for row in rows}
+
+    def backup_unit(self, source, unit, snapshot, previous, previous_id, top_level_only=False):
+        """Transfer one tree; returns the manifest changes for the index"""
+        target = os.path.join(snapshot, unit)
+        scanned = scan_tree(source, top_level_only)
+        known = self._previous_entries(unit, previous_id)
+        result = {'unit': unit, 'source': source, 'unchanged': False, 'kept': [], 'added': []}
+
+        link_dest = os.path.join(previous, unit) if previous else None
+        if known and link_dest and os.path.isdir(link_dest) and \
+                scanned == {path: signature for path, (signature, _, _) in known.items()}:
+            # Nothing changed since the previous snapshot: clone it instead of asking rsync
+            link_tree(link_dest, target, scanned)
+            result['unchanged'] = True
+            return result
+
+        os.makedirs(target, exist_ok=True)
+        self.transfer(source, target, link_dest if link_dest and os.path.isdir(link_dest) else None,
+                      self.rsync_options, top_level_only)
+        # The manifest describes what was stored, which may be newer than the scan
+        for path, signature in scan_tree(target, top_level_only).items():
+            previous_version = known.get(path)
+            if previous_version and previous_version[0] == signature:
+                result['kept'].append(previous_version[2])
+                continue
+            sha256 = file_sha256(os.path.join(target, path)) if signature[0] == 'f' else None
+            result['added'].append((f"{unit}/{path}" if path else unit, signature, sha256))
+        return result
+
+    def snapshot(self, sources, now=None):
+        """Take a snapshot of every existing source; returns its directory"""
+        now = now or datetime.now()
+        started = time.time()
+        name = now.strftime(SNAPSHOT_FORMAT)
+        final = os.path.join(self.base_dir, name)
+        partial = os.path.join(self.base_dir, f".{name}.partial")
+        if os.path.exists(final):
+            raise RuntimeError(f"snapshot {name} already exists")
+
+        previous = self.previous_snapshot()
+        previous_id = self.index.snapshot_id(os.path.basename(previous)) if previous else None
+        existing = []
+        for source in sources:
+            if os.path.isdir(source):
+                existing.append(source)
+            else:
+                logger.warning(f"Directory {source} does not exist, skipping")
+        names = dest_names(existing)
+
+        # One unit per top-level directory (e.g. each user's home) plus the loose files of each source
+        units, roots = [], []
+        for source in existing:
+            with os.scandir(source) as iterator:
+                for entry in sorted(iterator, key=lambda e: e.name):
+                    if entry.is_dir(follow_symlinks=False):
+                        units.append((entry.path, f"{names[source]}/{entry.name}", False))
+            roots.append((source, names[source], True))
+
+        shutil.rmtree(partial, ignore_errors=True)
+        os.makedirs(partial)
+        logger.info(f"Snapshot {name}: {len(units) + len(roots)} units from {len(existing)} sources, "
+                    f"linked against {os.path.basename(previous) if previous else 'nothing'}")
+        results = []
+        try:
+            with ThreadPoolExecutor(max_workers=self.jobs) as pool:
+                # Roots go last so their directory attributes are not disturbed by the units below them
+                for batch in (units, roots):
+                    futures = [pool.submit(self.backup_unit, source, unit, partial, previous, previous_id, top)
+                               for source, unit, top in batch]
+                    results += [future.result() for future in futures]
+            self.index.record(name, started, names, results, previous_id)
+            os.rename(partial, final)
+        except BaseException:
+            self.index.connection.rollback()
+            shutil.rmtree(partial, ignore_errors=True)
+            raise
+        self.index.connection.commit()
+
+        tmp_link = self.latest + '.tmp'
+        if os.path.lexists(tmp_link):
+            os.remove(tmp_link)
+        os.symlink(final, tmp_link)
+        os.replace(tmp_link, self.latest)
+
+        unchanged = sum(result['unchanged'] for result in results)
+        added = sum(len(result['added']) for result in results)
+        logger.info(f"Snapshot {name} complete in {time.time() - started:.1f}s: {unchanged}/{len(results)} "
+                    f"units unchanged, {added} new or changed entries")
+        return final
+
+    def prune(self, retention_days=RETENTION_DAYS, now=None):
+        """Remove snapshots older than the retention window; the latest one is always kept"""
+        now = now or datetime.now()
+        cutoff = now - timedelta(days=retention_days)
+        latest = os.path.basename(self.previous_snapshot() or '')
+        removed = []
+        for name in sorted(os.listdir(self.base_dir)):
+            path = os.path.join(self.base_dir, name)
+            if name == latest or not SNAPSHOT_PATTERN.match(name) or os.path.islink(path):
+                continue
+            if datetime.strptime(name, SNAPSHOT_FORMAT) < cutoff:
+                shutil.rmtree(path)
+                removed.append(name)
+        self.index.forget(removed)
+        if removed:
+            logger.info(f"Removed {len(removed)} snapshots older than {retention_days} days")
+        return removed
+
+def main():
+    parser = argparse.ArgumentParser(description='Incremental hardlink snapshot backups with a manifest index')
+    parser.add_argument('--base-dir', required=True, help='Directory holding the snapshots and index')
+    subparsers = parser.add_subparsers(dest='command')
+    snapshot_parser = subparsers.add_parser('snapshot', help='Take a snapshot of the source directories')
+    snapshot_parser.add_argument('sources', nargs='+')
+    snapshot_parser.add_argument('--rsync-options', default=RSYNC_OPTIONS)
+    snapshot_parser.add_argument('--jobs', type=int, default=PARALLEL_JOBS, help='Parallel transfers')
+    snapshot_parser.add_argument('--retention-days', type=int, help='Prune older snapshots afterwards')
+    prune_parser = subparsers.add_parser('prune', help='Remove snapshots past the retention window')
+    prune_parser.add_argument('--retention-days', type=int, default=RETENTION_DAYS)
+    find_parser = subparsers.add_parser('find', help='List the snapshots holding a file')
+    find_parser.add_argument('path', help='Source path (/home/alice/file) or snapshot path (home/alice/file)')
+    manifest_parser = subparsers.add_parser('manifest', help='Print the manifest of a snapshot')
+    manifest_parser.add_argument('name')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='[%(asctime)s] %(levelname)s %(message)s',
+                        datefmt='%Y-%m-%d %H:%M:%S')
+    if args.command == 'snapshot':
+        engine = BackupEngine(args.base_dir, args.rsync_options, args.jobs)
+        try:
+            engine.snapshot(args.sources)
+        except (OSError, RuntimeError) as e:
+            logger.error(f"Snapshot failed: {e}")
+            return 1
+        if args.retention_days is not None:
+            engine.prune(args.retention_days)
+    elif args.command == 'prune':
+        BackupEngine(args.base_dir).prune(args.retention_days)
+    elif args.command == 'find':
+        rows = BackupIndex(os.path.join(args.base_dir, INDEX_NAME)).find(args.path)
+        for name, path, kind, size, mtime, sha256 in rows:
+            print(f"{name}\t{os.path.join(args.base_dir, name, path)}\t{size}\t"
+                  f"{datetime.fromtimestamp(mtime):%Y-%m-%d %H:%M:%S}\t{sha256 or '-'}")
+        if not rows:
+            print(f"{args.path} is not in any snapshot")
+            return 1
+    elif args.command == 'manifest':
+        for path, kind, size, mtime, sha256 in BackupIndex(os.path.join(args.base_dir, INDEX_NAME)).manifest(args.name):
+            print(f"{path}\t{kind}\t{size}\t{mtime}\t{sha256 or '-'}")
+    else:
+        parser.print_help()
+        return 1
+    return 0
+
+if __name__ == "__main__":
+    raise SystemExit(main())
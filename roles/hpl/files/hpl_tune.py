@@ -0,0 +1,335 @@
+#!/usr/bin/env python3
+"""
+HPL Autotuner
+Derives an HPL search space from a node's cores and memory, prunes it with
+short coarse runs, repeats the best candidates at full size and keeps every
+result in a history store so nodes that lose GFLOPS are flagged
+"""
+
+import os
+import re
+import json
+import glob
+import math
+import time
+import shlex
+import socket
+import hashlib
+import logging
+import argparse
+import statistics
+import subprocess
+
+logger = logging.getLogger('hpl_tune')
+
+# Configuration
+NBS = (128, 192, 224, 256)
+BCASTS = (1, 4)  # 1rM and Lng
+MEMORY_FRACTIONS = (0.80,)
+COARSE_MEMORY_FRACTION = 0.02  # Coarse runs take seconds instead of minutes
+KEEP = 3  # Candidates promoted from the coarse to the full-size runs
+MAX_ASPECT = 4  # Process grids flatter than 1:4 are never competitive
+HPL_MAX_PARAMS = 20  # Longest list HPL.dat accepts
+MPIRUN = 'mpirun -np {ranks}'
+REGRESSION_THRESHOLD = 0.05  # Drop against the node's own history
+PEER_THRESHOLD = 0.10  # Drop against nodes with the same core count
+HISTORY_RUNS = 10  # Previous runs forming a node's baseline
+HISTORY_FILE = 'history.jsonl'
+
+BCAST_NAMES = {0: '1rg', 1: '1rM', 2: '2rg', 3: '2rM', 4: 'Lng', 5: 'LnM'}
+RESULT_LINE = re.compile(r'^(W[RC](\d)(\d)[LCR]\d[LCR]\d+)\s+(\d+)\s+(\d+)\s+(\d+)\s+(\d+)\s+([\d.]+)\s+([\d.eE+-]+)\s*$')
+RESIDUAL_LINE = re.compile(r'^\|\|Ax-b\|\|.*\s(PASSED|FAILED)\s*$')
+
+HPL_DAT = """HPLinpack benchmark input file
+Innovative Computing Laboratory, University of Tennessee
+HPL.out      output file name (if any)
+6            device out (6=stdout,7=stderr,file)
+{n_count:<12} # of problems sizes (N)
+{ns:<12} Ns
+{nb_count:<12} # of NBs
+{nbs:<12} NBs
+0            PMAP process mapping (0=Row-, 1=Column-major)
+{grid_count:<12} # of process grids (P x Q)
+{ps:<12} Ps
+{qs:<12} Qs
+16.0         threshold
+1            # of panel fact
+1            PFACTs (0=left, 1=Crout, 2=Right)
+1            # of recursive stopping criterium
+4            NBMINs (>= 1)
+1            # of panels in recursion
+2            NDIVs
+1            # of recursive panel fact.
+1            RFACTs (0=left, 1=Crout, 2=Right)
+{bcast_count:<12} # of broadcast
+{bcasts:<12} BCASTs (0=1rg,1=1rM,2=2rg,3=2rM,4=Lng,5=LnM)
+1            # of lookahead depth
+0            DEPTHs (>=0)
+2            SWAP (0=bin-exch,1=long,2=mix)
+64           swapping threshold
+0            L1 in (0=transposed,1=no-transposed) form
+0            U  in (0=transposed,1=no-transposed) form
+1            Equilibration (0=no,1=yes)
+8            memory alignment in double (> 0)
+"""
+
+# Search space
+
+def process_grids(ranks, max_aspect=MAX_ASPECT):
+    """P x Q factorizations of ranks with P <= Q, squarest first"""
+    grids = [(p, ranks // p) for p in range(1, int(math.isqrt(ranks)) + 1) if ranks % p == 0]
+    grids = sorted(grids, key=lambda grid: grid[1] / grid[0])
+    bounded = [grid for grid in grids if grid[1] / grid[0] <= max_aspect]
+    # Prime rank counts only factor as 1 x ranks
+    return bounded or grids[:1]
+
+def problem_size(memory_mb, fraction, nb):
+    """Largest N, as a multiple of NB, whose matrix fits in the memory fraction"""
+    n = int(math.sqrt(memory_mb * 2**20 * fraction / 8))
+    return max(n // nb, 1) * nb
+
+def search_space(cores, memory_mb, nbs=NBS, bcasts=BCASTS, max_aspect=MAX_ASPECT):
+    """Coarse candidates: every NB, process grid and broadcast combination"""
+    return [{'nb': nb, 'p': p, 'q': q, 'bcast': bcast}
+            for nb in nbs for p, q in process_grids(cores, max_aspect) for bcast in bcasts]
+
+def render_hpl_dat(ns, nbs, grids, bcasts):
+    """HPL.dat running the cross product of the given lists"""
+    for name, values in (('Ns', ns), ('NBs', nbs), ('grids', grids), ('BCASTs', bcasts)):
+        if not 0 < len(values) <= HPL_MAX_PARAMS:
+            raise ValueError(f"HPL.dat takes 1-{HPL_MAX_PARAMS} {name}, got {len(values)}")
+    return HPL_DAT.format(
+        n_count=len(ns), ns=' '.join(map(str, ns)),
+        nb_count=len(nbs), nbs=' '.join(map(str, nbs)),
+        grid_count=len(grids), ps=' '.join(str(p) for p, _ in grids), qs=' '.join(str(q) for _, q in grids),
+        bcast_count=len(bcasts), bcasts=' '.join(map(str, bcasts)),
+    )
+
+# Results
+
+def parse_hpl_output(text):
+    """One dict per HPL result line, with the residual check that follows it"""
+    results = []
+    for line in text.splitlines():
+        match = RESULT_LINE.match(line.strip())
+        if match:
+            tv, depth, bcast, n, nb, p, q, seconds, gflops = match.groups()
+            results.append({'tv': tv, 'n': int(n), 'nb': int(nb), 'p': int(p), 'q': int(q),
+                            'bcast': int(bcast), 'depth': int(depth), 'time': float(seconds),
+                            'gflops': float(gflops), 'passed': None})
+            continue
+        match = RESIDUAL_LINE.match(line.strip())
+        if match and results and results[-1]['passed'] is None:
+            results[-1]['passed'] = match.group(1) == 'PASSED'
+    return results
+
+def best_result(results):
+    passed = [result for result in results if result['passed']]
+    return max(passed, key=lambda result: result['gflops']) if passed else None
+
+# Running
+
+def run_hpl(dat, work_dir, ranks, xhpl, mpirun=MPIRUN):
+    """Run xhpl on an HPL.dat in work_dir; returns its output"""
+    os.makedirs(work_dir, exist_ok=True)
+    with open(os.path.join(work_dir, 'HPL.dat'), 'w') as f:
+        f.write(dat)
+    command = shlex.split(mpirun.format(ranks=ranks)) + [xhpl]
+    logger.info(f"Running {' '.join(command)} in {work_dir}")
+    result = subprocess.run(command, cwd=work_dir, stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
+                            universal_newlines=True)
+    with open(os.path.join(work_dir, 'HPL.out'), 'w') as f:
+        f.write(result.stdout)
+    if result.returncode != 0:
+        raise RuntimeError(f"xhpl exited with {result.returncode} in {work_dir}")
+    return result.stdout
+
+def tune(cores, memory_mb, work_dir, xhpl, runner=run_hpl, mpirun=MPIRUN, nbs=NBS, bcasts=BCASTS,
+         memory_fractions=MEMORY_FRACTIONS, coarse_fraction=COARSE_MEMORY_FRACTION, keep=KEEP,
+         max_aspect=MAX_ASPECT):
+    """Coarse sweep, prune to the best candidates, then full-size runs of those"""
+    started = time.time()
+    candidates = search_space(cores, memory_mb, nbs, bcasts, max_aspect)
+    grids = process_grids(cores, max_aspect)
+    coarse_n = problem_size(memory_mb, coarse_fraction, max(nbs))
+    logger.info(f"{len(candidates)} candidates for {cores} cores and {memory_mb} MB; coarse N={coarse_n}")
+
+    # HPL runs the cross product of its lists, so the coarse sweep needs few launches
+    coarse = []
+    for start in range(0, len(grids), HPL_MAX_PARAMS):
+        dat = render_hpl_dat([coarse_n], list(nbs), grids[start:start + HPL_MAX_PARAMS], list(bcasts))
+        output = runner(dat, os.path.join(work_dir, f"coarse_{start // HPL_MAX_PARAMS}"), cores, xhpl, mpirun)
+        coarse += parse_hpl_output(output)
+
+    ranked, seen = [], set()
+    for result in sorted((result for result in coarse if result['passed']), key=lambda r: -r['gflops']):
+        key = (result['nb'], result['p'], result['q'], result['bcast'])
+        if key not in seen:
+            seen.add(key)
+            ranked.append(dict(zip(('nb', 'p', 'q', 'bcast'), key)))
+    if not ranked:
+        raise RuntimeError('no coarse run passed the residual check')
+    promoted = ranked[:keep]
+
+    fine = []
+    for index, candidate in enumerate(promoted):
+        for fraction in memory_fractions:
+            n = problem_size(memory_mb, fraction, candidate['nb'])
+            dat = render_hpl_dat([n], [candidate['nb']], [(candidate['p'], candidate['q'])], [candidate['bcast']])
+            output = runner(dat, os.path.join(work_dir, f"fine_{index}_{int(fraction * 100)}"), cores, xhpl, mpirun)
+            fine += parse_hpl_output(output)
+
+    best = best_result(fine) or best_result(coarse)
+    logger.info(f"Best: {best['gflops']:.2f} GFLOPS with N={best['n']} NB={best['nb']} "
+                f"P={best['p']} Q={best['q']} BCAST={BCAST_NAMES.get(best['bcast'], best['bcast'])}")
+    return {
+        'node': socket.gethostname().split('.')[0],
+        'timestamp': started,
+        'duration': round(time.time() - started, 1),
+        'cores': cores,
+        'memory_mb': memory_mb,
+        'candidates': len(candidates),
+        'promoted': promoted,
+        'coarse': coarse,
+        'fine': fine,
+        'best': best,
+    }
+
+# History and regression tracking
+
+def load_result_file(path):
+    """History record for a fetched tuning result or a plain <node>_HPL.out"""
+    with open(path, 'rb') as f:
+        data = f.read()
+    digest = hashlib.sha1(data).hexdigest()
+    if path.endswith('.json'):
+        result = json.loads(data)
+        best = result.get('best')
+        node, timestamp, cores = result['node'], result['timestamp'], result.get('cores')
+    else:
+        best = best_result(parse_hpl_output(data.decode(errors='replace')))
+        node = os.path.basename(path).rsplit('_HPL.out', 1)[0]
+        timestamp, cores = os.path.getmtime(path), best and best['p'] * best['q']
+    if not best:
+        return None
+    return {'digest': digest, 'node': node, 'timestamp': timestamp, 'cores': cores, 'gflops': best['gflops'],
+            'config': {key: best[key] for key in ('n', 'nb', 'p', 'q', 'bcast')}, 'source': os.path.basename(path)}
+
+def update_history(results_dir, store=None):
+    """Append results not seen before to the JSON lines store; returns every record"""
+    store = store or os.path.join(results_dir, HISTORY_FILE)
+    records = []
+    if os.path.exists(store):
+        with open(store) as f:
+            records = [json.loads(line) for line in f if line.strip()]
+    known = {record['digest'] for record in records}
+    added = []
+    paths = glob.glob(os.path.join(results_dir, '*_hpl_tune.json')) + glob.glob(os.path.join(results_dir, '*_HPL.out'))
+    for path in sorted(paths):
+        try:
+            record = load_result_file(path)
+        except (OSError, ValueError, KeyError) as e:
+            logger.warning(f"Skipping {path}: {e}")
+            continue
+        if record and record['digest'] not in known:
+            known.add(record['digest'])
+            added.append(record)
+    if added:
+        with open(store, 'a') as f:
+            for record in added:
+                f.write(json.dumps(record, sort_keys=True) + '\n')
+    return records + added
+
+def find_regressions(records, threshold=REGRESSION_THRESHOLD, peer_threshold=PEER_THRESHOLD,
+                     history_runs=HISTORY_RUNS):
+    """Latest result per node compared with its own history and with its peers"""
+    by_node = {}
+    for record in sorted(records, key=lambda record: record['timestamp']):
+        by_node.setdefault(record['node'], []).append(record)
+
+    latest = {node: runs[-1] for node, runs in by_node.items()}
+    peers = {}
+    for record in latest.values():
+        peers.setdefault(record['cores'], []).append(record['gflops'])
+
+    rows = []
+    for node, runs in sorted(by_node.items()):
+        current = runs[-1]
+        history = [run['gflops'] for run in runs[-history_runs - 1:-1]]
+        baseline = statistics.median(history) if history else None
+        peer_values = peers[current['cores']]
+        peer = statistics.median(peer_values) if len(peer_values) > 1 else None
+        reasons = []
+        if baseline and current['gflops'] < baseline * (1 - threshold):
+            reasons.append(f"{(1 - current['gflops'] / baseline) * 100:.1f}% below its history")
+        if peer and current['gflops'] < peer * (1 - peer_threshold):
+            reasons.append(f"{(1 - current['gflops'] / peer) * 100:.1f}% below its peers")
+        rows.append({'node': node, 'gflops': current['gflops'], 'baseline': baseline, 'peer': peer,
+                     'runs': len(runs), 'config': current['config'], 'regressed': bool(reasons),
+                     'reasons': reasons})
+    return rows
+
+def format_report(rows):
+    lines = [f"{'Node':<16} {'GFLOPS':>10} {'History':>10} {'Peers':>10} {'Runs':>5}  Status"]
+    for row in rows:
+        baseline = f"{row['baseline']:.2f}" if row['baseline'] else '-'
+        peer = f"{row['peer']:.2f}" if row['peer'] else '-'
+        status = 'REGRESSED: ' + '; '.join(row['reasons']) if row['regressed'] else 'ok'
+        lines.append(f"{row['node']:<16} {row['gflops']:>10.2f} {baseline:>10} {peer:>10} {row['runs']:>5}  {status}")
+    return '\n'.join(lines)
+
+def _int_list(value):
+    return [int(item) for item in value.split(',') if item]
+
+def _float_list(value):
+    return [float(item) for item in value.split(',') if item]
+
+def main():
+    parser = argparse.ArgumentParser(description='Tune HPL per node and track GFLOPS regressions')
+    subparsers = parser.add_subparsers(dest='command')
+    tune_parser = subparsers.add_parser('tune', help='Sweep HPL parameters on this node')
+    tune_parser.add_argument('--cores', type=int, required=True, help='Physical cores (MPI ranks)')
+    tune_parser.add_argument('--memory-mb', type=int, required=True)
+    tune_parser.add_argument('--xhpl', required=True)
+    tune_parser.add_argument('--work-dir', required=True)
+    tune_parser.add_argument('--output', required=True, help='JSON result file')
+    tune_parser.add_argument('--mpirun', default=MPIRUN, help='Launcher; {ranks} is substituted')
+    tune_parser.add_argument('--nbs', type=_int_list, default=list(NBS))
+    tune_parser.add_argument('--bcasts', type=_int_list, default=list(BCASTS))
+    tune_parser.add_argument('--memory-fractions', type=_float_list, default=list(MEMORY_FRACTIONS))
+    tune_parser.add_argument('--coarse-fraction', type=float, default=COARSE_MEMORY_FRACTION)
+    tune_parser.add_argument('--keep', type=int, default=KEEP)
+    tune_parser.add_argument('--max-aspect', type=float, default=MAX_ASPECT)
+    report_parser = subparsers.add_parser('report', help='Add fetched results to the history and flag regressions')
+    report_parser.add_argument('--results-dir', required=True)
+    report_parser.add_argument('--store', help=f"History file (default: <results-dir>/{HISTORY_FILE})")
+    report_parser.add_argument('--threshold', type=float, default=REGRESSION_THRESHOLD)
+    report_parser.add_argument('--peer-threshold', type=float, default=PEER_THRESHOLD)
+    report_parser.add_argument('--json', help='Also write the report rows here')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    if args.command == 'tune':
+        try:
+            result = tune(args.cores, args.memory_mb, args.work_dir, args.xhpl, mpirun=args.mpirun, nbs=args.nbs,
+                          bcasts=args.bcasts, memory_fractions=args.memory_fractions,
+                          coarse_fraction=args.coarse_fraction, keep=args.keep, max_aspect=args.max_aspect)
+        except (OSError, RuntimeError, ValueError) as e:
+            logger.error(f"Tuning failed: {e}")
+            return 1
+        with open(args.output, 'w') as f:
+            json.dump(result, f, indent=2)
+        return 0
+    if args.command == 'report':
+        rows = find_regressions(update_history(args.results_dir, args.store), args.threshold, args.peer_threshold)
+        print(format_report(rows) if rows else 'No HPL results found')
+        if args.json:
+            with open(args.json, 'w') as f:
+                json.dump(rows, f, indent=2)
+        # Exit status 2 lets the playbook tell regressions apart from errors
+        return 2 if any(row['regressed'] for row in rows) else 0
+    parser.print_help()
+    return 1
+
+if __name__ == "__main__":
+    raise SystemExit(main())
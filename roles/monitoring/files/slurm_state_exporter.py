@@ -0,0 +1,393 @@
+#!/usr/bin/env python3
+"""
+Slurm State Exporter
+Takes one squeue/sinfo/sdiag JSON snapshot per interval on a background thread and
+answers every Prometheus scrape from that cached snapshot, so slurmctld sees
+the same load no matter how many consumers scrape the exporter
+"""
+
+import re
+import json
+import time
+import shlex
+import resource
+import hashlib
+import logging
+import argparse
+import threading
+import subprocess
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+logger = logging.getLogger('slurm_state_exporter')
+
+# Configuration
+LISTEN_ADDRESS = '0.0.0.0'
+LISTEN_PORT = 9092
+SNAPSHOT_INTERVAL = 30  # seconds; matches the Prometheus scrape interval
+COMMAND_TIMEOUT = 20  # seconds
+SQUEUE_COMMAND = 'squeue --all --json'
+SINFO_COMMAND = 'sinfo --all --json'
+SDIAG_COMMAND = 'sdiag --json'
+MEM_UNITS_MB = {'K': 1 / 1024, 'M': 1, 'G': 1024, 'T': 1024 * 1024}
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def _labels(**labels):
+    return '{' + ','.join(f'{key}="{_escape(value)}"' for key, value in labels.items()) + '}'
+
+def _number(value, default=0):
+    """Unwrap Slurm's {"set": .., "infinite": .., "number": ..} integers (23.02+)"""
+    if isinstance(value, dict):
+        if not value.get('set', True) or value.get('infinite'):
+            return default
+        value = value.get('number', default)
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return default
+
+def _state(value):
+    """Job and node states are a flag list in newer releases and a string before"""
+    if isinstance(value, list):
+        value = value[0] if value else 'unknown'
+    return str(value or 'unknown').lower()
+
+def parse_tres(tres):
+    """Return (cpus, memory MB) from a TRES string such as cpu=4,mem=16G,node=1"""
+    cpus, mem_mb = 0.0, 0.0
+    for item in (tres or '').split(','):
+        key, _, value = item.partition('=')
+        if key == 'cpu':
+            cpus = _number(value)
+        elif key == 'mem':
+            match = re.match(r'^([\d.]+)([KMGT]?)$', value)
+            if match:
+                mem_mb = float(match.group(1)) * MEM_UNITS_MB.get(match.group(2) or 'M', 1)
+    return cpus, mem_mb
+
+def parse_jobs(payload):
+    """Reduce squeue --json to per-job (id, partition, account, user, state, reason, cpus, mem MB)"""
+    jobs = []
+    for job in payload.get('jobs', []):
+        state = _state(job.get('job_state'))
+        # Pending jobs have no allocation yet; count what they asked for
+        tres = job.get('tres_alloc_str') if state != 'pending' else job.get('tres_req_str')
+        cpus, mem_mb = parse_tres(tres)
+        if not cpus:
+            cpus = _number(job.get('cpus'))
+        jobs.append((str(job.get('job_id', '')), job.get('partition') or 'unknown',
+                     job.get('account') or 'unknown', job.get('user_name') or 'unknown',
+                     state, job.get('state_reason') or 'None', cpus, mem_mb))
+    return jobs
+
+def parse_nodes(payload):
+    """Reduce sinfo --json to partition totals and de-duplicated cluster totals"""
+    partitions = {}
+    node_states = {}
+    # A node listed under several partitions must only count once cluster-wide
+    node_groups = {}
+    for entry in payload.get('sinfo', []):
+        partition = (entry.get('partition') or {}).get('name') or 'unknown'
+        cpus = entry.get('cpus') or {}
+        memory = entry.get('memory') or {}
+        nodes = entry.get('nodes') or {}
+        node_total = _number(nodes.get('total'))
+        # sinfo reports per-node memory ranges for each group of similar nodes
+        real_mem = _number(memory.get('maximum')) * node_total
+        free_mem = _number((memory.get('free') or {}).get('maximum')) * node_total
+        values = {
+            'total_cpus': _number(cpus.get('total')),
+            'alloc_cpus': _number(cpus.get('allocated')),
+            'idle_cpus': _number(cpus.get('idle')),
+            'other_cpus': _number(cpus.get('other')),
+            'real_mem': real_mem,
+            'alloc_mem': _number(memory.get('allocated')),
+            'free_mem': free_mem,
+            'cpu_load': _number(((entry.get('cpu') or {}).get('load') or {}).get('maximum')) / 100,
+        }
+        totals = partitions.setdefault(partition, dict.fromkeys(values, 0.0))
+        for key, value in values.items():
+            totals[key] += value
+
+        names = tuple(nodes.get('nodes') or [])
+        state = _state((entry.get('node') or {}).get('state'))
+        for name in names:
+            node_states[name] = state
+        node_groups[names or (partition, state)] = values
+    cluster = {key: sum(values[key] for values in node_groups.values())
+               for key in ('total_cpus', 'alloc_cpus', 'idle_cpus', 'other_cpus', 'real_mem', 'alloc_mem', 'free_mem')}
+    return partitions, node_states, cluster
+
+def render_jobs(jobs):
+    partition_states, account_states, user_states = {}, {}, {}
+    account_cpus, account_mem, user_cpus, user_mem = {}, {}, {}, {}
+    account_pending, user_pending, pending_reasons = {}, {}, {}
+    job_lines = []
+    for job_id, partition, account, user, state, reason, cpus, mem_mb in jobs:
+        for counts, key in [(partition_states, (partition, state)), (account_states, (account, state)),
+                            (user_states, (user, state))]:
+            counts[key] = counts.get(key, 0) + 1
+        if state == 'pending':
+            account_pending[account] = account_pending.get(account, 0) + cpus
+            user_pending[user] = user_pending.get(user, 0) + cpus
+            key = (partition, reason)
+            pending_reasons[key] = pending_reasons.get(key, 0) + 1
+            continue
+        account_cpus[(account, state)] = account_cpus.get((account, state), 0) + cpus
+        account_mem[(account, state)] = account_mem.get((account, state), 0) + mem_mb
+        user_cpus[(user, state)] = user_cpus.get((user, state), 0) + cpus
+        user_mem[(user, state)] = user_mem.get((user, state), 0) + mem_mb
+        if state == 'running':
+            job_lines.append((job_id, partition, user, cpus, mem_mb))
+
+    lines = []
+    for name, description, values, keys in [
+        ('slurm_partition_job_state_total', 'Jobs per partition and state', partition_states, ('partition', 'state')),
+        ('slurm_account_job_state_total', 'Jobs per account and state', account_states, ('account', 'state')),
+        ('slurm_user_job_state_total', 'Jobs per user and state', user_states, ('username', 'state')),
+        ('slurm_account_job_state_cpu_alloc', 'Allocated CPUs per account and state', account_cpus,
+         ('account', 'state')),
+        ('slurm_account_job_state_mem_alloc', 'Allocated memory (MB) per account and state', account_mem,
+         ('account', 'state')),
+        ('slurm_user_cpu_alloc', 'Allocated CPUs per user and state', user_cpus, ('username', 'state')),
+        ('slurm_user_mem_alloc', 'Allocated memory (MB) per user and state', user_mem, ('username', 'state')),
+        ('slurm_account_cpus_pending', 'CPUs requested by pending jobs per account', account_pending, ('account',)),
+        ('slurm_user_cpus_pending', 'CPUs requested by pending jobs per user', user_pending, ('username',)),
+        ('slurm_partition_pending_reason_total', 'Pending jobs per partition and reason', pending_reasons,
+         ('partition', 'reason')),
+    ]:
+        lines.append(f"# HELP {name} {description}")
+        lines.append(f"# TYPE {name} gauge")
+        for key, value in sorted(values.items()):
+            key = key if isinstance(key, tuple) else (key,)
+            lines.append(f"{name}{_labels(**dict(zip(keys, key)))} {value:g}")
+
+    for name, description, position in [
+        ('slurm_job_cpu_alloc', 'CPUs allocated to a running job', 3),
+        ('slurm_job_mem_alloc', 'Memory (MB) allocated to a running job', 4),
+    ]:
+        lines.append(f"# HELP {name} {description}")
+        lines.append(f"# TYPE {name} gauge")
+        for job in job_lines:
+            lines.append(f"{name}{_labels(jobid=job[0], partition=job[1], username=job[2])} {job[position]:g}")
+    return lines
+
+def render_nodes(partitions, node_states, cluster):
+    lines = []
+    for key, description in [
+        ('total_cpus', 'CPUs in the partition'),
+        ('alloc_cpus', 'Allocated CPUs in the partition'),
+        ('idle_cpus', 'Idle CPUs in the partition'),
+        ('real_mem', 'Memory (MB) in the partition'),
+        ('alloc_mem', 'Allocated memory (MB) in the partition'),
+        ('free_mem', 'Free memory (MB) in the partition'),
+        ('cpu_load', 'Summed CPU load of the partition nodes'),
+    ]:
+        name = f"slurm_partition_{key}"
+        lines.append(f"# HELP {name} {description}")
+        lines.append(f"# TYPE {name} gauge")
+        for partition, values in sorted(partitions.items()):
+            lines.append(f"{name}{_labels(partition=partition)} {values[key]:g}")
+
+    state_counts = {}
+    for state in node_states.values():
+        state_counts[state] = state_counts.get(state, 0) + 1
+    lines += ['# HELP slurm_node_count_per_state Nodes per state',
+              '# TYPE slurm_node_count_per_state gauge']
+    lines += [f"slurm_node_count_per_state{_labels(state=state)} {count}"
+              for state, count in sorted(state_counts.items())]
+
+    for name, key, description in [
+        ('slurm_cpus_total', 'total_cpus', 'CPUs in the cluster'),
+        ('slurm_cpus_alloc', 'alloc_cpus', 'Allocated CPUs in the cluster'),
+        ('slurm_cpus_idle', 'idle_cpus', 'Idle CPUs in the cluster'),
+        ('slurm_mem_real', 'real_mem', 'Memory (MB) in the cluster'),
+        ('slurm_mem_alloc', 'alloc_mem', 'Allocated memory (MB) in the cluster'),
+        ('slurm_mem_free', 'free_mem', 'Free memory (MB) in the cluster'),
+    ]:
+        lines += [f"# HELP {name} {description}", f"# TYPE {name} gauge", f"{name} {cluster[key]:g}"]
+    return lines
+
+DIAG_GAUGES = [
+    ('server_thread_count', 'slurmctld server threads'),
+    ('agent_queue_size', 'Outgoing RPCs queued in the slurmctld agent'),
+    ('schedule_cycle_last', 'Microseconds spent in the last main scheduling cycle'),
+    ('schedule_cycle_mean', 'Mean microseconds per main scheduling cycle'),
+    ('bf_cycle_last', 'Microseconds spent in the last backfill cycle'),
+    ('bf_cycle_mean', 'Mean microseconds per backfill cycle'),
+]
+
+def parse_diag(payload):
+    """Reduce sdiag --json to scheduler gauges and per message type/user RPC counters"""
+    stats = payload.get('statistics') or {}
+    scheduler = {key: _number(stats.get(key)) for key, _ in DIAG_GAUGES}
+    rpc_types = {}
+    for entry in stats.get('rpcs_by_message_type') or []:
+        rpc_types[entry.get('message_type') or str(entry.get('type_id', 'unknown'))] = (
+            _number(entry.get('count')), _number(entry.get('average_time')), _number(entry.get('total_time')))
+    rpc_users = {}
+    for entry in stats.get('rpcs_by_user') or []:
+        rpc_users[entry.get('user') or str(entry.get('user_id', 'unknown'))] = (
+            _number(entry.get('count')), _number(entry.get('average_time')), _number(entry.get('total_time')))
+    return scheduler, rpc_types, rpc_users
+
+def render_diag(scheduler, rpc_types, rpc_users):
+    lines = []
+    for key, description in DIAG_GAUGES:
+        lines += [f"# HELP slurm_{key} {description}", f"# TYPE slurm_{key} gauge",
+                  f"slurm_{key} {scheduler[key]:g}"]
+    # sdiag counts since the last slurmctld restart or sdiag --reset
+    for label, values, kind in [('type', rpc_types, 'msg_type'), ('user', rpc_users, 'user')]:
+        for name, position, description, metric_type in [
+            (f'slurm_rpc_{kind}_count', 0, f'RPCs received per {label}', 'counter'),
+            (f'slurm_rpc_{kind}_avg_time', 1, f'Average microseconds per RPC per {label}', 'gauge'),
+            (f'slurm_rpc_{kind}_total_time', 2, f'Microseconds spent in RPCs per {label}', 'counter'),
+        ]:
+            lines.append(f"# HELP {name} {description}")
+            lines.append(f"# TYPE {name} {metric_type}")
+            for key, value in sorted(values.items()):
+                lines.append(f"{name}{_labels(**{label: key})} {value[position]:g}")
+    return lines
+
+class SlurmSnapshot:
+    """One squeue, sinfo and sdiag call per refresh, rendered once for every scrape"""
+
+    def __init__(self, squeue_command=SQUEUE_COMMAND, sinfo_command=SINFO_COMMAND, sdiag_command=SDIAG_COMMAND,
+                 timeout=COMMAND_TIMEOUT):
+        self.commands = {
+            'job': (shlex.split(squeue_command), parse_jobs, render_jobs),
+            'node': (shlex.split(sinfo_command), parse_nodes, render_nodes),
+            'diag': (shlex.split(sdiag_command), parse_diag, render_diag),
+        }
+        self.timeout = timeout
+        self.lock = threading.Lock()
+        # source -> (output digest, rendered lines) so unchanged output is not parsed again
+        self.sections = {}
+        self.durations = {}
+        self.errors = dict.fromkeys(self.commands, 0)
+        self.refreshes = 0
+        self.metrics = ''
+        self.taken_at = None
+
+    def _run(self, command):
+        result = subprocess.run(command, capture_output=True, timeout=self.timeout, check=True)
+        return result.stdout
+
+    def _refresh_source(self, source):
+        command, parse, render = self.commands[source]
+        started = time.monotonic()
+        try:
+            output = self._run(command)
+            digest = hashlib.sha1(output).hexdigest()
+            previous = self.sections.get(source)
+            if previous is None or previous[0] != digest:
+                parsed = parse(json.loads(output))
+                self.sections[source] = (digest, render(*parsed) if isinstance(parsed, tuple) else render(parsed))
+        except (OSError, ValueError, subprocess.SubprocessError) as e:
+            # Keep serving the last good section; the error counter shows the gap
+            self.errors[source] += 1
+            logger.error(f"Error running {' '.join(command)}: {e}")
+        self.durations[source] = (time.monotonic() - started) * 1000
+
+    def refresh(self):
+        """Take a new snapshot and pre-render the exposition text"""
+        for source in self.commands:
+            self._refresh_source(source)
+        lines = []
+        for source in self.commands:
+            lines += self.sections.get(source, (None, []))[1]
+            lines += [
+                f"# HELP slurm_{source}_scrape_duration Milliseconds spent in the last {source} snapshot",
+                f"# TYPE slurm_{source}_scrape_duration gauge",
+                f"slurm_{source}_scrape_duration {self.durations[source]:.0f}",
+                f"# HELP slurm_{source}_scrape_error Failed {source} snapshots since start",
+                f"# TYPE slurm_{source}_scrape_error counter",
+                f"slurm_{source}_scrape_error {self.errors[source]}",
+            ]
+        self.refreshes += 1
+        lines += [
+            '# HELP slurm_exporter_snapshots_total Snapshots taken from slurmctld since start',
+            '# TYPE slurm_exporter_snapshots_total counter',
+            f"slurm_exporter_snapshots_total {self.refreshes}",
+        ]
+        with self.lock:
+            self.metrics = '\n'.join(lines) + '\n'
+            self.taken_at = time.monotonic()
+
+    def render(self):
+        """Cached exposition plus the snapshot age; never calls into Slurm"""
+        with self.lock:
+            metrics, taken_at = self.metrics, self.taken_at
+        age = time.monotonic() - taken_at if taken_at is not None else -1
+        return (metrics + '# HELP slurm_exporter_snapshot_age_seconds Age of the served snapshot\n'
+                '# TYPE slurm_exporter_snapshot_age_seconds gauge\n'
+                f"slurm_exporter_snapshot_age_seconds {age:.3f}\n"
+                '# HELP process_resident_memory_bytes Resident memory of the exporter process\n'
+                '# TYPE process_resident_memory_bytes gauge\n'
+                f"process_resident_memory_bytes {_resident_memory()}\n")
+
+def _resident_memory():
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * resource.getpagesize()
+    except (OSError, IndexError, ValueError):
+        return 0
+
+class MetricsHandler(BaseHTTPRequestHandler):
+    """Serve the cached snapshot"""
+
+    def do_GET(self):
+        if self.path.split('?')[0] == '/metrics':
+            body = self.server.snapshot.render().encode()
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/plain; version=0.0.4')
+        else:
+            body = (b"<html><head><title>Slurm State Exporter</title></head>"
+                    b"<body><h1>Slurm State Exporter</h1>"
+                    b"<p>Visit <a href='/metrics'>/metrics</a> for Prometheus metrics</p></body></html>")
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/html')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        return
+
+def snapshot_loop(snapshot, interval, stop=None):
+    stop = stop or threading.Event()
+    while not stop.wait(interval):
+        try:
+            snapshot.refresh()
+        except Exception as e:
+            logger.error(f"Error taking Slurm snapshot: {e}")
+
+def make_server(snapshot, address=LISTEN_ADDRESS, port=LISTEN_PORT):
+    server = ThreadingHTTPServer((address, port), MetricsHandler)
+    server.daemon_threads = True
+    server.snapshot = snapshot
+    return server
+
+def main():
+    parser = argparse.ArgumentParser(description='Export cached Slurm queue and node state to Prometheus')
+    parser.add_argument('--address', default=LISTEN_ADDRESS)
+    parser.add_argument('--port', type=int, default=LISTEN_PORT)
+    parser.add_argument('--interval', type=int, default=SNAPSHOT_INTERVAL)
+    parser.add_argument('--timeout', type=int, default=COMMAND_TIMEOUT)
+    parser.add_argument('--squeue', default=SQUEUE_COMMAND, help='Command printing squeue JSON')
+    parser.add_argument('--sinfo', default=SINFO_COMMAND, help='Command printing sinfo JSON')
+    parser.add_argument('--sdiag', default=SDIAG_COMMAND, help='Command printing sdiag JSON')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    snapshot = SlurmSnapshot(args.squeue, args.sinfo, args.sdiag, args.timeout)
+    snapshot.refresh()
+    threading.Thread(target=snapshot_loop, args=(snapshot, args.interval), daemon=True).start()
+
+    server = make_server(snapshot, args.address, args.port)
+    logger.info(f"Serving Slurm state on {args.address}:{args.port}, refreshed every {args.interval}s")
+    server.serve_forever()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,214 @@
+#!/usr/bin/env python3
+"""
+Proxmox VM Power Exporter
+Estimates per-VM power from KVM process CPU time read directly from /proc and
+serves the result to Prometheus over HTTP
+"""
+
+import os
+import re
+import glob
+import time
+import logging
+import argparse
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+logger = logging.getLogger('proxmox_power_exporter')
+
+# Configuration
+LISTEN_PORT = 9200
+COLLECTION_INTERVAL = 30  # seconds
+POWER_IDLE = 30  # Node idle power in watts
+POWER_VM_BASE = 5  # Base power per running VM in watts
+PROC_ROOT = '/proc'
+RUN_DIR = '/run/qemu-server'
+CONF_DIR = '/etc/pve/qemu-server'
+CLOCK_TICKS = os.sysconf('SC_CLK_TCK') if hasattr(os, 'sysconf') else 100
+
+def _sanitize(value):
+    return re.sub(r'[\\"\n?]', '', str(value))
+
+def read_vm_name(conf_path):
+    """Return the VM name from its Proxmox config (current section only)"""
+    try:
+        with open(conf_path, 'r') as f:
+            for line in f:
+                if line.startswith('['):
+                    break  # Snapshot sections follow the current config
+                if line.startswith('name:'):
+                    return line.split(':', 1)[1].strip()
+    except OSError:
+        pass
+    return ''
+
+def read_proc_stat(proc_root, pid):
+    """Return (utime + stime ticks, process start time) from /proc/<pid>/stat"""
+    with open(os.path.join(proc_root, str(pid), 'stat'), 'r') as f:
+        data = f.read()
+    # The command name may contain spaces; fields resume after the last ')'
+    fields = data[data.rindex(')') + 2:].split()
+    return int(fields[11]) + int(fields[12]), int(fields[19])
+
+class VmIndex:
+    """vmid -> (pid, name) map rebuilt only when the pid files change"""
+
+    def __init__(self, run_dir=RUN_DIR, conf_dir=CONF_DIR):
+        self.run_dir = run_dir
+        self.conf_dir = conf_dir
+        self.signature = None
+        self.vms = {}
+        self.rebuilds = 0
+
+    def _current_signature(self):
+        signature = []
+        for path in glob.glob(os.path.join(self.run_dir, '*.pid')):
+            try:
+                signature.append((path, os.stat(path).st_mtime_ns))
+            except OSError:
+                continue
+        return tuple(sorted(signature))
+
+    def refresh(self):
+        signature = self._current_signature()
+        if signature == self.signature:
+            return self.vms
+
+        vms = {}
+        for path, _ in signature:
+            vmid = os.path.basename(path)[:-len('.pid')]
+            try:
+                with open(path, 'r') as f:
+                    pid = int(f.read().split()[0])
+            except (OSError, ValueError, IndexError):
+                continue
+            vms[vmid] = (pid, read_vm_name(os.path.join(self.conf_dir, f"{vmid}.conf")))
+        self.vms = vms
+        self.signature = signature
+        self.rebuilds += 1
+        logger.info(f"Indexed {len(vms)} running VMs")
+        return vms
+
+class PowerCollector:
+    """Turns KVM CPU time deltas into per-VM and node power estimates"""
+
+    def __init__(self, index, proc_root=PROC_ROOT, power_idle=POWER_IDLE, power_vm_base=POWER_VM_BASE):
+        self.index = index
+        self.proc_root = proc_root
+        self.power_idle = power_idle
+        self.power_vm_base = power_vm_base
+        # vmid -> (pid, start time, cpu ticks, wall time)
+        self.previous = {}
+
+    def collect(self, now=None):
+        """Sample all VMs and return the Prometheus exposition text"""
+        now = time.monotonic() if now is None else now
+        vms = self.index.refresh()
+
+        samples = {}
+        for vmid, (pid, name) in vms.items():
+            try:
+                ticks, start_time = read_proc_stat(self.proc_root, pid)
+            except (OSError, ValueError, IndexError):
+                continue  # VM stopped since the index was built
+            samples[vmid] = (pid, start_time, ticks, now, name)
+
+        vm_lines = []
+        cpu_total = 0.0
+        for vmid, (pid, start_time, ticks, wall, name) in sorted(samples.items(), key=lambda item: int(item[0])):
+            cpu_vm = 0.0
+            previous = self.previous.get(vmid)
+            # A different pid or start time means the VM was restarted; wait for a second sample
+            if previous and previous[:2] == (pid, start_time) and wall > previous[3]:
+                cpu_vm = max(ticks - previous[2], 0) / CLOCK_TICKS / (wall - previous[3]) * 100
+            cpu_total += cpu_vm
+            power_vm = self.power_vm_base + self.power_idle * cpu_vm / 100
+            labels = f'vmid="{vmid}",name="{_sanitize(name)}"'
+            vm_lines.append(('proxmox_vm_power_usage_watts', labels, f"{power_vm:.2f}"))
+            vm_lines.append(('proxmox_vm_cpu_usage', labels, f"{cpu_vm:.2f}"))
+            vm_lines.append(('proxmox_vm_cpu_seconds_total', labels, f"{ticks / CLOCK_TICKS:.2f}"))
+        self.previous = {vmid: sample[:4] for vmid, sample in samples.items()}
+
+        power_total = self.power_idle + self.power_idle * cpu_total / 100
+        lines = [
+            '# HELP proxmox_node_power_usage_watts Estimated total power usage for the node in watts',
+            '# TYPE proxmox_node_power_usage_watts gauge',
+            f"proxmox_node_power_usage_watts {power_total:.2f}",
+            '# HELP proxmox_node_vm_cpu_usage_total Total CPU usage percentage from all VMs',
+            '# TYPE proxmox_node_vm_cpu_usage_total gauge',
+            f"proxmox_node_vm_cpu_usage_total {cpu_total:.2f}",
+            '# HELP proxmox_node_vm_count Number of running VMs',
+            '# TYPE proxmox_node_vm_count gauge',
+            f"proxmox_node_vm_count {len(samples)}",
+        ]
+        for name, metric_type, description in [
+            ('proxmox_vm_power_usage_watts', 'gauge', 'Estimated power usage for VM in watts'),
+            ('proxmox_vm_cpu_usage', 'gauge', 'CPU usage percentage for VM since the previous sample'),
+            ('proxmox_vm_cpu_seconds_total', 'counter', 'CPU time consumed by the VM process'),
+        ]:
+            lines.append(f"# HELP {name} {description}")
+            lines.append(f"# TYPE {name} {metric_type}")
+            lines += [f"{metric}{{{labels}}} {value}" for metric, labels, value in vm_lines if metric == name]
+        return '\n'.join(lines) + '\n'
+
+class MetricsHandler(BaseHTTPRequestHandler):
+    """Serve the most recent collection"""
+
+    def do_GET(self):
+        if self.path.split('?')[0] == '/metrics':
+            body = self.server.metrics.encode()
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/plain; version=0.0.4')
+        else:
+            body = (b"<html><head><title>Proxmox Power Metrics Exporter</title></head>"
+                    b"<body><h1>Proxmox Power Metrics Exporter</h1>"
+                    b"<p>Visit <a href='/metrics'>/metrics</a> for Prometheus metrics</p></body></html>")
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/html')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        return
+
+def collection_loop(server, collector, interval, metrics_file=None):
+    while True:
+        time.sleep(interval)
+        try:
+            server.metrics = collector.collect()
+            if metrics_file:
+                tmp_path = metrics_file + '.tmp'
+                with open(tmp_path, 'w') as f:
+                    f.write(server.metrics)
+                os.replace(tmp_path, metrics_file)
+        except Exception as e:
+            logger.error(f"Error collecting VM power: {e}")
+
+def main():
+    parser = argparse.ArgumentParser(description='Export estimated Proxmox VM power to Prometheus')
+    parser.add_argument('--port', type=int, default=LISTEN_PORT)
+    parser.add_argument('--interval', type=int, default=COLLECTION_INTERVAL)
+    parser.add_argument('--power-idle', type=float, default=POWER_IDLE)
+    parser.add_argument('--power-vm-base', type=float, default=POWER_VM_BASE)
+    parser.add_argument('--metrics-file', help='Also write metrics here for the node_exporter textfile collector')
+    parser.add_argument('--proc-root', default=PROC_ROOT)
+    parser.add_argument('--run-dir', default=RUN_DIR)
+    parser.add_argument('--conf-dir', default=CONF_DIR)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    collector = PowerCollector(VmIndex(args.run_dir, args.conf_dir), args.proc_root,
+                               args.power_idle, args.power_vm_base)
+
+    server = ThreadingHTTPServer(('', args.port), MetricsHandler)
+    server.daemon_threads = True
+    # The first sample only primes the CPU counters; rates follow one interval later
+    server.metrics = collector.collect()
+    threading.Thread(target=collection_loop, args=(server, collector, args.interval, args.metrics_file),
+                     daemon=True).start()
+    logger.info(f"Serving VM power metrics on port {args.port}")
+    server.serve_forever()
+
+if __name__ == "__main__":
+    main()
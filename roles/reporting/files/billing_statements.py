@@ -0,0 +1,307 @@
+#!/usr/bin/env python3
+# Per-Account Billing Statements
+# Renders one HTML statement per account/project from the costed job frame of
+# the monthly billing report, in parallel and incrementally
+
+import os
+import re
+import io
+import json
+import base64
+import hashlib
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from datetime import datetime
+import pandas as pd
+
+# Configuration
+STATEMENT_DIR = "/opt/reporting/output/statements"
+# Bump to force regeneration when the statement layout changes
+STATEMENT_VERSION = 2
+TOP_JOBS = 10
+# Columns that determine a statement's content (and therefore its hash)
+STATEMENT_COLUMNS = [
+    'Cluster', 'JobID', 'User', 'Account', 'Partition', 'State', 'Start', 'End', 'Elapsed',
+    'CPUHours', 'GPUHours', 'MemoryGBHours', 'CPUCost', 'GPUCost', 'MemoryCost', 'TotalCost',
+    'DisplayName', 'Department',
+]
+
+STATEMENT_TEMPLATE = """
+<!DOCTYPE html>
+<html>
+<head>
+    <title>Billing Statement - {{ account }} - {{ month }}</title>
+    <style>
+        body { font-family: Arial, sans-serif; margin: 20px; }
+        h1, h2, h3 { color: #2c3e50; }
+        table { border-collapse: collapse; width: 100%; margin-bottom: 20px; }
+        th, td { border: 1px solid #ddd; padding: 8px; text-align: left; }
+        th { background-color: #f2f2f2; }
+        tr:nth-child(even) { background-color: #f9f9f9; }
+        .stats { display: flex; justify-content: space-between; margin-bottom: 20px; flex-wrap: wrap; }
+        .stat-box { background-color: #f8f9fa; border-radius: 5px; padding: 15px; width: 22%; box-shadow: 0 2px 4px rgba(0,0,0,0.1); margin-bottom: 10px; }
+        .plot-image { max-width: 100%; height: auto; }
+        .total-cost { font-size: 24px; font-weight: bold; color: #2c3e50; }
+    </style>
+</head>
+<body>
+    <h1>Billing Statement: {{ account }}</h1>
+    <p>Billing Period: {{ month }}</p>
+
+    <h2>Summary</h2>
+    <div class="stats">
+        <div class="stat-box">
+            <h3>Total Cost</h3>
+            <p class="total-cost">{{ currency_symbol }}{{ total_cost|round(2) }}</p>
+        </div>
+        <div class="stat-box">
+            <h3>Jobs</h3>
+            <p>{{ total_jobs }}</p>
+        </div>
+        <div class="stat-box">
+            <h3>CPU / GPU Hours</h3>
+            <p>{{ cpu_hours|round(1) }} / {{ gpu_hours|round(1) }}</p>
+        </div>
+        <div class="stat-box">
+            <h3>Memory (GB-Hours)</h3>
+            <p>{{ mem_hours|round(1) }}</p>
+        </div>
+    </div>
+
+    <h2>Cost Breakdown</h2>
+    {{ breakdown_table|safe }}
+    {% if plot %}
+    <img src="data:image/png;base64,{{ plot }}" class="plot-image" />
+    {% endif %}
+
+    <h2>Usage by User</h2>
+    {{ user_table|safe }}
+
+    <h2>Top {{ top_jobs }} Jobs by Cost</h2>
+    {{ jobs_table|safe }}
+
+    <footer>
+        <p>Generated automatically by the HPC Cluster Billing System</p>
+        <p><small>For billing inquiries, please contact the HPC administration team.</small></p>
+    </footer>
+</body>
+</html>
+"""
+
+# Read-only state inherited by forked workers (set before the pool starts)
+_SHARED = {}
+
+def _safe_name(account):
+    """Turn an account name into a safe file name, unique per account
+
+    The hash of the raw name keeps accounts that sanitize alike ("bio lab",
+    "bio_lab") from overwriting each other's statement.
+    """
+    safe = re.sub(r'[^A-Za-z0-9._-]', '_', str(account)) or 'unknown'
+    return f"{safe}-{hashlib.sha1(str(account).encode()).hexdigest()[:8]}"
+
+def _account_hashes(df, groups, config):
+    """Hash each account's statement inputs without copying the sub-frames"""
+    columns = [c for c in STATEMENT_COLUMNS if c in df.columns]
+    row_hashes = pd.util.hash_pandas_object(df[columns], index=False).to_numpy()
+    config_bytes = json.dumps(config, sort_keys=True).encode()
+
+    hashes = {}
+    for account, positions in groups.items():
+        digest = hashlib.sha256(config_bytes)
+        digest.update(row_hashes[positions].tobytes())
+        hashes[account] = digest.hexdigest()
+    return hashes
+
+def _format_money(series, currency_symbol):
+    return series.map(lambda value: f"{currency_symbol}{value:.2f}")
+
+def _render_plot(breakdown):
+    """Render the cost breakdown bar chart as a base64 PNG"""
+    import matplotlib
+    matplotlib.use('Agg')
+    import matplotlib.pyplot as plt
+
+    fig, ax = plt.subplots(figsize=(6, 3))
+    breakdown.plot(kind='bar', ax=ax)
+    ax.set_ylabel('Cost')
+    ax.grid(True, linestyle='--', alpha=0.7)
+    fig.tight_layout()
+    buffer = io.BytesIO()
+    fig.savefig(buffer, format='png')
+    plt.close(fig)
+    return base64.b64encode(buffer.getvalue()).decode()
+
+def _render_statement(account):
+    """Render one account statement (runs in a worker process)"""
+    from jinja2 import Environment
+
+    df = _SHARED['df']
+    config = _SHARED['config']
+    currency_symbol = config['currency_symbol']
+    jobs = df.iloc[_SHARED['groups'][account]]
+
+    breakdown = pd.Series({
+        'CPU': jobs['CPUCost'].sum(),
+        'GPU': jobs['GPUCost'].sum(),
+        'Memory': jobs['MemoryCost'].sum(),
+    })
+    breakdown_table = pd.DataFrame({
+        'Resource': breakdown.index,
+        'Usage': [f"{jobs['CPUHours'].sum():.1f} CPU-h", f"{jobs['GPUHours'].sum():.1f} GPU-h",
+                  f"{jobs['MemoryGBHours'].sum():.1f} GB-h"],
+        'Cost': _format_money(breakdown, currency_symbol).values,
+    }).to_html(index=False)
+
+    user_summary = jobs.groupby('User').agg(
+        Jobs=('JobID', 'count'),
+        CPUHours=('CPUHours', 'sum'),
+        GPUHours=('GPUHours', 'sum'),
+        TotalCost=('TotalCost', 'sum'),
+    ).sort_values('TotalCost', ascending=False).reset_index()
+    user_summary['Share'] = (user_summary['TotalCost'] / max(breakdown.sum(), 1e-9) * 100).map('{:.1f}%'.format)
+    user_summary['TotalCost'] = _format_money(user_summary['TotalCost'], currency_symbol)
+    user_summary[['CPUHours', 'GPUHours']] = user_summary[['CPUHours', 'GPUHours']].round(1)
+    if 'DisplayName' in jobs.columns:
+        user_info = jobs.drop_duplicates('User').set_index('User')
+        user_summary.insert(1, 'Name', user_summary['User'].map(user_info['DisplayName']))
+        user_summary.insert(2, 'Department', user_summary['User'].map(user_info['Department']))
+
+    cluster_column = ['Cluster'] if 'Cluster' in jobs.columns and df['Cluster'].nunique() > 1 else []
+    top_jobs = jobs.nlargest(TOP_JOBS, 'TotalCost')[
+        cluster_column + ['JobID', 'User', 'Partition', 'State', 'Elapsed', 'CPUHours', 'GPUHours', 'TotalCost']
+    ].copy()
+    top_jobs[['CPUHours', 'GPUHours']] = top_jobs[['CPUHours', 'GPUHours']].round(1)
+    top_jobs['TotalCost'] = _format_money(top_jobs['TotalCost'], currency_symbol)
+
+    template = _SHARED.get('template')
+    if template is None:
+        # Account and user names come from sacct/LDAP; the tables are pre-rendered and marked safe
+        template = _SHARED['template'] = Environment(autoescape=True).from_string(STATEMENT_TEMPLATE)
+
+    html_content = template.render(
+        account=account,
+        month=config['month'],
+        currency_symbol=currency_symbol,
+        total_cost=breakdown.sum(),
+        total_jobs=len(jobs),
+        cpu_hours=jobs['CPUHours'].sum(),
+        gpu_hours=jobs['GPUHours'].sum(),
+        mem_hours=jobs['MemoryGBHours'].sum(),
+        breakdown_table=breakdown_table,
+        plot=_render_plot(breakdown) if breakdown.sum() > 0 else None,
+        user_table=user_summary.to_html(index=False),
+        jobs_table=top_jobs.to_html(index=False),
+        top_jobs=TOP_JOBS,
+    )
+
+    file_name = f"{_safe_name(account)}.html"
+    path = os.path.join(config['output_dir'], file_name)
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w') as f:
+        f.write(html_content)
+    os.replace(tmp_path, path)
+
+    return account, file_name, float(breakdown.sum()), len(jobs)
+
+def _load_manifest(path):
+    try:
+        with open(path, 'r') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+def generate_statements(df, month, rates, currency_symbol='$', statement_dir=STATEMENT_DIR, workers=None):
+    """Render per-account statements for a month and return the manifest"""
+    if df is None or df.empty:
+        return None
+
+    output_dir = os.path.join(statement_dir, month)
+    os.makedirs(output_dir, exist_ok=True)
+    manifest_path = os.path.join(output_dir, 'manifest.json')
+    previous = _load_manifest(manifest_path).get('accounts', {})
+
+    # Partition once: positional row indices per account
+    df = df.reset_index(drop=True)
+    groups = {str(account): positions for account, positions in df.groupby('Account').indices.items()}
+
+    config = {
+        'version': STATEMENT_VERSION,
+        'month': month,
+        'rates': rates,
+        'currency_symbol': currency_symbol,
+        'output_dir': output_dir,
+    }
+    hashes = _account_hashes(df, groups, config)
+
+    accounts = {}
+    pending = []
+    for account, input_hash in hashes.items():
+        entry = previous.get(account)
+        if entry and entry.get('hash') == input_hash and os.path.exists(os.path.join(output_dir, entry['file'])):
+            accounts[account] = entry
+        else:
+            pending.append(account)
+
+    if pending:
+        _SHARED.clear()
+        _SHARED.update({'df': df, 'groups': groups, 'config': config})
+        try:
+            results = []
+            if workers == 1 or len(pending) == 1:
+                for account in pending:
+                    try:
+                        results.append(_render_statement(account))
+                    except Exception as e:
+                        print(f"Error rendering billing statement for {account}: {e}")
+            else:
+                # Forked workers share the frame copy-on-write; only account names cross the pipe
+                context = multiprocessing.get_context('fork')
+                with ProcessPoolExecutor(max_workers=workers, mp_context=context) as pool:
+                    futures = {pool.submit(_render_statement, account): account for account in pending}
+                    for future in as_completed(futures):
+                        try:
+                            results.append(future.result())
+                        except Exception as e:
+                            print(f"Error rendering billing statement for {futures[future]}: {e}")
+        finally:
+            _SHARED.clear()
+
+        generated_at = datetime.now().isoformat(timespec='seconds')
+        for account, file_name, total_cost, jobs in results:
+            # Statements of an older version may have been written under another name
+            old_file = previous.get(account, {}).get('file')
+            if old_file and old_file != file_name:
+                try:
+                    os.remove(os.path.join(output_dir, old_file))
+                except OSError:
+                    pass
+            accounts[account] = {
+                'hash': hashes[account],
+                'file': file_name,
+                'total_cost': round(total_cost, 2),
+                'jobs': jobs,
+                'generated': generated_at,
+            }
+
+    # Drop statements for accounts that no longer have jobs in the frame
+    for account, entry in previous.items():
+        if account not in hashes:
+            try:
+                os.remove(os.path.join(output_dir, entry['file']))
+            except OSError:
+                pass
+
+    manifest = {
+        'version': STATEMENT_VERSION,
+        'month': month,
+        'rates': rates,
+        'accounts': dict(sorted(accounts.items())),
+    }
+    tmp_path = manifest_path + '.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(tmp_path, manifest_path)
+
+    print(f"Billing statements: {len(pending)} rendered, {len(hashes) - len(pending)} unchanged in {output_dir}")
+    return manifest
@@ -0,0 +1,223 @@
+#!/usr/bin/env python3
+# EAR Measured Energy for SLURM Reports
+# Reads EAR's Jobs/Applications/Power_signatures tables for a report window in
+# two bulk queries and joins measured energy, power and CPU frequency onto the
+# sacct frame
+
+import numpy as np
+import pandas as pd
+
+# Configuration
+FETCH_SIZE = 10000  # Rows per fetchmany() from the server-side cursor
+JOULES_PER_KWH = 3.6e6
+KHZ_PER_GHZ = 1e6
+
+# SLURM's reserved step ids as stored by EAR
+BATCH_STEP = 4294967294
+EXTERN_STEP = 4294967295
+STEP_NAMES = {'batch': BATCH_STEP, 'extern': EXTERN_STEP}
+
+JOBS_QUERY = """
+SELECT id AS job_id, step_id, user_id, user_acc, start_time, end_time
+FROM Jobs
+WHERE end_time >= {p} AND start_time <= {p}
+"""
+
+# One row per (job, step, node); the MPI signature, when present, has the
+# better frequency estimate
+NODES_QUERY = """
+SELECT a.job_id, a.step_id, a.node_id, p.DC_power, p.time, p.avg_f, s.avg_f AS sig_avg_f
+FROM Applications a
+JOIN Jobs j ON j.id = a.job_id AND j.step_id = a.step_id
+JOIN Power_signatures p ON p.id = a.power_signature_id
+LEFT JOIN Signatures s ON s.id = a.signature_id
+WHERE j.end_time >= {p} AND j.start_time <= {p}
+"""
+
+try:
+    import pymysql
+    import pymysql.cursors
+except ImportError:
+    pymysql = None
+
+class EarDatabase:
+    """Bulk reader for the EAR accounting database"""
+
+    def __init__(self, host='localhost', port=3306, user=None, password=None, database='ear_db',
+                 connection_factory=None, placeholder='%s', fetch_size=FETCH_SIZE):
+        self.host = host
+        self.port = port
+        self.user = user
+        self.password = password
+        self.database = database
+        self._connection_factory = connection_factory or self._pymysql_connection
+        self.placeholder = placeholder
+        self.fetch_size = fetch_size
+        self.queries = 0
+
+    def _pymysql_connection(self):
+        if pymysql is None:
+            raise RuntimeError("pymysql is not installed")
+        # SSCursor streams rows from the server instead of buffering the result set
+        return pymysql.connect(host=self.host, port=int(self.port), user=self.user, password=self.password,
+                               database=self.database, cursorclass=pymysql.cursors.SSCursor,
+                               connect_timeout=10, read_timeout=600)
+
+    def _fetch(self, connection, query, params, columns):
+        self.queries += 1
+        cursor = connection.cursor()
+        try:
+            cursor.execute(query.format(p=self.placeholder), params)
+            chunks = []
+            while True:
+                rows = cursor.fetchmany(self.fetch_size)
+                if not rows:
+                    break
+                chunks.append(pd.DataFrame.from_records(rows, columns=columns))
+        finally:
+            cursor.close()
+        if not chunks:
+            return pd.DataFrame(columns=columns)
+        return pd.concat(chunks, ignore_index=True)
+
+    def read_window(self, start, end):
+        """Return (jobs, nodes) frames for EAR steps overlapping [start, end] (epoch seconds)"""
+        params = (int(start), int(end))
+        connection = self._connection_factory()
+        try:
+            jobs = self._fetch(connection, JOBS_QUERY, params,
+                               ['job_id', 'step_id', 'user_id', 'user_acc', 'start_time', 'end_time'])
+            nodes = self._fetch(connection, NODES_QUERY, params,
+                                ['job_id', 'step_id', 'node_id', 'DC_power', 'time', 'avg_f', 'sig_avg_f'])
+        finally:
+            connection.close()
+        return jobs, nodes
+
+def summarize_steps(jobs, nodes):
+    """Aggregate per-node signatures into per-step energy, power and frequency"""
+    columns = ['job_id', 'step_id', 'EnergyJ', 'AvgPowerW', 'FreqWeight', 'Seconds']
+    if nodes.empty:
+        return pd.DataFrame(columns=columns)
+
+    nodes = nodes.copy()
+    for col in ['job_id', 'step_id', 'DC_power', 'time', 'avg_f', 'sig_avg_f']:
+        nodes[col] = pd.to_numeric(nodes[col], errors='coerce')
+    nodes['EnergyJ'] = nodes['DC_power'] * nodes['time']
+    nodes['FreqKHz'] = nodes['sig_avg_f'].where(nodes['sig_avg_f'] > 0, nodes['avg_f'])
+    # Time-weighted so long-running nodes dominate the average frequency
+    nodes['FreqWeight'] = nodes['FreqKHz'] * nodes['time']
+
+    steps = nodes.groupby(['job_id', 'step_id']).agg(
+        EnergyJ=('EnergyJ', 'sum'),
+        AvgPowerW=('DC_power', 'sum'),
+        FreqWeight=('FreqWeight', 'sum'),
+        Seconds=('time', 'sum'),
+    ).reset_index()
+
+    if not jobs.empty:
+        durations = jobs[['job_id', 'step_id', 'start_time', 'end_time']].apply(pd.to_numeric, errors='coerce')
+        steps = steps.merge(durations, on=['job_id', 'step_id'], how='left')
+    else:
+        steps['start_time'] = np.nan
+        steps['end_time'] = np.nan
+    return steps
+
+def summarize_jobs(steps):
+    """Roll step energy up to jobs"""
+    if steps.empty:
+        return steps
+
+    # The batch and extern steps span the whole allocation and overlap the srun
+    # steps on the same nodes, so they only count when a job has no srun steps
+    wrapper = steps['step_id'].isin([BATCH_STEP, EXTERN_STEP])
+    has_srun = (~wrapper).groupby(steps['job_id']).transform('any')
+    counted = steps[~(wrapper & has_srun)]
+
+    jobs = counted.groupby('job_id').agg(
+        EnergyJ=('EnergyJ', 'sum'),
+        FreqWeight=('FreqWeight', 'sum'),
+        Seconds=('Seconds', 'sum'),
+    )
+    window = steps.groupby('job_id').agg(start_time=('start_time', 'min'), end_time=('end_time', 'max'))
+    jobs = jobs.join(window).reset_index()
+    elapsed = jobs['end_time'] - jobs['start_time']
+    jobs['AvgPowerW'] = np.where(elapsed > 0, jobs['EnergyJ'] / elapsed.where(elapsed > 0, 1), np.nan)
+    return jobs
+
+def _with_metrics(frame):
+    """Convert accumulated sums into the report columns"""
+    frame = frame.copy()
+    frame['MeasuredEnergyKWh'] = frame['EnergyJ'] / JOULES_PER_KWH
+    frame['AvgCPUFreqGHz'] = np.where(frame['Seconds'] > 0,
+                                      frame['FreqWeight'] / frame['Seconds'].where(frame['Seconds'] > 0, 1),
+                                      np.nan) / KHZ_PER_GHZ
+    return frame[['job_id', 'step_id', 'MeasuredEnergyKWh', 'AvgPowerW', 'AvgCPUFreqGHz']]
+
+def merge_ear_energy(df, jobs, nodes, id_column=None, cluster=None):
+    """Add MeasuredEnergyKWh, AvgPowerW and AvgCPUFreqGHz to a sacct frame
+
+    The EAR database belongs to one cluster: with cluster set, rows of a
+    multi-cluster frame from other clusters are left empty, even when their
+    job IDs match.
+    """
+    if df is None or df.empty:
+        return df
+    if id_column is None:
+        id_column = 'JobIDRaw' if 'JobIDRaw' in df.columns else 'JobID'
+
+    steps = summarize_steps(jobs, nodes)
+    lookup = pd.DataFrame(columns=['job_id', 'step_id', 'MeasuredEnergyKWh', 'AvgPowerW', 'AvgCPUFreqGHz'])
+    if not steps.empty:
+        job_rows = _with_metrics(summarize_jobs(steps).assign(step_id=-1))
+        step_rows = _with_metrics(steps)
+        lookup = pd.concat([job_rows, step_rows], ignore_index=True)
+
+    # Job rows (1234) match the job rollup under step -1; step rows (1234.0,
+    # 1234.batch) match that step
+    keys = df[id_column].astype(str).str.split('.', n=1, expand=True)
+    if keys.shape[1] == 1:
+        keys[1] = None
+    step_keys = keys[1].map(lambda step: STEP_NAMES.get(step, step)).fillna(-1)
+    left = pd.DataFrame({
+        'job_id': pd.to_numeric(keys[0], errors='coerce'),
+        'step_id': pd.to_numeric(step_keys, errors='coerce'),
+    }, index=df.index)
+
+    lookup = lookup.astype({'job_id': float, 'step_id': float})
+    merged = left.astype(float).merge(lookup, on=['job_id', 'step_id'], how='left')
+    merged.index = df.index
+    if cluster is not None and 'Cluster' in df.columns:
+        merged.loc[df['Cluster'].astype(str) != str(cluster)] = np.nan
+    for col in ['MeasuredEnergyKWh', 'AvgPowerW', 'AvgCPUFreqGHz']:
+        df[col] = merged[col].astype(float)
+    return df
+
+def add_ear_columns(df, database, start, end, **kwargs):
+    """Read the EAR window and merge it onto the frame, leaving NaNs on failure"""
+    if df is None or df.empty:
+        return df
+    try:
+        jobs, nodes = database.read_window(start, end)
+        return merge_ear_energy(df, jobs, nodes, **kwargs)
+    except Exception as e:
+        print(f"Error reading EAR energy data: {e}")
+        for col in ['MeasuredEnergyKWh', 'AvgPowerW', 'AvgCPUFreqGHz']:
+            df[col] = np.nan
+        return df
+
+def summarize_energy(df, by):
+    """Per-user or per-account table of measured energy, mean power and frequency"""
+    measured = df.dropna(subset=['MeasuredEnergyKWh'])
+    if measured.empty:
+        return None
+    summary = measured.groupby(by).agg(
+        Jobs=('MeasuredEnergyKWh', 'count'),
+        EnergyKWh=('MeasuredEnergyKWh', 'sum'),
+        AvgPowerW=('AvgPowerW', 'mean'),
+        AvgCPUFreqGHz=('AvgCPUFreqGHz', 'mean'),
+    ).sort_values('EnergyKWh', ascending=False).reset_index()
+    return summary.rename(columns={
+        'EnergyKWh': 'Energy (kWh)',
+        'AvgPowerW': 'Avg Power (W)',
+        'AvgCPUFreqGHz': 'Avg CPU Freq (GHz)',
+    }).round(2)
@@ -0,0 +1,159 @@
+#!/usr/bin/env python3
+# SLURM Job Usage and Cost Calculations
+# Shared CPU/GPU/memory-hour and cost math used by the monthly billing report,
+# the per-account statements and the usage rollups
+
+import os
+import json
+import pandas as pd
+from job_efficiency import parse_sacct_output
+
+# Daily rollups served by usage_query_service.py
+ROLLUP_DIR = "/opt/reporting/rollups"
+ROLLUP_VERSION = 1
+ROLLUP_DIMENSIONS = {'Cluster': 'cluster', 'User': 'user', 'Account': 'account', 'Partition': 'partition'}
+ROLLUP_METRICS = {
+    'CPUHours': 'cpu_hours',
+    'GPUHours': 'gpu_hours',
+    'MemoryGBHours': 'mem_gb_hours',
+    'CPUCost': 'cpu_cost',
+    'GPUCost': 'gpu_cost',
+    'MemoryCost': 'mem_cost',
+    'TotalCost': 'total_cost',
+}
+
+# Default billing rates (cost per unit hour)
+DEFAULT_RATES = {
+    'cpu': 0.05,  # per CPU hour
+    'gpu': 0.50,  # per GPU hour
+    'mem': 0.01,  # per GB hour
+}
+
+def parse_elapsed_hours(time_str):
+    """Parse elapsed time (format: [DD-]HH:MM:SS) into hours"""
+    if not time_str or pd.isna(time_str):
+        return 0
+
+    days = 0
+    if '-' in time_str:
+        days_part, time_part = time_str.split('-')
+        days = int(days_part)
+    else:
+        time_part = time_str
+
+    hours, minutes, seconds = map(int, time_part.split(':'))
+    return days * 24 + hours + minutes / 60 + seconds / 3600  # Convert to hours
+
+def extract_gpu_count(tres_str):
+    """Extract the allocated GPU count from an AllocTRES string"""
+    if not tres_str or pd.isna(tres_str):
+        return 0
+
+    # Example TRES: "cpu=4,mem=16G,node=1,billing=4,gres/gpu=2"
+    if 'gres/gpu=' in tres_str:
+        gpu_part = tres_str.split('gres/gpu=')[1].split(',')[0]
+        return int(gpu_part)
+    return 0
+
+def extract_mem_gb(tres_str):
+    """Extract the allocated memory in GB from an AllocTRES string"""
+    if not tres_str or pd.isna(tres_str):
+        return 0
+
+    # Example TRES: "cpu=4,mem=16G,node=1,billing=4"
+    if 'mem=' in tres_str:
+        mem_part = tres_str.split('mem=')[1].split(',')[0]
+        if 'G' in mem_part:
+            return float(mem_part.replace('G', ''))
+        elif 'M' in mem_part:
+            return float(mem_part.replace('M', '')) / 1024
+        elif 'T' in mem_part:
+            return float(mem_part.replace('T', '')) * 1024
+        else:
+            return float(mem_part) / (1024 * 1024)  # Assume bytes if no unit
+    return 0
+
+def add_usage_columns(df):
+    """Add ElapsedHours, CPUHours, GPUHours and MemoryGBHours columns"""
+    for col in ['AllocCPUS', 'NNodes']:
+        if col in df.columns:
+            df[col] = pd.to_numeric(df[col], errors='coerce')
+
+    df['ElapsedHours'] = df['Elapsed'].apply(parse_elapsed_hours)
+
+    # Calculate CPU hours
+    df['CPUHours'] = df['AllocCPUS'] * df['ElapsedHours']
+
+    df['GPUCount'] = df['AllocTRES'].apply(extract_gpu_count)
+    df['MemoryGB'] = df['AllocTRES'].apply(extract_mem_gb)
+
+    # Calculate GPU hours and Memory GB hours
+    df['GPUHours'] = df['GPUCount'] * df['ElapsedHours']
+    df['MemoryGBHours'] = df['MemoryGB'] * df['ElapsedHours']
+    return df
+
+def cluster_rates_table(clusters, rates=None, cluster_rates=None):
+    """Effective rates per cluster: the defaults overridden by each cluster's own"""
+    rates = {**DEFAULT_RATES, **(rates or {})}
+    cluster_rates = cluster_rates or {}
+    return pd.DataFrame([{'Cluster': cluster, **rates, **cluster_rates.get(cluster, {})}
+                         for cluster in clusters], columns=['Cluster', 'cpu', 'gpu', 'mem'])
+
+def _rate(df, rates, cluster_rates, key):
+    if not cluster_rates or 'Cluster' not in df.columns:
+        return rates[key]
+    per_cluster = {cluster: overrides.get(key, rates[key]) for cluster, overrides in cluster_rates.items()}
+    return df['Cluster'].map(per_cluster).fillna(rates[key]).astype(float)
+
+def add_cost_columns(df, rates=None, cluster_rates=None):
+    """Add CPUCost, GPUCost, MemoryCost and TotalCost columns
+
+    cluster_rates ({cluster: {'cpu': ...}}) overrides the rates for jobs of that cluster
+    """
+    rates = {**DEFAULT_RATES, **(rates or {})}
+    df['CPUCost'] = df['CPUHours'] * _rate(df, rates, cluster_rates, 'cpu')
+    df['GPUCost'] = df['GPUHours'] * _rate(df, rates, cluster_rates, 'gpu')
+    df['MemoryCost'] = df['MemoryGBHours'] * _rate(df, rates, cluster_rates, 'mem')
+    df['TotalCost'] = df['CPUCost'] + df['GPUCost'] + df['MemoryCost']
+    return df
+
+def process_billing_data(data, rates=None, cluster_rates=None):
+    """Process the SLURM accounting data for billing"""
+    df = parse_sacct_output(data)
+    if df is None or df.empty:
+        return df
+
+    # Filter out batch job steps, keeping only the main job entries
+    df = df[~df['JobID'].str.contains(r'\.', regex=True)].copy()
+
+    add_usage_columns(df)
+    add_cost_columns(df, rates, cluster_rates)
+    return df
+
+def daily_rollup(df, day):
+    """Usage and cost per cluster, user, account and partition of the jobs that ended on day"""
+    end = pd.to_datetime(df['End'], errors='coerce')
+    day_start = pd.Timestamp(day)
+    jobs = df[(end >= day_start) & (end < day_start + pd.Timedelta(days=1))]
+    dimensions = [col for col in ROLLUP_DIMENSIONS if col in jobs.columns]
+    rollup = jobs.groupby(dimensions, dropna=False).agg(
+        jobs=('JobID', 'count'),
+        **{name: (col, 'sum') for col, name in ROLLUP_METRICS.items()}
+    ).reset_index()
+    return rollup.rename(columns=ROLLUP_DIMENSIONS)
+
+def write_daily_rollup(df, day, rollup_dir=ROLLUP_DIR):
+    """Write the day's rollup atomically; the query service picks it up on its next scan"""
+    rollup = daily_rollup(df, day)
+    os.makedirs(rollup_dir, exist_ok=True)
+    path = os.path.join(rollup_dir, f"{day}.json")
+    payload = {
+        'version': ROLLUP_VERSION,
+        'day': day,
+        'rows': json.loads(rollup.round(6).to_json(orient='records')),
+    }
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump(payload, f)
+    os.replace(tmp_path, path)
+    return path
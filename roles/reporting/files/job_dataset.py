@@ -0,0 +1,141 @@
+#!/usr/bin/env python3
+# Columnar Job Dataset
+# Persists the processed job DataFrames of every report run as a compressed,
+# schema-versioned Parquet dataset and loads them back through Arrow
+#
+# Example (Jupyter):
+#   from job_dataset import load_jobs
+#   df = load_jobs('2026-01-01', '2026-03-31', report='monthly_billing',
+#                  columns=['User', 'Account', 'CPUHours', 'TotalCost'])
+
+import os
+import pandas as pd
+
+# Configuration
+DATASET_DIR = "/opt/reporting/dataset"
+# Bump when the column set or column meaning changes; each version lives in
+# its own directory so old and new files are never mixed in one scan
+SCHEMA_VERSION = 1
+COMPRESSION = "zstd"
+
+try:
+    import pyarrow as pa
+    import pyarrow.dataset as ds
+    import pyarrow.fs as pafs
+except ImportError:
+    pa = None
+
+def _version_dir(dataset_dir):
+    return os.path.join(dataset_dir, f"v{SCHEMA_VERSION}")
+
+def _partitioning():
+    return ds.partitioning(pa.schema([('date', pa.string())]), flavor='hive')
+
+def _partition_dates(df):
+    """Partition rows by the day the job ended; jobs still running have no day yet"""
+    if 'End' not in df.columns:
+        return pd.Series(pd.NA, index=df.index, dtype='string')
+    end = pd.to_datetime(df['End'], format='%Y-%m-%dT%H:%M:%S', errors='coerce')
+    return end.dt.strftime("%Y-%m-%d").astype('string')
+
+def _merge_existing(frame, report_name, dataset_dir):
+    """Add the rows already stored for the frame's days, so rewriting a day never drops jobs"""
+    days = sorted(frame['date'].unique())
+    existing = load_jobs(days[0], days[-1], report=report_name, dataset_dir=dataset_dir)
+    if existing.empty:
+        return frame
+    existing = existing[existing['date'].astype(str).isin(days)]
+    keys = [col for col in ('Cluster', 'JobID') if col in frame.columns and col in existing.columns]
+    merged = pd.concat([existing, frame], ignore_index=True)
+    # Rows of this run replace earlier copies of the same job
+    return merged.drop_duplicates(subset=keys or None, keep='last')
+
+def export_job_frame(df, report_name, dataset_dir=DATASET_DIR):
+    """Write a processed job frame to the dataset, merged into the days its jobs ended on
+
+    Jobs without an End time are left out until a later run sees them finish.
+    """
+    if pa is None:
+        print("pyarrow is not installed; skipping Parquet export")
+        return None
+    if df is None or df.empty:
+        return None
+
+    frame = df.copy()
+    frame['date'] = _partition_dates(frame)
+    frame = frame[frame['date'].notna()]
+    if frame.empty:
+        return None
+    frame = _merge_existing(frame, report_name, dataset_dir)
+
+    # sacct fields arrive as Python strings; store them as Arrow strings
+    for col in frame.columns:
+        if frame[col].dtype == object:
+            frame[col] = frame[col].astype('string')
+
+    table = pa.Table.from_pandas(frame, preserve_index=False)
+    table = table.replace_schema_metadata({
+        **(table.schema.metadata or {}),
+        b'hpc_reporting.schema_version': str(SCHEMA_VERSION).encode(),
+        b'hpc_reporting.report': report_name.encode(),
+    })
+
+    base_dir = os.path.join(_version_dir(dataset_dir), f"report={report_name}")
+    try:
+        ds.write_dataset(
+            table,
+            base_dir=base_dir,
+            format='parquet',
+            partitioning=_partitioning(),
+            existing_data_behavior='delete_matching',
+            basename_template='part-{i}.parquet',
+            file_options=ds.ParquetFileFormat().make_write_options(compression=COMPRESSION),
+        )
+    except (OSError, pa.ArrowException) as e:
+        print(f"Error writing Parquet dataset: {e}")
+        return None
+
+    return base_dir
+
+def _unified_schema(dataset):
+    """Union of the columns of every file in the dataset, plus the partition field"""
+    schemas = [fragment.physical_schema for fragment in dataset.get_fragments()]
+    schemas.append(_partitioning().schema)
+    try:
+        return pa.unify_schemas(schemas, promote_options='permissive')
+    except TypeError:
+        # pyarrow < 14 only merges null columns into typed ones
+        return pa.unify_schemas(schemas)
+
+def load_jobs(start=None, end=None, report='monthly_billing', columns=None, dataset_dir=DATASET_DIR):
+    """Load job rows between start and end (YYYY-MM-DD, inclusive) as a DataFrame"""
+    if pa is None:
+        raise ImportError("pyarrow is required to load the job dataset")
+
+    base_dir = os.path.join(_version_dir(dataset_dir), f"report={report}")
+    if not os.path.isdir(base_dir):
+        return pd.DataFrame(columns=columns or [])
+
+    # Memory-map the Parquet files instead of copying them into heap buffers
+    options = dict(format='parquet', partitioning=_partitioning(),
+                   filesystem=pafs.LocalFileSystem(use_mmap=True))
+    dataset = ds.dataset(base_dir, **options)
+    # The discovered schema is the first file's; columns added later in the
+    # history (energy, EAR measurements) would be dropped from every scan
+    dataset = ds.dataset(base_dir, schema=_unified_schema(dataset), **options)
+
+    condition = None
+    if start:
+        condition = ds.field('date') >= str(start)
+    if end:
+        upper = ds.field('date') <= str(end)
+        condition = upper if condition is None else condition & upper
+
+    return dataset.to_table(columns=columns, filter=condition).to_pandas()
+
+def list_partitions(report='monthly_billing', dataset_dir=DATASET_DIR):
+    """Return the dates available for a report"""
+    base_dir = os.path.join(_version_dir(dataset_dir), f"report={report}")
+    if not os.path.isdir(base_dir):
+        return []
+    return sorted(name.split('=', 1)[1] for name in os.listdir(base_dir) if name.startswith('date='))
@@ -0,0 +1,123 @@
+#!/usr/bin/env python3
+# SLURM Job Efficiency Calculations
+# Shared CPU and memory efficiency logic for the weekly report and the
+# near-real-time inefficiency watcher
+
+import pandas as pd
+import numpy as np
+
+# Jobs below these efficiencies (%) are considered inefficient
+CPU_EFFICIENCY_THRESHOLD = 50
+MEM_EFFICIENCY_THRESHOLD = 50
+
+def parse_elapsed(time_str):
+    """Parse a SLURM duration ([DD-]HH:MM:SS or MM:SS.mmm) into seconds"""
+    if not time_str or pd.isna(time_str):
+        return 0
+
+    days = 0
+    if '-' in time_str:
+        days_part, time_part = time_str.split('-')
+        days = int(days_part)
+    else:
+        time_part = time_str
+
+    parts = [float(p) for p in time_part.split(':')]
+    while len(parts) < 3:
+        parts.insert(0, 0)
+    hours, minutes, seconds = parts
+    return int(days * 86400 + hours * 3600 + minutes * 60 + seconds)
+
+def parse_mem(mem_str):
+    """Parse a SLURM memory value (e.g. 4000K, 16G) into MB"""
+    if not mem_str or pd.isna(mem_str):
+        return 0
+
+    if 'K' in mem_str:
+        return float(mem_str.replace('K', '')) / 1024  # Convert to MB
+    elif 'M' in mem_str:
+        return float(mem_str.replace('M', ''))
+    elif 'G' in mem_str:
+        return float(mem_str.replace('G', '')) * 1024  # Convert to MB
+    elif 'T' in mem_str:
+        return float(mem_str.replace('T', '')) * 1024 * 1024  # Convert to MB
+    else:
+        return float(mem_str)
+
+def parse_sacct_output(data):
+    """Split parsable2 sacct output into a DataFrame (all rows, including steps)"""
+    if not data:
+        return None
+
+    lines = data.strip().split('\n')
+    headers = lines[0].split('|')
+
+    rows = []
+    for line in lines[1:]:
+        if not line.strip():
+            continue
+        rows.append(line.split('|'))
+
+    return pd.DataFrame(rows, columns=headers)
+
+def _job_keys(df, job_ids):
+    """Job IDs qualified by cluster, since IDs repeat across federated clusters"""
+    if 'Cluster' in df.columns:
+        return df['Cluster'] + '|' + job_ids
+    return job_ids
+
+def process_efficiency_data(data):
+    """Process the SLURM accounting data for efficiency metrics"""
+    df = parse_sacct_output(data)
+    if df is None or df.empty:
+        return df
+
+    # MaxRSS is only reported on job steps; keep the peak step per job
+    step_rss = None
+    if 'MaxRSS' in df.columns:
+        base_ids = _job_keys(df, df['JobID'].str.split('.').str[0])
+        step_rss = df['MaxRSS'].apply(parse_mem).groupby(base_ids).max()
+
+    # Filter out batch job steps, keeping only the main job entries
+    df = df[~df['JobID'].str.contains(r'\.', regex=True)].copy()
+
+    # Convert relevant columns to numeric
+    numeric_cols = ['ReqCPUS', 'AllocCPUS', 'NNodes']
+    for col in numeric_cols:
+        if col in df.columns:
+            df[col] = pd.to_numeric(df[col], errors='coerce')
+
+    df['ElapsedSeconds'] = df['Elapsed'].apply(parse_elapsed)
+
+    # Parse TotalCPU (format: [DD-]HH:MM:SS)
+    df['TotalCPUSeconds'] = df['TotalCPU'].apply(parse_elapsed)
+
+    # Calculate CPU efficiency (TotalCPU / (Elapsed * AllocCPUS))
+    df['CPUEfficiency'] = np.where(
+        (df['ElapsedSeconds'] > 0) & (df['AllocCPUS'] > 0),
+        df['TotalCPUSeconds'] / (df['ElapsedSeconds'] * df['AllocCPUS']) * 100,
+        0
+    )
+
+    # Parse requested memory
+    df['ReqMemMB'] = df['ReqMem'].apply(parse_mem)
+
+    # Parse actual memory usage (MaxRSS), falling back to the step peak
+    df['MaxRSSMB'] = df['MaxRSS'].apply(parse_mem)
+    if step_rss is not None:
+        df['MaxRSSMB'] = np.maximum(df['MaxRSSMB'], _job_keys(df, df['JobID']).map(step_rss).fillna(0))
+
+    # Calculate memory efficiency (MaxRSS / ReqMem)
+    df['MemEfficiency'] = np.where(
+        df['ReqMemMB'] > 0,
+        df['MaxRSSMB'] / df['ReqMemMB'] * 100,
+        0
+    )
+
+    return df
+
+def flag_inefficient_jobs(df, cpu_threshold=CPU_EFFICIENCY_THRESHOLD, mem_threshold=MEM_EFFICIENCY_THRESHOLD):
+    """Return boolean Series for CPU- and memory-inefficient jobs"""
+    inefficient_cpu = df['CPUEfficiency'] < cpu_threshold
+    inefficient_mem = df['MemEfficiency'] < mem_threshold
+    return inefficient_cpu, inefficient_mem
@@ -0,0 +1,253 @@
+#!/usr/bin/env python3
+# Energy-Based Job Accounting
+# Integrates the slurm_job_power_watts series published by the power
+# collector into per-job kWh using batched Prometheus range queries
+
+import re
+import json
+import threading
+import urllib.error
+import urllib.parse
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+import pandas as pd
+
+# Configuration
+POWER_METRIC = "slurm_job_power_watts"
+# Exact prolog-to-epilog node energy recorded by the collector's checkpoint socket
+CHECKPOINT_METRIC = "slurm_job_energy_joules"
+CHECKPOINT_CONCURRENCY_METRIC = "slurm_job_energy_concurrent_jobs"
+WINDOW_SECONDS = 6 * 3600  # Range-query window; jobs are grouped into aligned windows
+STEP_SECONDS = 60  # Matches the collector's sampling interval
+MAX_PARALLEL_QUERIES = 4  # Keeps the TSDB load bounded
+MAX_CONSECUTIVE_ERRORS = 5  # Failed queries in a row before Prometheus is given up on for the run
+CHECKPOINT_WINDOW_SECONDS = 24 * 3600  # Checkpoint lookups are split into windows of this size
+CHECKPOINT_LAG_SECONDS = 3600  # Checkpoints are published after the job ends
+JOULES_PER_KWH = 3.6e6
+
+# np.trapz was renamed to np.trapezoid in NumPy 2.0
+_trapezoid = getattr(np, 'trapezoid', None) or np.trapz
+
+def expand_hostlist(hostlist):
+    """Expand a SLURM hostlist expression (e.g. nodo[01-03,07],gpu1) into host names"""
+    if not hostlist or pd.isna(hostlist) or hostlist in ('None assigned', '(null)'):
+        return []
+
+    hosts = []
+    for part in re.findall(r'[^,\[]+(?:\[[^\]]*\])?[^,]*', hostlist):
+        match = re.match(r'^(.*?)\[([^\]]*)\](.*)$', part)
+        if not match:
+            hosts.append(part)
+            continue
+        prefix, ranges, suffix = match.groups()
+        for item in ranges.split(','):
+            if '-' in item:
+                low, high = item.split('-', 1)
+                width = len(low)
+                for number in range(int(low), int(high) + 1):
+                    hosts.append(f"{prefix}{number:0{width}d}{suffix}")
+            else:
+                hosts.append(f"{prefix}{item}{suffix}")
+    return hosts
+
+class PrometheusUnavailable(RuntimeError):
+    """Prometheus stopped answering; the remaining queries of the run are not sent"""
+
+class PrometheusClient:
+    """Minimal client for the Prometheus HTTP API
+
+    Acts as a circuit breaker: after a connection error, or max_consecutive_errors
+    failed queries in a row, every further query raises PrometheusUnavailable
+    without waiting on the network.
+    """
+
+    def __init__(self, url, timeout=30, max_consecutive_errors=MAX_CONSECUTIVE_ERRORS):
+        self.url = url.rstrip('/')
+        self.timeout = timeout
+        self.max_consecutive_errors = max_consecutive_errors
+        self.queries = 0
+        self.consecutive_errors = 0
+        self.unavailable = None  # Error that opened the breaker
+        self.lock = threading.Lock()
+
+    def _get(self, path, params):
+        if self.unavailable is not None:
+            raise PrometheusUnavailable(f"Prometheus unavailable: {self.unavailable}")
+        with self.lock:
+            self.queries += 1
+        query_string = urllib.parse.urlencode(params)
+        try:
+            with urllib.request.urlopen(f"{self.url}{path}?{query_string}", timeout=self.timeout) as response:
+                payload = json.load(response)
+            if payload.get('status') != 'success':
+                raise RuntimeError(f"Prometheus query failed: {payload.get('error')}")
+        except Exception as e:
+            self._record_error(e)
+            raise
+        with self.lock:
+            self.consecutive_errors = 0
+        return payload['data']['result']
+
+    def _record_error(self, error):
+        # Refused, unreachable or timed out: every other query would fail the same way
+        connection_error = isinstance(error, OSError) and not isinstance(error, urllib.error.HTTPError)
+        with self.lock:
+            self.consecutive_errors += 1
+            if self.unavailable is None and (connection_error or
+                                             self.consecutive_errors >= self.max_consecutive_errors):
+                self.unavailable = error
+
+    def query_range(self, query, start, end, step):
+        return self._get('/api/v1/query_range', {'query': query, 'start': start, 'end': end, 'step': step})
+
+    def query(self, query, time=None):
+        params = {'query': query}
+        if time is not None:
+            params['time'] = time
+        return self._get('/api/v1/query', params)
+
+def _node_selector(metric, node):
+    # Collectors report os.uname().nodename, which may be the FQDN; backslashes
+    # are doubled because the regex sits inside a PromQL string literal
+    pattern = (re.escape(node) + r'(\..*)?').replace('\\', '\\\\')
+    return metric + '{hostname=~"' + pattern + '"}'
+
+def _job_windows(df, window_seconds):
+    """Yield (row index, job id, start, end, nodes) for jobs with a usable interval"""
+    start = pd.to_datetime(df['Start'], errors='coerce')
+    end = pd.to_datetime(df['End'], errors='coerce')
+    job_ids = df['JobIDRaw'] if 'JobIDRaw' in df.columns else df['JobID']
+    for index, job_id, job_start, job_end, nodelist in zip(df.index, job_ids, start, end, df['NodeList']):
+        if pd.isna(job_start) or pd.isna(job_end) or job_end <= job_start:
+            continue
+        nodes = expand_hostlist(nodelist)
+        if nodes:
+            # sacct times are local; naive datetime.timestamp() interprets them as such
+            yield (index, str(job_id), job_start.to_pydatetime().timestamp(),
+                   job_end.to_pydatetime().timestamp(), nodes)
+
+def compute_job_energy(df, client, metric=POWER_METRIC, window_seconds=WINDOW_SECONDS,
+                       step=STEP_SECONDS, max_parallel=MAX_PARALLEL_QUERIES):
+    """Return a Series of per-job energy in kWh aligned with df.index"""
+    energy = pd.Series(np.nan, index=df.index, dtype=float)
+    jobs = list(_job_windows(df, window_seconds))
+
+    # One query per (aligned window, node) no matter how many jobs share it
+    requests = set()
+    for _, _, start, end, nodes in jobs:
+        first = int(start // window_seconds) * window_seconds
+        for window_start in range(first, int(end) + 1, window_seconds):
+            for node in nodes:
+                requests.add((window_start, node))
+
+    def fetch(request):
+        window_start, node = request
+        try:
+            return request, client.query_range(_node_selector(metric, node), window_start,
+                                               window_start + window_seconds, step)
+        except Exception as e:
+            return request, e
+
+    # (job id, node) -> list of (timestamps, watts) chunks from every window
+    samples = {}
+    failed = set()
+    errors = []
+    with ThreadPoolExecutor(max_workers=max_parallel) as pool:
+        for (window_start, node), result in pool.map(fetch, sorted(requests)):
+            if isinstance(result, Exception):
+                failed.add(node)
+                errors.append(result)
+                continue
+            for series in result:
+                job_id = series['metric'].get('job_id')
+                if not job_id or not series.get('values'):
+                    continue
+                values = np.asarray(series['values'], dtype=float)
+                samples.setdefault((job_id, node), []).append(values)
+
+    # One line for the run instead of one per failed query
+    unavailable = getattr(client, 'unavailable', None)
+    if unavailable is not None:
+        print(f"Prometheus unavailable ({unavailable}); no power data for {len(errors)} of "
+              f"{len(requests)} node windows")
+    elif errors:
+        print(f"Error querying power for {len(errors)} of {len(requests)} node windows: {errors[-1]}")
+
+    for index, job_id, start, end, nodes in jobs:
+        if failed.intersection(nodes):
+            continue
+        joules = 0.0
+        for node in nodes:
+            chunks = samples.get((job_id, node))
+            if not chunks:
+                continue
+            values = np.concatenate(chunks)
+            # Windows share their boundary sample; keep unique, ordered timestamps
+            timestamps, unique_positions = np.unique(values[:, 0], return_index=True)
+            watts = values[unique_positions, 1]
+            inside = (timestamps >= start) & (timestamps <= end)
+            if inside.sum() >= 2:
+                joules += _trapezoid(watts[inside], timestamps[inside])
+            elif inside.sum() == 1:
+                joules += watts[inside][0] * (end - start)
+        energy[index] = joules / JOULES_PER_KWH
+
+    return energy
+
+def _max_over_windows(client, metric, start, end, window_seconds):
+    """{series labels: value} of max_over_time over [start, end], one instant query per window"""
+    values = {}
+    window_start = start
+    while window_start < end:
+        window_end = min(window_start + window_seconds, end)
+        result = client.query(f"max_over_time({metric}[{int(window_end - window_start)}s])", time=window_end)
+        for series in result:
+            key = tuple(sorted(series['metric'].items()))
+            values[key] = max(values.get(key, float('-inf')), float(series['value'][1]))
+        window_start = window_end
+    return values
+
+def fetch_checkpoint_energy(client, start, end, window_seconds=CHECKPOINT_WINDOW_SECONDS):
+    """Return {job id: kWh} for jobs measured exclusively between prolog and epilog
+
+    Queried a window at a time so a month never becomes one instant query over
+    every job series in the TSDB.
+    """
+    end += CHECKPOINT_LAG_SECONDS
+    energy = _max_over_windows(client, CHECKPOINT_METRIC, start, end, window_seconds)
+    concurrency = _max_over_windows(client, CHECKPOINT_CONCURRENCY_METRIC, start, end, window_seconds)
+
+    # Node counters cover every job on the node, so shared nodes fall back to the series
+    shared = {dict(labels).get('job_id') for labels, value in concurrency.items() if value > 1}
+    joules = {}
+    for labels, value in energy.items():
+        job_id = dict(labels).get('job_id')
+        if job_id and job_id not in shared:
+            joules[job_id] = joules.get(job_id, 0.0) + value
+    return {job_id: value / JOULES_PER_KWH for job_id, value in joules.items()}
+
+def add_energy_columns(df, client, kwh_rate, **kwargs):
+    """Add EnergyKWh and EnergyCost columns to a job frame"""
+    if df is None or df.empty:
+        return df
+    try:
+        df['EnergyKWh'] = compute_job_energy(df, client, **kwargs)
+    except Exception as e:
+        print(f"Error computing job energy: {e}")
+        df['EnergyKWh'] = np.nan
+
+    # Prefer exact checkpoint energy where the collector recorded it
+    try:
+        end = pd.to_datetime(df['End'], errors='coerce')
+        start = pd.to_datetime(df['Start'], errors='coerce')
+        # Not worth another timeout once the range queries found Prometheus down
+        if end.notna().any() and getattr(client, 'unavailable', None) is None:
+            checkpoints = fetch_checkpoint_energy(client, start.min().to_pydatetime().timestamp(),
+                                                  end.max().to_pydatetime().timestamp())
+            job_ids = (df['JobIDRaw'] if 'JobIDRaw' in df.columns else df['JobID']).astype(str)
+            df['EnergyKWh'] = job_ids.map(checkpoints).fillna(df['EnergyKWh'])
+    except Exception as e:
+        print(f"Error reading job energy checkpoints: {e}")
+    df['EnergyCost'] = df['EnergyKWh'] * kwh_rate
+    return df
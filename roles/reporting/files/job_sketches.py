@@ -0,0 +1,260 @@
+#!/usr/bin/env python3
+# Streaming Quantile Sketches for SLURM Job Distributions
+# Keeps mergeable t-digest sketches of queue wait and runtime per partition,
+# account and day so longer reports can compute percentiles without sacct
+
+import os
+import sys
+import json
+import math
+import argparse
+from datetime import datetime, timedelta
+
+# Configuration
+SKETCH_DIR = "/opt/reporting/sketches"
+SKETCH_VERSION = 1
+DEFAULT_COMPRESSION = 100
+DEFAULT_QUANTILES = (0.5, 0.9, 0.99)
+METRICS = ("wait", "runtime")
+
+
+class TDigest:
+    """Merging t-digest with a bounded number of centroids"""
+
+    def __init__(self, compression=DEFAULT_COMPRESSION):
+        self.compression = compression
+        self.count = 0
+        self.min = math.inf
+        self.max = -math.inf
+        self._means = []
+        self._weights = []
+        self._buffer = []
+        # Unmerged points are capped so memory stays O(compression)
+        self._buffer_limit = 5 * compression
+
+    def add(self, value, weight=1):
+        """Add a single observation to the sketch"""
+        if value is None or math.isnan(value):
+            return
+        self._buffer.append((float(value), float(weight)))
+        self.count += weight
+        self.min = min(self.min, value)
+        self.max = max(self.max, value)
+        if len(self._buffer) >= self._buffer_limit:
+            self._compress()
+
+    def merge(self, other):
+        """Merge another sketch into this one"""
+        if other.count == 0:
+            return self
+        other._compress()
+        self._buffer.extend(zip(other._means, other._weights))
+        self.count += other.count
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+        self._compress()
+        return self
+
+    def _k(self, q):
+        return self.compression / (2 * math.pi) * math.asin(2 * q - 1)
+
+    def _q(self, k):
+        return (math.sin(k * 2 * math.pi / self.compression) + 1) / 2
+
+    def _compress(self):
+        if not self._buffer:
+            return
+
+        items = sorted(list(zip(self._means, self._weights)) + self._buffer)
+        self._buffer = []
+        total = sum(w for _, w in items)
+
+        means = []
+        weights = []
+        cur_mean, cur_weight = items[0]
+        weight_so_far = 0.0
+        q_limit = self._q(self._k(0) + 1)
+
+        for mean, weight in items[1:]:
+            if (weight_so_far + cur_weight + weight) / total <= q_limit:
+                # Merge into the current centroid (weighted mean)
+                cur_weight += weight
+                cur_mean += (mean - cur_mean) * weight / cur_weight
+            else:
+                weight_so_far += cur_weight
+                means.append(cur_mean)
+                weights.append(cur_weight)
+                q_limit = self._q(self._k(weight_so_far / total) + 1)
+                cur_mean, cur_weight = mean, weight
+
+        means.append(cur_mean)
+        weights.append(cur_weight)
+        self._means = means
+        self._weights = weights
+
+    def quantile(self, q):
+        """Estimate the value at quantile q (0 <= q <= 1)"""
+        self._compress()
+        if not self._means:
+            return None
+        if len(self._means) == 1 or q <= 0:
+            return self.min if q <= 0 else self._means[0]
+        if q >= 1:
+            return self.max
+
+        target = q * self.count
+        cumulative = 0.0
+        for i, (mean, weight) in enumerate(zip(self._means, self._weights)):
+            center = cumulative + weight / 2
+            if target < center:
+                if i == 0:
+                    # Interpolate between the minimum and the first centroid
+                    left, left_pos = self.min, 0.0
+                else:
+                    prev_weight = self._weights[i - 1]
+                    left, left_pos = self._means[i - 1], cumulative - prev_weight / 2
+                span = center - left_pos
+                frac = (target - left_pos) / span if span > 0 else 0
+                return left + frac * (mean - left)
+            cumulative += weight
+
+        # Between the last centroid and the maximum
+        last_center = self.count - self._weights[-1] / 2
+        span = self.count - last_center
+        frac = (target - last_center) / span if span > 0 else 0
+        return self._means[-1] + frac * (self.max - self._means[-1])
+
+    def to_dict(self):
+        """Serialize the sketch to a JSON-friendly dict"""
+        self._compress()
+        return {
+            'c': self.compression,
+            'n': self.count,
+            'min': self.min if self.count else None,
+            'max': self.max if self.count else None,
+            'm': [round(m, 3) for m in self._means],
+            'w': self._weights,
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        """Rebuild a sketch from to_dict() output"""
+        digest = cls(data.get('c', DEFAULT_COMPRESSION))
+        digest.count = data.get('n', 0)
+        if digest.count:
+            digest.min = data['min']
+            digest.max = data['max']
+        digest._means = list(data.get('m', []))
+        digest._weights = list(data.get('w', []))
+        return digest
+
+
+def sketch_key(metric, partition, account):
+    """Build the storage key for a (metric, partition, account) sketch"""
+    return f"{metric}|{partition}|{account}"
+
+
+def split_key(key):
+    """Split a storage key back into (metric, partition, account)"""
+    metric, partition, account = key.split('|', 2)
+    return metric, partition, account
+
+
+def build_daily_sketches(observations, compression=DEFAULT_COMPRESSION):
+    """Build sketches from (metric, partition, account, seconds) tuples"""
+    sketches = {}
+    for metric, partition, account, value in observations:
+        key = sketch_key(metric, partition or 'unknown', account or 'unknown')
+        if key not in sketches:
+            sketches[key] = TDigest(compression)
+        sketches[key].add(value)
+    return sketches
+
+
+def sketch_path(sketch_dir, day):
+    """Return the path of the sketch file for a given day"""
+    return os.path.join(sketch_dir, f"sketches_{day}.json")
+
+
+def save_daily_sketches(sketch_dir, day, sketches):
+    """Persist the sketches for one day, replacing any previous run"""
+    os.makedirs(sketch_dir, exist_ok=True)
+    payload = {
+        'version': SKETCH_VERSION,
+        'date': day,
+        'sketches': {key: digest.to_dict() for key, digest in sketches.items()},
+    }
+    path = sketch_path(sketch_dir, day)
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump(payload, f, separators=(',', ':'))
+    os.replace(tmp_path, path)
+    return path
+
+
+def load_sketches(sketch_dir, start_date, end_date):
+    """Merge all daily sketches between start_date and end_date (inclusive)"""
+    merged = {}
+    day = start_date
+    while day <= end_date:
+        path = sketch_path(sketch_dir, day.strftime("%Y-%m-%d"))
+        if os.path.exists(path):
+            with open(path, 'r') as f:
+                payload = json.load(f)
+            if payload.get('version') == SKETCH_VERSION:
+                for key, data in payload['sketches'].items():
+                    digest = TDigest.from_dict(data)
+                    if key in merged:
+                        merged[key].merge(digest)
+                    else:
+                        merged[key] = digest
+        day += timedelta(days=1)
+    return merged
+
+
+def summarize_sketches(sketches, by='partition', quantiles=DEFAULT_QUANTILES):
+    """Merge sketches along one dimension and return percentile rows"""
+    grouped = {}
+    for key, digest in sketches.items():
+        metric, partition, account = split_key(key)
+        group = partition if by == 'partition' else account if by == 'account' else 'all'
+        target = grouped.setdefault((group, metric), TDigest(digest.compression))
+        target.merge(digest)
+
+    rows = []
+    for group in sorted({g for g, _ in grouped}):
+        row = {by.capitalize(): group}
+        for metric in METRICS:
+            digest = grouped.get((group, metric))
+            if metric == 'wait':
+                row['Jobs'] = int(digest.count) if digest else 0
+            for q in quantiles:
+                label = f"{metric.capitalize()} p{int(q * 100)} (min)"
+                value = digest.quantile(q) if digest else None
+                row[label] = round(value / 60, 1) if value is not None else None
+        rows.append(row)
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Query queue wait and runtime percentiles from daily sketches")
+    parser.add_argument('--start', required=True, help="First day (YYYY-MM-DD)")
+    parser.add_argument('--end', required=True, help="Last day (YYYY-MM-DD)")
+    parser.add_argument('--by', choices=['partition', 'account', 'all'], default='partition')
+    parser.add_argument('--sketch-dir', default=SKETCH_DIR)
+    args = parser.parse_args()
+
+    start_date = datetime.strptime(args.start, "%Y-%m-%d")
+    end_date = datetime.strptime(args.end, "%Y-%m-%d")
+    sketches = load_sketches(args.sketch_dir, start_date, end_date)
+
+    if not sketches:
+        print(f"No sketches found in {args.sketch_dir} for {args.start} to {args.end}")
+        sys.exit(1)
+
+    for row in summarize_sketches(sketches, by=args.by):
+        print(json.dumps(row))
+
+
+if __name__ == "__main__":
+    main()
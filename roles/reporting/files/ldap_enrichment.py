@@ -0,0 +1,198 @@
+#!/usr/bin/env python3
+# LDAP Enrichment for SLURM Reports
+# Resolves the distinct users of a report frame to display name, department
+# and cost centre with a few batched LDAP queries and an on-disk TTL cache
+
+import os
+import json
+import time
+
+# Configuration
+CACHE_FILE = "/opt/reporting/cache/ldap_users.json"
+CACHE_VERSION = 1
+CACHE_TTL_SECONDS = 24 * 3600
+BATCH_SIZE = 50  # uids per (|(uid=...)(uid=...)) filter
+
+# Report column -> LDAP attributes tried in order
+USER_ATTRIBUTES = {
+    'DisplayName': ['displayName', 'cn'],
+    'Department': ['departmentNumber', 'ou'],
+    'CostCentre': ['businessCategory', 'employeeType'],
+}
+
+try:
+    import ldap3
+except ImportError:
+    ldap3 = None
+
+def escape_filter_value(value):
+    """Escape a value for use inside an LDAP search filter (RFC 4515)"""
+    replacements = {'\\': r'\5c', '*': r'\2a', '(': r'\28', ')': r'\29', '\0': r'\00'}
+    return ''.join(replacements.get(ch, ch) for ch in str(value))
+
+def _first(value):
+    if isinstance(value, (list, tuple)):
+        return str(value[0]) if value else None
+    return str(value) if value not in (None, '') else None
+
+def _batches(items, size):
+    for i in range(0, len(items), size):
+        yield items[i:i + size]
+
+class LdapDirectory:
+    """Batched user lookups over a single reused LDAP connection"""
+
+    def __init__(self, uri, base_dn, bind_dn=None, bind_password=None, user_ou='People',
+                 group_ou='Groups', batch_size=BATCH_SIZE, connection_factory=None):
+        self.uri = uri
+        self.base_dn = base_dn
+        self.bind_dn = bind_dn
+        self.bind_password = bind_password
+        self.user_base = f"ou={user_ou},{base_dn}"
+        self.group_base = f"ou={group_ou},{base_dn}"
+        self.batch_size = batch_size
+        self._connection_factory = connection_factory or self._ldap3_connection
+        self._connection = None
+        self.queries = 0
+
+    def _ldap3_connection(self):
+        if ldap3 is None:
+            raise RuntimeError("ldap3 is not installed")
+        server = ldap3.Server(self.uri, connect_timeout=5)
+        return ldap3.Connection(server, user=self.bind_dn, password=self.bind_password,
+                                auto_bind=True, read_only=True, receive_timeout=30)
+
+    @property
+    def connection(self):
+        if self._connection is None:
+            self._connection = self._connection_factory()
+        return self._connection
+
+    def close(self):
+        if self._connection is not None:
+            try:
+                self._connection.unbind()
+            except Exception:
+                pass
+            self._connection = None
+
+    def _search(self, base, search_filter, attributes):
+        self.queries += 1
+        self.connection.search(base, search_filter, attributes=attributes)
+        return [entry for entry in self.connection.response or [] if entry.get('type', 'searchResEntry') == 'searchResEntry']
+
+    def lookup_users(self, uids):
+        """Return {uid: {column: value}} for the given uids (missing users are omitted)"""
+        attributes = sorted({'uid'} | {attr for attrs in USER_ATTRIBUTES.values() for attr in attrs})
+        found = {}
+        for batch in _batches(sorted(set(uids)), self.batch_size):
+            search_filter = '(|' + ''.join(f"(uid={escape_filter_value(uid)})" for uid in batch) + ')'
+            for entry in self._search(self.user_base, search_filter, attributes):
+                attrs = entry.get('attributes', {})
+                uid = _first(attrs.get('uid'))
+                if uid is None:
+                    continue
+                record = {'dn': entry.get('dn')}
+                for column, candidates in USER_ATTRIBUTES.items():
+                    record[column] = next((_first(attrs.get(a)) for a in candidates if _first(attrs.get(a))), None)
+                found[uid] = record
+
+        # Research groups (groupOfNames) stand in for a missing department
+        missing_department = [uid for uid, record in found.items() if not record['Department'] and record['dn']]
+        by_dn = {found[uid]['dn'].lower(): uid for uid in missing_department}
+        for batch in _batches(missing_department, self.batch_size):
+            search_filter = '(|' + ''.join(f"(member={escape_filter_value(found[uid]['dn'])})" for uid in batch) + ')'
+            for entry in self._search(self.group_base, search_filter, ['cn', 'description', 'member']):
+                attrs = entry.get('attributes', {})
+                group_name = _first(attrs.get('description')) or _first(attrs.get('cn'))
+                members = attrs.get('member') or []
+                for member in members if isinstance(members, (list, tuple)) else [members]:
+                    uid = by_dn.get(str(member).lower())
+                    if uid and not found[uid]['Department']:
+                        found[uid]['Department'] = group_name
+
+        for record in found.values():
+            record.pop('dn', None)
+        return found
+
+class UserAttributeCache:
+    """JSON file cache of user attributes with a per-entry TTL"""
+
+    def __init__(self, path=CACHE_FILE, ttl=CACHE_TTL_SECONDS):
+        self.path = path
+        self.ttl = ttl
+        self.entries = {}
+        self._dirty = False
+        try:
+            with open(path, 'r') as f:
+                payload = json.load(f)
+            if payload.get('version') == CACHE_VERSION:
+                self.entries = payload.get('entries', {})
+        except (OSError, ValueError):
+            pass
+
+    def get_fresh(self, uids, now=None):
+        """Split uids into ({uid: attrs} still fresh, [uids to fetch])"""
+        now = now or time.time()
+        fresh, stale = {}, []
+        for uid in uids:
+            entry = self.entries.get(uid)
+            if entry and now - entry['fetched'] < self.ttl:
+                fresh[uid] = entry['attrs']
+            else:
+                stale.append(uid)
+        return fresh, stale
+
+    def get_any(self, uid):
+        entry = self.entries.get(uid)
+        return entry['attrs'] if entry else None
+
+    def update(self, uid, attrs, now=None):
+        # attrs is None for users the directory does not know (negative cache)
+        self.entries[uid] = {'fetched': now or time.time(), 'attrs': attrs}
+        self._dirty = True
+
+    def save(self):
+        if not self._dirty:
+            return
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        tmp_path = f"{self.path}.{os.getpid()}.tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump({'version': CACHE_VERSION, 'entries': self.entries}, f)
+        os.replace(tmp_path, self.path)
+        self._dirty = False
+
+def resolve_users(uids, directory, cache):
+    """Resolve uids through the cache, querying the directory only for stale entries"""
+    uids = sorted({str(uid) for uid in uids if uid})
+    resolved, stale = cache.get_fresh(uids)
+    if stale:
+        try:
+            found = directory.lookup_users(stale)
+        except Exception as e:
+            # Directory unavailable: fall back to whatever the cache still has
+            print(f"Error querying LDAP, using cached user attributes: {e}")
+            for uid in stale:
+                resolved[uid] = cache.get_any(uid)
+        else:
+            for uid in stale:
+                cache.update(uid, found.get(uid))
+                resolved[uid] = found.get(uid)
+        finally:
+            directory.close()
+        cache.save()
+    return resolved
+
+def enrich_frame(df, directory, cache, user_column='User'):
+    """Add DisplayName, Department and CostCentre columns keyed on the user column"""
+    if df is None or df.empty:
+        return df
+
+    resolved = resolve_users(df[user_column].unique(), directory, cache)
+    for column in USER_ATTRIBUTES:
+        mapping = {uid: (attrs or {}).get(column) for uid, attrs in resolved.items()}
+        df[column] = df[user_column].map(mapping)
+    df['DisplayName'] = df['DisplayName'].fillna(df[user_column])
+    df['Department'] = df['Department'].fillna('Unknown')
+    df['CostCentre'] = df['CostCentre'].fillna('Unassigned')
+    return df
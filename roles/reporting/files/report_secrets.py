@@ -0,0 +1,23 @@
+#!/usr/bin/env python3
+# Report Secrets
+# Credentials for the reporting scripts live in owner-only files under
+# /opt/reporting/secrets rather than in the world-readable scripts
+
+import os
+import stat
+
+# Configuration
+SECRET_DIR = "/opt/reporting/secrets"
+
+def read_secret(name, secret_dir=SECRET_DIR):
+    """Contents of a secret file without the trailing newline, or None if it is missing or empty"""
+    path = os.path.join(secret_dir, name)
+    try:
+        with open(path) as f:
+            mode = os.fstat(f.fileno()).st_mode
+            value = f.read().rstrip('\n')
+    except FileNotFoundError:
+        return None
+    if mode & (stat.S_IRWXG | stat.S_IRWXO):
+        print(f"Warning: {path} is readable by other users; it should be mode 0600")
+    return value or None
@@ -0,0 +1,276 @@
+#!/usr/bin/env python3
+# Report Run Telemetry
+# Times each stage of a report run (wall, CPU, peak traced memory, rows),
+# optionally profiles it, and records every run as a JSON line and as
+# node_exporter textfile metrics
+#
+# Example:
+#   with RunTelemetry('daily_usage', profile=args.profile) as telemetry:
+#       with telemetry.stage('fetch') as stage:
+#           data = get_slurm_accounting_data()
+#       with telemetry.stage('parse') as stage:
+#           df = process_slurm_data(data)
+#           stage.rows = len(df)
+#       with telemetry.stage('send') as stage:
+#           if not send_email_report(report_path, plots):
+#               stage.fail('email not sent')
+
+import os
+import io
+import json
+import time
+import socket
+import pstats
+import cProfile
+import tracemalloc
+from datetime import datetime
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+try:
+    import pyinstrument
+except ImportError:
+    pyinstrument = None
+
+# Configuration
+TELEMETRY_LOG = "/opt/reporting/state/report_telemetry.jsonl"
+TELEMETRY_LOG_MAX_BYTES = 10 * 1024 * 1024  # Rotated to <log>.1 past this size
+TEXTFILE_DIR = "/var/lib/node_exporter/textfile_collector"
+PROFILE_DIR = "/opt/reporting/output/profiles"
+PROFILERS = ('cprofile', 'pyinstrument')
+PROFILE_TOP_FUNCTIONS = 40
+# Exit status of a run that found nothing to report: a quiet period, not a failure
+EXIT_NO_DATA = 3
+
+def add_profile_argument(parser):
+    """Add the shared --profile option to a report's argument parser"""
+    parser.add_argument('--profile', nargs='?', const='cprofile', choices=PROFILERS, default=None,
+                        help=f"Profile each stage and write the output to {PROFILE_DIR}")
+    return parser
+
+class Stage:
+    """Measurements of one named stage; repeated stages accumulate"""
+
+    def __init__(self, name):
+        self.name = name
+        self.wall_seconds = 0.0
+        self.cpu_seconds = 0.0
+        self.peak_memory_bytes = 0
+        self.rows = None
+        self.calls = 0
+        self.error = None
+
+    def fail(self, error):
+        """Mark the stage, and so the run, as failed without raising"""
+        self.error = str(error)
+
+    def as_dict(self):
+        return {
+            'stage': self.name,
+            'wall_seconds': round(self.wall_seconds, 6),
+            'cpu_seconds': round(self.cpu_seconds, 6),
+            'peak_memory_bytes': self.peak_memory_bytes,
+            'rows': self.rows,
+            'calls': self.calls,
+            'error': self.error,
+        }
+
+class _StageTimer:
+    def __init__(self, telemetry, stage):
+        self.telemetry = telemetry
+        self.stage = stage
+
+    def __enter__(self):
+        telemetry = self.telemetry
+        if telemetry.active_stage is not None:
+            raise RuntimeError(f"stage {self.stage.name} started inside {telemetry.active_stage}")
+        telemetry.active_stage = self.stage.name
+        if telemetry.trace_memory:
+            tracemalloc.reset_peak()
+        self.profiler = telemetry._start_profiler()
+        self.wall = time.perf_counter()
+        self.cpu = time.process_time()
+        return self.stage
+
+    def __exit__(self, exc_type, exc, tb):
+        stage = self.stage
+        stage.wall_seconds += time.perf_counter() - self.wall
+        stage.cpu_seconds += time.process_time() - self.cpu
+        stage.calls += 1
+        self.telemetry._stop_profiler(self.profiler, stage)
+        if (exc_type is not None or stage.error is not None) and self.telemetry.failed_stage is None:
+            self.telemetry.failed_stage = stage.name
+        if self.telemetry.trace_memory:
+            stage.peak_memory_bytes = max(stage.peak_memory_bytes, tracemalloc.get_traced_memory()[1])
+        self.telemetry.active_stage = None
+        return False
+
+class RunTelemetry:
+    """Per-stage measurements of one report run, written out when the run ends"""
+
+    def __init__(self, report, profile=None, telemetry_log=TELEMETRY_LOG, textfile_dir=TEXTFILE_DIR,
+                 profile_dir=PROFILE_DIR, trace_memory=True, log_max_bytes=TELEMETRY_LOG_MAX_BYTES):
+        if profile not in (None,) + PROFILERS:
+            raise ValueError(f"Unknown profiler: {profile}")
+        if profile == 'pyinstrument' and pyinstrument is None:
+            print("pyinstrument is not installed, profiling with cProfile")
+            profile = 'cprofile'
+        self.report = report
+        self.profile = profile
+        self.telemetry_log = telemetry_log
+        self.textfile_dir = textfile_dir
+        self.profile_dir = profile_dir
+        self.trace_memory = trace_memory
+        self.log_max_bytes = log_max_bytes
+        self.stages = {}
+        self.active_stage = None
+        self.run_id = datetime.now().strftime('%Y%m%dT%H%M%S')
+        self.record = None
+        self.started_tracing = False
+        self.failed_stage = None
+
+    def __enter__(self):
+        self.started = time.time()
+        self.wall = time.perf_counter()
+        self.cpu = time.process_time()
+        if self.trace_memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+            self.started_tracing = True
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if self.failed_stage is not None and exc_type is None:
+            # A stage called fail(): the run went on, but did not do its job
+            status = 'failed'
+        elif exc_type is None or (exc_type is SystemExit and exc.code in (None, 0)):
+            status = 'success'
+        elif exc_type is SystemExit and exc.code == EXIT_NO_DATA:
+            status = 'no_data'
+        else:
+            status = 'failed'
+        self.finish(status)
+        return False
+
+    def stage(self, name):
+        """Context manager timing one stage; set .rows on the yielded Stage to record a row count"""
+        stage = self.stages.setdefault(name, Stage(name))
+        return _StageTimer(self, stage)
+
+    def _start_profiler(self):
+        if self.profile == 'pyinstrument':
+            profiler = pyinstrument.Profiler()
+            profiler.start()
+        elif self.profile == 'cprofile':
+            profiler = cProfile.Profile()
+            profiler.enable()
+        else:
+            profiler = None
+        return profiler
+
+    def _stop_profiler(self, profiler, stage):
+        if profiler is None:
+            return
+        try:
+            os.makedirs(self.profile_dir, exist_ok=True)
+            base = os.path.join(self.profile_dir, f"{self.report}-{self.run_id}-{stage.name}-{stage.calls}")
+            if self.profile == 'pyinstrument':
+                profiler.stop()
+                with open(base + '.txt', 'w') as f:
+                    f.write(profiler.output_text(unicode=False, color=False))
+            else:
+                profiler.disable()
+                profiler.dump_stats(base + '.prof')
+                summary = io.StringIO()
+                pstats.Stats(profiler, stream=summary).sort_stats('cumulative').print_stats(PROFILE_TOP_FUNCTIONS)
+                with open(base + '.txt', 'w') as f:
+                    f.write(summary.getvalue())
+        except Exception as e:
+            print(f"Error writing profile for stage {stage.name}: {e}")
+
+    def finish(self, status='success'):
+        """Build the run record, then append it to the log and write the textfile metrics"""
+        if self.started_tracing:
+            tracemalloc.stop()
+            self.started_tracing = False
+        max_rss = None
+        if resource is not None:
+            # ru_maxrss is in kilobytes on Linux
+            max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+        self.record = {
+            'report': self.report,
+            'run_id': self.run_id,
+            'host': socket.gethostname(),
+            'started_at': datetime.fromtimestamp(self.started).isoformat(timespec='seconds'),
+            'status': status,
+            'failed_stage': self.failed_stage if status == 'failed' else None,
+            'wall_seconds': round(time.perf_counter() - self.wall, 6),
+            'cpu_seconds': round(time.process_time() - self.cpu, 6),
+            'peak_memory_bytes': max((s.peak_memory_bytes for s in self.stages.values()), default=0),
+            'max_rss_bytes': max_rss,
+            'profile': self.profile,
+            'stages': [stage.as_dict() for stage in self.stages.values()],
+        }
+        self._append_log()
+        self._write_textfile()
+        return self.record
+
+    def _append_log(self):
+        try:
+            os.makedirs(os.path.dirname(self.telemetry_log), exist_ok=True)
+            # Frequent runs (the inefficiency watcher) would grow the log without bound
+            if os.path.exists(self.telemetry_log) and os.path.getsize(self.telemetry_log) >= self.log_max_bytes:
+                os.replace(self.telemetry_log, self.telemetry_log + '.1')
+            with open(self.telemetry_log, 'a') as f:
+                f.write(json.dumps(self.record) + '\n')
+        except Exception as e:
+            print(f"Error writing run telemetry: {e}")
+
+    def render_metrics(self):
+        """Prometheus text exposition of the finished run"""
+        record = self.record
+        report = _escape(self.report)
+        lines = []
+        for name, description, value in [
+            ('slurm_report_last_run_timestamp_seconds', 'Start time of the last report run', self.started),
+            ('slurm_report_success', 'Whether the last report run succeeded',
+             int(record['status'] in ('success', 'no_data'))),
+            ('slurm_report_no_data', 'Whether the last report run found no jobs in its period',
+             int(record['status'] == 'no_data')),
+            ('slurm_report_duration_seconds', 'Wall time of the last report run', record['wall_seconds']),
+            ('slurm_report_cpu_seconds', 'CPU time of the last report run', record['cpu_seconds']),
+            ('slurm_report_peak_memory_bytes', 'Peak traced Python memory of the last report run',
+             record['peak_memory_bytes']),
+        ]:
+            lines += [f"# HELP {name} {description}", f"# TYPE {name} gauge",
+                      f'{name}{{report="{report}"}} {value}']
+
+        for name, description, key in [
+            ('slurm_report_stage_duration_seconds', 'Wall time per report stage', 'wall_seconds'),
+            ('slurm_report_stage_cpu_seconds', 'CPU time per report stage', 'cpu_seconds'),
+            ('slurm_report_stage_peak_memory_bytes', 'Peak traced Python memory per report stage',
+             'peak_memory_bytes'),
+            ('slurm_report_stage_rows', 'Rows handled per report stage', 'rows'),
+        ]:
+            lines += [f"# HELP {name} {description}", f"# TYPE {name} gauge"]
+            for stage in record['stages']:
+                if stage[key] is not None:
+                    lines.append(f'{name}{{report="{report}",stage="{_escape(stage["stage"])}"}} {stage[key]}')
+        return '\n'.join(lines) + '\n'
+
+    def _write_textfile(self):
+        if not self.textfile_dir or not os.path.isdir(self.textfile_dir):
+            return
+        path = os.path.join(self.textfile_dir, f"slurm_report_{self.report}.prom")
+        try:
+            tmp_path = path + '.tmp'
+            with open(tmp_path, 'w') as f:
+                f.write(self.render_metrics())
+            os.replace(tmp_path, path)
+        except Exception as e:
+            print(f"Error writing report metrics: {e}")
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
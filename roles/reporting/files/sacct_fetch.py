@@ -0,0 +1,67 @@
+#!/usr/bin/env python3
+# Multi-Cluster Accounting Fetch
+# Runs one sacct per cluster against the shared slurmdbd concurrently and
+# merges the parsable2 output under a leading Cluster field, so a federated
+# report waits only as long as its slowest cluster
+
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+
+CLUSTER_FIELD = 'Cluster'
+
+class ClusterFetchError(RuntimeError):
+    """sacct failed for one or more clusters; a partial result would under-bill them"""
+
+    def __init__(self, errors):
+        self.errors = errors  # {cluster: error}
+        super().__init__("sacct failed for cluster(s) " +
+                         ', '.join(f"{cluster} ({error})" for cluster, error in errors.items()))
+
+def sacct_command(fields, start, end, cluster=None, extra_args=()):
+    """sacct invocation for one cluster (no -M: the local cluster)"""
+    cmd = ["sacct", "-a"]
+    if cluster:
+        cmd += ["-M", cluster]
+    cmd += list(extra_args) + [f"--format={fields}", "-S", start, "-E", end, "--parsable2"]
+    return cmd
+
+def run_sacct(cmd):
+    result = subprocess.run(cmd, capture_output=True, text=True, check=True)
+    return result.stdout
+
+def merge_sacct_output(outputs):
+    """Join {cluster: parsable2 text} into one parsable2 text with a Cluster column"""
+    header, rows = None, []
+    for cluster, data in outputs.items():
+        if not data or not data.strip():
+            continue
+        lines = data.strip().split('\n')
+        if header is None:
+            header = lines[0]
+        elif lines[0] != header:
+            raise ValueError(f"sacct fields for cluster {cluster} differ: {lines[0]}")
+        rows += [f"{cluster}|{line}" for line in lines[1:] if line.strip()]
+    if header is None:
+        return None
+    return '\n'.join([f"{CLUSTER_FIELD}|{header}"] + rows) + '\n'
+
+def fetch_accounting_data(fields, start, end, clusters=None, local_cluster='local', extra_args=(),
+                          runner=run_sacct):
+    """Fetch every cluster concurrently; raises ClusterFetchError if any cluster fails"""
+    clusters = list(clusters or [])
+
+    def fetch(cluster):
+        try:
+            return runner(sacct_command(fields, start, end, cluster, extra_args)), None
+        except (subprocess.CalledProcessError, OSError) as e:
+            print(f"Error retrieving SLURM data for cluster {cluster or local_cluster}: {e}")
+            return None, e
+
+    targets = clusters or [None]
+    with ThreadPoolExecutor(max_workers=len(targets)) as pool:
+        results = list(pool.map(fetch, targets))
+    names = [cluster or local_cluster for cluster in targets]
+    errors = {name: error for name, (_, error) in zip(names, results) if error is not None}
+    if errors:
+        raise ClusterFetchError(errors)
+    return merge_sacct_output({name: data for name, (data, _) in zip(names, results)})
@@ -0,0 +1,316 @@
+#!/usr/bin/env python3
+"""
+SLURM Usage Query Service
+Read-only HTTP/JSON API answering ad-hoc usage and cost questions per user,
+account and partition from the daily rollups written by the daily usage report
+"""
+
+import argparse
+import bisect
+import json
+import logging
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+from datetime import date
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+logger = logging.getLogger('usage_query_service')
+
+# Configuration
+LISTEN_ADDRESS = '127.0.0.1'  # No authentication: bind to loopback or the reporting VLAN only
+LISTEN_PORT = 9310
+ROLLUP_DIR = '/opt/reporting/rollups'
+REFRESH_SECONDS = 60  # How often the rollup directory is checked for new days
+CACHE_SIZE = 1024  # Query results kept between rollup changes
+
+# Must match job_costing.ROLLUP_DIMENSIONS and ROLLUP_METRICS
+DIMENSIONS = ('cluster', 'user', 'account', 'partition')
+METRICS = ('jobs', 'cpu_hours', 'gpu_hours', 'mem_gb_hours',
+           'cpu_cost', 'gpu_cost', 'mem_cost', 'total_cost')
+QUERY_OPTIONS = ('start', 'end', 'group_by', 'limit')  # Query string keys that are not filters
+ROLLUP_FILE = re.compile(r'^(\d{4}-\d{2}-\d{2})\.json$')
+
+class QueryError(ValueError):
+    """Invalid query parameters"""
+
+def _add_totals(target, totals):
+    for i, value in enumerate(totals):
+        target[i] += value
+
+def _as_dict(totals):
+    result = {metric: round(value, 6) for metric, value in zip(METRICS, totals)}
+    result['jobs'] = int(result['jobs'])
+    return result
+
+class DaySummary:
+    """One day's rollup rows with the day total and per-dimension totals pre-aggregated"""
+
+    def __init__(self, rows):
+        # (dimension values, metric values) pairs for queries the totals cannot answer
+        self.rows = [(row, [row[metric] for metric in METRICS]) for row in rows]
+        self.total = [0.0] * len(METRICS)
+        self.by_dimension = {dimension: {} for dimension in DIMENSIONS}
+        for row, values in self.rows:
+            _add_totals(self.total, values)
+            for dimension in DIMENSIONS:
+                totals = self.by_dimension[dimension].setdefault(row[dimension], [0.0] * len(METRICS))
+                _add_totals(totals, values)
+
+def load_rollup(path):
+    """Read a rollup file into normalized rows"""
+    with open(path) as f:
+        payload = json.load(f)
+    rows = []
+    for row in payload.get('rows', []):
+        normalized = {dimension: str(row.get(dimension) or '') for dimension in DIMENSIONS}
+        normalized.update({metric: float(row.get(metric) or 0) for metric in METRICS})
+        rows.append(normalized)
+    return rows
+
+class UsageIndex:
+    """In-memory index of the daily rollups, reloaded incrementally as files change"""
+
+    def __init__(self, rollup_dir=ROLLUP_DIR, cache_size=CACHE_SIZE):
+        self.rollup_dir = rollup_dir
+        self.cache_size = cache_size
+        self.lock = threading.Lock()
+        self.files = {}  # day -> (mtime_ns, size)
+        self.summaries = {}
+        self.days = []
+        self.generation = 0
+        self.loaded_at = None
+        self.cache = OrderedDict()
+        self.cache_hits = 0
+        self.cache_misses = 0
+
+    def refresh(self):
+        """Load new or changed rollup files and drop removed ones; returns True if anything changed"""
+        try:
+            names = os.listdir(self.rollup_dir)
+        except FileNotFoundError:
+            names = []
+
+        seen = {}
+        for name in names:
+            match = ROLLUP_FILE.match(name)
+            if not match:
+                continue
+            try:
+                st = os.stat(os.path.join(self.rollup_dir, name))
+            except FileNotFoundError:
+                continue
+            seen[match.group(1)] = (st.st_mtime_ns, st.st_size)
+
+        changed = {day: sig for day, sig in seen.items() if self.files.get(day) != sig}
+        removed = set(self.files) - set(seen)
+        if not changed and not removed:
+            return False
+
+        loaded = {}
+        for day, sig in changed.items():
+            try:
+                loaded[day] = DaySummary(load_rollup(os.path.join(self.rollup_dir, f"{day}.json")))
+            except (OSError, ValueError, TypeError) as e:
+                logger.warning(f"Skipping rollup for {day}: {e}")
+                seen.pop(day)
+
+        with self.lock:
+            for day in removed:
+                self.summaries.pop(day, None)
+            self.summaries.update(loaded)
+            self.files = seen
+            self.days = sorted(self.summaries)
+            self.generation += 1
+            self.loaded_at = time.time()
+            self.cache.clear()
+        logger.info(f"Loaded {len(loaded)} rollup day(s), dropped {len(removed)}; {len(self.days)} day(s) indexed")
+        return True
+
+    def query(self, start=None, end=None, group_by=None, limit=None, filters=None):
+        """Usage and cost totals over [start, end], optionally filtered by {dimension: value} and grouped"""
+        filters = filters or {}
+        start = _parse_day(start, 'start')
+        end = _parse_day(end, 'end')
+        if start and end and start > end:
+            raise QueryError('start is after end')
+        if group_by is not None and group_by not in DIMENSIONS:
+            raise QueryError(f"group_by must be one of {', '.join(DIMENSIONS)}")
+        unknown = set(filters) - set(DIMENSIONS)
+        if unknown:
+            raise QueryError(f"unknown filter: {', '.join(sorted(unknown))}")
+        filters = {key: value for key, value in filters.items() if value is not None}
+        if limit is not None:
+            try:
+                limit = int(limit)
+            except ValueError:
+                raise QueryError('limit must be an integer')
+
+        key = (start, end, group_by, limit, tuple(sorted(filters.items())))
+        with self.lock:
+            result = self.cache.get(key)
+            if result is not None:
+                self.cache.move_to_end(key)
+                self.cache_hits += 1
+                return result
+            self.cache_misses += 1
+            generation = self.generation
+            days = self.days[bisect.bisect_left(self.days, start) if start else 0:
+                             bisect.bisect_right(self.days, end) if end else len(self.days)]
+            summaries = [self.summaries[day] for day in days]
+
+        result = self._compute(summaries, group_by, limit, filters)
+        result.update({
+            'start': start or (days[0] if days else None),
+            'end': end or (days[-1] if days else None),
+            'days': len(days),
+            'filters': filters,
+            'group_by': group_by,
+        })
+
+        with self.lock:
+            # A refresh in between means the result may already be stale
+            if generation == self.generation:
+                self.cache[key] = result
+                if len(self.cache) > self.cache_size:
+                    self.cache.popitem(last=False)
+        return result
+
+    def _compute(self, summaries, group_by, limit, filters):
+        total = [0.0] * len(METRICS)
+        groups = {}
+
+        if len(filters) <= 1 and (not filters or group_by in (None, *filters)):
+            # Served from the pre-aggregated per-dimension totals
+            dimension, value = next(iter(filters.items()), (group_by, None))
+            for summary in summaries:
+                if dimension is None:
+                    _add_totals(total, summary.total)
+                    continue
+                per_key = summary.by_dimension[dimension]
+                if value is None:
+                    items = per_key.items()
+                else:
+                    items = [(value, per_key[value])] if value in per_key else []
+                for key, totals in items:
+                    _add_totals(total, totals)
+                    if group_by:
+                        _add_totals(groups.setdefault(key, [0.0] * len(METRICS)), totals)
+        else:
+            for summary in summaries:
+                for row, values in summary.rows:
+                    if any(row[dimension] != value for dimension, value in filters.items()):
+                        continue
+                    _add_totals(total, values)
+                    if group_by:
+                        _add_totals(groups.setdefault(row[group_by], [0.0] * len(METRICS)), values)
+
+        result = {'totals': _as_dict(total)}
+        if group_by:
+            ranked = sorted(groups.items(), key=lambda item: item[1][METRICS.index('total_cost')], reverse=True)
+            if limit is not None:
+                ranked = ranked[:limit]
+            result['groups'] = [{group_by: key, **_as_dict(totals)} for key, totals in ranked]
+        return result
+
+    def status(self):
+        with self.lock:
+            return {
+                'days': len(self.days),
+                'first_day': self.days[0] if self.days else None,
+                'last_day': self.days[-1] if self.days else None,
+                'generation': self.generation,
+                'loaded_at': self.loaded_at,
+                'cache_entries': len(self.cache),
+                'cache_hits': self.cache_hits,
+                'cache_misses': self.cache_misses,
+            }
+
+def _parse_day(value, name):
+    if value is None:
+        return None
+    try:
+        return date.fromisoformat(value).isoformat()
+    except ValueError:
+        raise QueryError(f"{name} must be a YYYY-MM-DD date")
+
+def refresh_loop(index, interval, stop_event):
+    """Pick up new daily rollups until stopped"""
+    while not stop_event.wait(interval):
+        try:
+            index.refresh()
+        except Exception as e:
+            logger.error(f"Rollup refresh failed: {e}")
+
+class UsageQueryHandler(BaseHTTPRequestHandler):
+    """GET /usage, /days and /health"""
+
+    def _reply(self, status, body, content_type='application/json'):
+        data = body.encode()
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self):
+        url = urlsplit(self.path)
+        index = self.server.index
+        if url.path == '/usage':
+            filters = {key: values[-1] for key, values in parse_qs(url.query).items()}
+            options = {key: filters.pop(key, None) for key in QUERY_OPTIONS}
+            try:
+                result = index.query(filters=filters, **options)
+            except QueryError as e:
+                return self._reply(400, json.dumps({'error': str(e)}))
+            self._reply(200, json.dumps(result))
+        elif url.path == '/days':
+            with index.lock:
+                days = list(index.days)
+            self._reply(200, json.dumps({'days': days}))
+        elif url.path == '/health':
+            self._reply(200, json.dumps(index.status()))
+        else:
+            self._reply(404, json.dumps({'error': 'not found'}))
+
+    def log_message(self, format, *args):
+        logger.debug(format % args)
+
+class UsageQueryServer(ThreadingHTTPServer):
+    daemon_threads = True
+    request_queue_size = 128
+
+def make_server(address=LISTEN_ADDRESS, port=LISTEN_PORT, index=None):
+    server = UsageQueryServer((address, port), UsageQueryHandler)
+    server.index = index or UsageIndex()
+    return server
+
+def main():
+    parser = argparse.ArgumentParser(description='Serve ad-hoc usage and cost queries from the daily rollups')
+    parser.add_argument('--address', default=LISTEN_ADDRESS)
+    parser.add_argument('--port', type=int, default=LISTEN_PORT)
+    parser.add_argument('--rollup-dir', default=ROLLUP_DIR)
+    parser.add_argument('--interval', type=int, default=REFRESH_SECONDS,
+                        help='Seconds between checks for new rollup files')
+    parser.add_argument('--cache-size', type=int, default=CACHE_SIZE)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    index = UsageIndex(args.rollup_dir, args.cache_size)
+    index.refresh()
+
+    stop_event = threading.Event()
+    threading.Thread(target=refresh_loop, args=(index, args.interval, stop_event), daemon=True).start()
+
+    server = make_server(args.address, args.port, index)
+    logger.info(f"Usage query service listening on {args.address}:{args.port}")
+    try:
+        server.serve_forever()
+    finally:
+        stop_event.set()
+
+if __name__ == "__main__":
+    main()
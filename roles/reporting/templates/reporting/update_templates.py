@@ -2,8 +2,8 @@
 import os
 import re
 
-# Directory containing the templates
-template_dir = "/home/psantana/playbooks-slurm/roles/reporting/templates/reporting"
+# Directory containing the templates (this script lives next to them)
+template_dir = os.path.dirname(os.path.abspath(__file__))
 
 # Ansible variables to look for and update
 ansible_vars = [
@@ -21,27 +21,30 @@ ansible_vars = [
     "smtp_password"
 ]
 
+# One pass for every variable: {{ var }} or {{ var | default(...) }}, skipping
+# occurrences that were already converted to {{{{ var }}}}
+pattern = re.compile(r'(?<!\{)\{\{\s*(' + '|'.join(map(re.escape, ansible_vars)) + r')\b(\s*\|\s*[^}]+)?\s*\}\}(?!\})')
+
 # Process each template file
-for filename in os.listdir(template_dir):
+for filename in sorted(os.listdir(template_dir)):
     if filename.endswith(".py.j2"):
         filepath = os.path.join(template_dir, filename)
         print(f"Processing {filepath}")
-        
+
         # Read the file content
         with open(filepath, 'r') as file:
             content = file.read()
-        
+
         # Replace Ansible variables with the new delimiter format
-        for var in ansible_vars:
-            # Match patterns like {{ var }} or {{ var | default(...) }}
-            pattern = r'{{\s*' + var + r'(\s*\|\s*[^}]+)?\s*}}'
-            replacement = r'{{{{ ' + var + r'\1 }}}}'
-            content = re.sub(pattern, replacement, content)
-        
-        # Write the updated content back to the file
+        updated = pattern.sub(lambda m: '{{{{ ' + m.group(1) + (m.group(2) or '') + ' }}}}', content)
+
+        # Only touch files that actually change
+        if updated == content:
+            print(f"Unchanged {filepath}")
+            continue
         with open(filepath, 'w') as file:
-            file.write(content)
-        
+            file.write(updated)
+
         print(f"Updated {filepath}")
 
 print("All template files have been updated!")
\ No newline at end of file
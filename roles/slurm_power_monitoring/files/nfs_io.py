@@ -0,0 +1,287 @@
+#!/usr/bin/env python3
+"""
+Per-Job NFS I/O Collector for Slurm Nodes
+Turns /proc/self/mountstats into per-mount, per-operation NFS rates and
+attributes I/O to running jobs through their cgroups, for the
+node_exporter textfile collector
+"""
+
+import logging
+import os
+import re
+import time
+
+logger = logging.getLogger('nfs_io')
+
+# Configuration
+MOUNTSTATS_PATH = '/proc/self/mountstats'
+# Slurm job cgroups under cgroup v2 (job_<id>/step_<id>)
+CGROUP_ROOT = '/sys/fs/cgroup/system.slice/slurmstepd.scope'
+PROC_ROOT = '/proc'
+NFS_IO_METRICS_FILE = '/var/lib/node_exporter/textfile_collector/slurm_nfs_io.prom'
+NFS_FSTYPES = ('nfs', 'nfs4')
+JOB_CGROUP = re.compile(r'^job_(\d+)$')
+
+# Per-op fields: ops, transmissions, major timeouts, bytes sent, bytes received,
+# queue, RTT and execute time in ms (and errors on newer kernels)
+OP_FIELDS = ('ops', 'transmissions', 'timeouts', 'bytes_sent', 'bytes_recv', 'queue_ms', 'rtt_ms', 'exec_ms')
+BYTES_FIELDS = ('normal_read', 'normal_write', 'direct_read', 'direct_write',
+                'server_read', 'server_write', 'read_pages', 'write_pages')
+MOUNT_LINE = re.compile(r'^device (\S+) mounted on (\S+) with fstype (\S+)')
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def _labels(**labels):
+    return '{' + ','.join(f'{key}="{_escape(value)}"' for key, value in labels.items()) + '}'
+
+def parse_mountstats(text):
+    """NFS mounts from mountstats: {mountpoint: {'export', 'age', 'bytes', 'ops'}}"""
+    mounts = {}
+    mount = None
+    in_ops = False
+    for line in text.splitlines():
+        match = MOUNT_LINE.match(line)
+        if match:
+            export, mountpoint, fstype = match.groups()
+            in_ops = False
+            if fstype in NFS_FSTYPES:
+                mount = mounts[mountpoint] = {'export': export, 'age': 0, 'bytes': {}, 'ops': {}}
+            else:
+                mount = None
+            continue
+        if mount is None:
+            continue
+
+        stripped = line.strip()
+        if stripped.startswith('age:'):
+            mount['age'] = int(stripped.split()[1])
+        elif stripped.startswith('bytes:'):
+            values = [int(value) for value in stripped.split()[1:]]
+            mount['bytes'] = dict(zip(BYTES_FIELDS, values))
+        elif stripped == 'per-op statistics':
+            in_ops = True
+        elif in_ops and ':' in stripped:
+            op, values = stripped.split(':', 1)
+            values = [int(value) for value in values.split()]
+            if len(values) >= len(OP_FIELDS):
+                mount['ops'][op] = dict(zip(OP_FIELDS, values))
+    return mounts
+
+def read_mountstats(path=MOUNTSTATS_PATH):
+    """Parse every NFS mount from a single read of mountstats"""
+    with open(path, 'r') as f:
+        return parse_mountstats(f.read())
+
+def mountstats_rates(previous, current, seconds):
+    """Per-mount byte and per-op RPC rates between two snapshots
+
+    Mounts that are new, or were remounted (age or counters went backwards),
+    have no rates until the next cycle.
+    """
+    rates = {}
+    if seconds <= 0:
+        return rates
+    for mountpoint, mount in current.items():
+        before = previous.get(mountpoint)
+        if before is None or mount['age'] < before['age']:
+            continue
+        read = (mount['bytes'].get('normal_read', 0) + mount['bytes'].get('direct_read', 0)
+                - before['bytes'].get('normal_read', 0) - before['bytes'].get('direct_read', 0))
+        write = (mount['bytes'].get('normal_write', 0) + mount['bytes'].get('direct_write', 0)
+                 - before['bytes'].get('normal_write', 0) - before['bytes'].get('direct_write', 0))
+        if read < 0 or write < 0:
+            continue
+
+        ops = {}
+        for op, stats in mount['ops'].items():
+            old = before['ops'].get(op)
+            if old is None:
+                continue
+            delta = {field: stats[field] - old[field] for field in OP_FIELDS}
+            if delta['ops'] <= 0 or any(value < 0 for value in delta.values()):
+                continue
+            ops[op] = {
+                'ops_per_second': delta['ops'] / seconds,
+                'retransmissions_per_second': max(delta['transmissions'] - delta['ops'], 0) / seconds,
+                'timeouts_per_second': delta['timeouts'] / seconds,
+                'sent_bytes_per_second': delta['bytes_sent'] / seconds,
+                'received_bytes_per_second': delta['bytes_recv'] / seconds,
+                'avg_rtt_ms': delta['rtt_ms'] / delta['ops'],
+                'avg_exec_ms': delta['exec_ms'] / delta['ops'],
+            }
+        rates[mountpoint] = {
+            'export': mount['export'],
+            'read_bytes_per_second': read / seconds,
+            'write_bytes_per_second': write / seconds,
+            'ops': ops,
+        }
+    return rates
+
+def parse_io_stat(text):
+    """Sum a cgroup v2 io.stat over its devices"""
+    totals = {'rbytes': 0, 'wbytes': 0, 'rios': 0, 'wios': 0}
+    for line in text.splitlines():
+        for item in line.split()[1:]:
+            key, _, value = item.partition('=')
+            if key in totals:
+                totals[key] += int(value)
+    return totals
+
+def parse_proc_io(text):
+    """rchar/wchar/syscr/syscw from /proc/<pid>/io; these include NFS and other non-block I/O"""
+    values = {}
+    for line in text.splitlines():
+        key, _, value = line.partition(':')
+        if key in ('rchar', 'wchar', 'syscr', 'syscw'):
+            values[key] = int(value)
+    return values
+
+def find_job_cgroups(root=CGROUP_ROOT):
+    """{job_id: cgroup path} for every Slurm job cgroup below root"""
+    jobs = {}
+    for dirpath, dirnames, _ in os.walk(root):
+        for name in list(dirnames):
+            match = JOB_CGROUP.match(name)
+            if match:
+                jobs[match.group(1)] = os.path.join(dirpath, name)
+                # Step cgroups below the job are read with it
+                dirnames.remove(name)
+    return jobs
+
+def read_job_io(cgroup_path, proc_root=PROC_ROOT):
+    """Block I/O from the job cgroup's io.stat and syscall I/O of its processes"""
+    usage = {'rbytes': 0, 'wbytes': 0, 'rios': 0, 'wios': 0, 'rchar': 0, 'wchar': 0, 'syscr': 0, 'syscw': 0}
+    try:
+        with open(os.path.join(cgroup_path, 'io.stat'), 'r') as f:
+            usage.update(parse_io_stat(f.read()))
+    except OSError:
+        pass
+
+    for dirpath, _, filenames in os.walk(cgroup_path):
+        if 'cgroup.procs' not in filenames:
+            continue
+        try:
+            with open(os.path.join(dirpath, 'cgroup.procs'), 'r') as f:
+                pids = f.read().split()
+        except OSError:
+            continue
+        for pid in pids:
+            try:
+                with open(os.path.join(proc_root, pid, 'io'), 'r') as f:
+                    proc_io = parse_proc_io(f.read())
+            except OSError:
+                # The process exited between listing and reading
+                continue
+            for key, value in proc_io.items():
+                usage[key] += value
+    return usage
+
+def job_io_rates(previous, current, seconds):
+    """Per-job rates; counters of exited processes drop out, so negative deltas count as zero"""
+    rates = {}
+    if seconds <= 0:
+        return rates
+    for job_id, usage in current.items():
+        before = previous.get(job_id)
+        if before is None:
+            continue
+        rates[job_id] = {key: max(value - before.get(key, 0), 0) / seconds for key, value in usage.items()}
+    return rates
+
+class NfsIoCollector:
+    """Keeps the previous snapshot and renders rate metrics each cycle"""
+
+    def __init__(self, hostname, mountstats_path=MOUNTSTATS_PATH, cgroup_root=CGROUP_ROOT,
+                 proc_root=PROC_ROOT, clock=time.time):
+        self.hostname = hostname
+        self.mountstats_path = mountstats_path
+        self.cgroup_root = cgroup_root
+        self.proc_root = proc_root
+        self.clock = clock
+        self.previous = None
+
+    def snapshot(self):
+        try:
+            mounts = read_mountstats(self.mountstats_path)
+        except OSError as e:
+            logger.error(f"Error reading mountstats: {e}")
+            mounts = {}
+        jobs = {job_id: read_job_io(path, self.proc_root)
+                for job_id, path in find_job_cgroups(self.cgroup_root).items()}
+        return {'time': self.clock(), 'mounts': mounts, 'jobs': jobs}
+
+    def collect(self):
+        """Metric lines for the interval since the previous call (none on the first)"""
+        current = self.snapshot()
+        previous, self.previous = self.previous, current
+        if previous is None:
+            return []
+        seconds = current['time'] - previous['time']
+        mounts = mountstats_rates(previous['mounts'], current['mounts'], seconds)
+        jobs = job_io_rates(previous['jobs'], current['jobs'], seconds)
+        return self.render(mounts, jobs)
+
+    def render(self, mounts, jobs):
+        host = self.hostname
+        lines = []
+
+        def metric(name, description, samples):
+            lines.append(f"# HELP {name} {description}")
+            lines.append(f"# TYPE {name} gauge")
+            for labels, value in samples:
+                lines.append(f"{name}{_labels(hostname=host, **labels)} {value:.6g}")
+
+        for key, description in [
+            ('read_bytes_per_second', 'NFS bytes read by applications per mount'),
+            ('write_bytes_per_second', 'NFS bytes written by applications per mount'),
+        ]:
+            metric(f"node_nfs_{key}", description,
+                   [({'mountpoint': mountpoint, 'export': mount['export']}, mount[key])
+                    for mountpoint, mount in sorted(mounts.items())])
+
+        for key, name, description in [
+            ('ops_per_second', 'ops_per_second', 'NFS RPC operations per mount and operation'),
+            ('retransmissions_per_second', 'retransmissions_per_second',
+             'NFS RPC retransmissions per mount and operation'),
+            ('timeouts_per_second', 'timeouts_per_second', 'NFS RPC major timeouts per mount and operation'),
+            ('sent_bytes_per_second', 'sent_bytes_per_second', 'NFS RPC bytes sent per mount and operation'),
+            ('received_bytes_per_second', 'received_bytes_per_second',
+             'NFS RPC bytes received per mount and operation'),
+            ('avg_rtt_ms', 'rtt_milliseconds', 'Average NFS RPC round trip time per mount and operation'),
+            ('avg_exec_ms', 'execute_milliseconds',
+             'Average NFS RPC execution time, queueing included, per mount and operation'),
+        ]:
+            metric(f"node_nfs_rpc_{name}", description,
+                   [({'mountpoint': mountpoint, 'op': op}, stats[key])
+                    for mountpoint, mount in sorted(mounts.items())
+                    for op, stats in sorted(mount['ops'].items())])
+
+        for key, name, description in [
+            ('rbytes', 'block_read_bytes_per_second', 'Block device bytes read by the job (cgroup io.stat)'),
+            ('wbytes', 'block_write_bytes_per_second', 'Block device bytes written by the job (cgroup io.stat)'),
+            ('rios', 'block_read_iops', 'Block device read operations of the job (cgroup io.stat)'),
+            ('wios', 'block_write_iops', 'Block device write operations of the job (cgroup io.stat)'),
+            ('rchar', 'read_bytes_per_second', 'Bytes read through syscalls by the job, NFS and network included'),
+            ('wchar', 'write_bytes_per_second', 'Bytes written through syscalls by the job, NFS and network included'),
+            ('syscr', 'read_syscalls_per_second', 'Read syscalls issued by the job'),
+            ('syscw', 'write_syscalls_per_second', 'Write syscalls issued by the job'),
+        ]:
+            metric(f"slurm_job_{name}", description,
+                   [({'job_id': job_id}, rates[key]) for job_id, rates in sorted(jobs.items())])
+
+        # NFS has no block device in io.stat; split the node's NFS traffic by each job's syscall I/O
+        nfs_total = sum(mount['read_bytes_per_second'] + mount['write_bytes_per_second'] for mount in mounts.values())
+        syscall_total = sum(rates['rchar'] + rates['wchar'] for rates in jobs.values())
+        metric('slurm_job_nfs_bytes_per_second_estimate',
+               "Node NFS bytes attributed to the job by its share of syscall I/O",
+               [({'job_id': job_id}, nfs_total * (rates['rchar'] + rates['wchar']) / syscall_total
+                 if syscall_total else 0.0) for job_id, rates in sorted(jobs.items())])
+        return lines
+
+def write_metrics(lines, path=NFS_IO_METRICS_FILE):
+    """Atomically replace the textfile"""
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w') as f:
+        f.write('\n'.join(lines) + '\n')
+    os.replace(tmp_path, path)
@@ -0,0 +1,312 @@
+#!/usr/bin/env python3
+"""
+Cluster Power Aggregator for Slurm
+Receives batched per-job power deltas from the node collectors and exposes
+per-job, per-user and per-account totals as low-cardinality Prometheus metrics.
+With a group power budget it also hands out per-node RAPL caps on /caps
+"""
+
+import argparse
+import json
+import logging
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from power_capping import NODE_FLOOR_WATTS, allocate_budget
+
+logger = logging.getLogger('power_aggregator')
+
+# Configuration
+LISTEN_ADDRESS = '0.0.0.0'
+LISTEN_PORT = 9095
+NODE_STALE_SECONDS = 180  # A node's last reported power stops counting after this
+JOB_IDLE_SECONDS = 300  # Jobs with no live nodes for this long are finished
+FINISHED_RETENTION_SECONDS = 3600  # Finished jobs stay available on /jobs
+MAX_BODY_BYTES = 4 * 1024 * 1024
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def _labels(**labels):
+    return '{' + ','.join(f'{key}="{_escape(value)}"' for key, value in labels.items()) + '}'
+
+class PowerAggregator:
+    """In-memory running totals fed by collector pushes"""
+
+    def __init__(self, node_stale=NODE_STALE_SECONDS, job_idle=JOB_IDLE_SECONDS,
+                 finished_retention=FINISHED_RETENTION_SECONDS, power_budget=None,
+                 cap_floor=NODE_FLOOR_WATTS, cap_ceiling=None):
+        self.node_stale = node_stale
+        self.job_idle = job_idle
+        self.finished_retention = finished_retention
+        # Group budget in watts split across the live collectors; None disables /caps
+        self.power_budget = power_budget
+        self.cap_floor = cap_floor
+        self.cap_ceiling = cap_ceiling
+        # hostname -> time of the last push, busy or idle
+        self.nodes = {}
+        # First push since start; caps wait one stale window for every node to report
+        self.first_push = None
+        self.lock = threading.Lock()
+        self.jobs = {}
+        self.finished = {}
+        # Counters survive job expiry so rate() works on them
+        self.user_energy = {}
+        self.account_energy = {}
+        # hostname -> (collector boot id, last applied sequence number)
+        self.collectors = {}
+        self.batches_applied = 0
+        self.batches_duplicate = 0
+
+    def ingest(self, payload, now=None):
+        """Apply a push; batches a collector already delivered are skipped"""
+        now = time.time() if now is None else now
+        hostname = str(payload['hostname'])
+        boot = payload.get('boot')
+        applied = 0
+        with self.lock:
+            known_boot, last_seq = self.collectors.get(hostname, (None, -1))
+            if known_boot != boot:
+                last_seq = -1
+            for batch in sorted(payload.get('batches', []), key=lambda b: b['seq']):
+                if batch['seq'] <= last_seq:
+                    self.batches_duplicate += 1
+                    continue
+                self._apply_batch(hostname, batch, now)
+                last_seq = batch['seq']
+                applied += 1
+            self.collectors[hostname] = (boot, last_seq)
+            self.nodes[hostname] = now
+            if self.first_push is None:
+                self.first_push = now
+            self.batches_applied += applied
+        return applied
+
+    def _apply_batch(self, hostname, batch, now):
+        for sample in batch.get('jobs', []):
+            job_id = str(sample['job_id'])
+            job = self.jobs.get(job_id)
+            if job is None:
+                job = self.jobs[job_id] = {
+                    'job_id': job_id,
+                    'user': sample.get('user', 'unknown'),
+                    'account': sample.get('account', 'unknown'),
+                    'first_seen': now,
+                    'energy_joules': 0.0,
+                    'nodes': {},
+                }
+            joules = max(float(sample.get('joules', 0)), 0.0)
+            job['energy_joules'] += joules
+            job['last_seen'] = now
+            job['nodes'][hostname] = {'watts': float(sample.get('watts', 0)), 'seen': now}
+            self.user_energy[job['user']] = self.user_energy.get(job['user'], 0.0) + joules
+            self.account_energy[job['account']] = self.account_energy.get(job['account'], 0.0) + joules
+
+        for job_id in batch.get('finished', []):
+            job = self.jobs.get(str(job_id))
+            if job is not None:
+                job['nodes'].pop(hostname, None)
+                if not job['nodes']:
+                    self._finish(str(job_id), now)
+
+    def _finish(self, job_id, now):
+        job = self.jobs.pop(job_id)
+        job['finished_at'] = now
+        job['nodes'] = sorted(job['nodes'])
+        self.finished[job_id] = job
+
+    def expire(self, now=None):
+        """Drop stale node power, finish idle jobs and forget old finished jobs"""
+        now = time.time() if now is None else now
+        with self.lock:
+            for job_id, job in list(self.jobs.items()):
+                job['nodes'] = {host: node for host, node in job['nodes'].items()
+                                if now - node['seen'] < self.node_stale}
+                if not job['nodes'] and now - job['last_seen'] >= self.job_idle:
+                    self._finish(job_id, now)
+            self.finished = {job_id: job for job_id, job in self.finished.items()
+                             if now - job['finished_at'] < self.finished_retention}
+            self.nodes = {host: seen for host, seen in self.nodes.items() if now - seen < self.node_stale}
+
+    def _job_power(self, job, now):
+        return sum(node['watts'] for node in job['nodes'].values() if now - node['seen'] < self.node_stale)
+
+    def caps_ready(self, now=None):
+        """Whether every live collector has had one stale window to push since start"""
+        now = time.time() if now is None else now
+        with self.lock:
+            return self.first_push is not None and now - self.first_push >= self.node_stale
+
+    def caps(self, now=None):
+        """Per-node power caps: the budget goes to nodes running jobs before idle ones
+
+        Withheld until caps_ready(): splitting the budget over only the first
+        nodes to report after a restart would hand them nearly all of it.
+        """
+        now = time.time() if now is None else now
+        self.expire(now)
+        if self.power_budget is None or not self.caps_ready(now):
+            return {}
+        with self.lock:
+            busy = {host for job in self.jobs.values() for host in job['nodes']}
+            nodes = {host: {'busy': host in busy} for host in sorted(self.nodes)}
+        return allocate_budget(self.power_budget, nodes, self.cap_floor, self.cap_ceiling)
+
+    def render_metrics(self, now=None):
+        """Prometheus text exposition of the aggregated totals"""
+        now = time.time() if now is None else now
+        caps = self.caps(now)
+        with self.lock:
+            user_power, account_power = {}, {}
+            lines = [
+                '# HELP slurm_job_cluster_power_watts Job power summed across its nodes',
+                '# TYPE slurm_job_cluster_power_watts gauge',
+            ]
+            job_lines = ['# HELP slurm_job_cluster_energy_joules Job energy summed across its nodes',
+                         '# TYPE slurm_job_cluster_energy_joules gauge']
+            node_lines = ['# HELP slurm_job_cluster_nodes Nodes currently reporting power for the job',
+                          '# TYPE slurm_job_cluster_nodes gauge']
+            for job in sorted(self.jobs.values(), key=lambda j: j['job_id']):
+                power = self._job_power(job, now)
+                user_power[job['user']] = user_power.get(job['user'], 0.0) + power
+                account_power[job['account']] = account_power.get(job['account'], 0.0) + power
+                labels = _labels(job_id=job['job_id'], user=job['user'], account=job['account'])
+                lines.append(f"slurm_job_cluster_power_watts{labels} {power:.3f}")
+                job_lines.append(f"slurm_job_cluster_energy_joules{labels} {job['energy_joules']:.3f}")
+                node_lines.append(f"slurm_job_cluster_nodes{labels} {len(job['nodes'])}")
+            lines += job_lines + node_lines
+
+            for name, metric_type, description, values, label in [
+                ('slurm_user_power_watts', 'gauge', 'Power of running jobs per user', user_power, 'user'),
+                ('slurm_account_power_watts', 'gauge', 'Power of running jobs per account', account_power, 'account'),
+                ('slurm_user_energy_joules_total', 'counter', 'Job energy per user since aggregator start',
+                 self.user_energy, 'user'),
+                ('slurm_account_energy_joules_total', 'counter', 'Job energy per account since aggregator start',
+                 self.account_energy, 'account'),
+            ]:
+                lines.append(f"# HELP {name} {description}")
+                lines.append(f"# TYPE {name} {metric_type}")
+                for key, value in sorted(values.items()):
+                    lines.append(f"{name}{_labels(**{label: key})} {value:.3f}")
+
+            live_collectors = {host for job in self.jobs.values() for host in job['nodes']}
+            lines += [
+                '# HELP slurm_cluster_job_power_watts Power of all running jobs',
+                '# TYPE slurm_cluster_job_power_watts gauge',
+                f"slurm_cluster_job_power_watts {sum(user_power.values()):.3f}",
+                '# HELP slurm_power_aggregator_jobs Jobs tracked by the aggregator',
+                '# TYPE slurm_power_aggregator_jobs gauge',
+                f'slurm_power_aggregator_jobs{_labels(state="running")} {len(self.jobs)}',
+                f'slurm_power_aggregator_jobs{_labels(state="finished")} {len(self.finished)}',
+                '# HELP slurm_power_aggregator_collectors Collectors with live job samples',
+                '# TYPE slurm_power_aggregator_collectors gauge',
+                f"slurm_power_aggregator_collectors {len(live_collectors)}",
+                '# HELP slurm_power_aggregator_batches_total Pushed batches by outcome',
+                '# TYPE slurm_power_aggregator_batches_total counter',
+                f'slurm_power_aggregator_batches_total{_labels(outcome="applied")} {self.batches_applied}',
+                f'slurm_power_aggregator_batches_total{_labels(outcome="duplicate")} {self.batches_duplicate}',
+            ]
+            if self.power_budget is not None:
+                lines += [
+                    '# HELP slurm_cluster_power_budget_watts Group power budget split across the nodes',
+                    '# TYPE slurm_cluster_power_budget_watts gauge',
+                    f"slurm_cluster_power_budget_watts {self.power_budget:.3f}",
+                    '# HELP slurm_node_power_cap_watts Power cap assigned to the node',
+                    '# TYPE slurm_node_power_cap_watts gauge',
+                ] + [f"slurm_node_power_cap_watts{_labels(hostname=host)} {cap:.3f}"
+                     for host, cap in sorted(caps.items())]
+        return '\n'.join(lines) + '\n'
+
+    def jobs_snapshot(self, now=None):
+        """Running and recently finished job totals for the reporting pipeline"""
+        now = time.time() if now is None else now
+        self.expire(now)
+        with self.lock:
+            running = [{
+                'job_id': job['job_id'], 'user': job['user'], 'account': job['account'],
+                'state': 'running', 'first_seen': job['first_seen'], 'last_seen': job['last_seen'],
+                'energy_joules': round(job['energy_joules'], 3), 'power_watts': round(self._job_power(job, now), 3),
+                'nodes': sorted(job['nodes']),
+            } for job in self.jobs.values()]
+            finished = [{
+                'job_id': job['job_id'], 'user': job['user'], 'account': job['account'],
+                'state': 'finished', 'first_seen': job['first_seen'], 'last_seen': job['last_seen'],
+                'finished_at': job['finished_at'], 'energy_joules': round(job['energy_joules'], 3),
+                'nodes': job['nodes'],
+            } for job in self.finished.values()]
+        return running + finished
+
+class AggregatorHandler(BaseHTTPRequestHandler):
+    """POST /push from collectors; GET /metrics, /jobs and /caps for consumers"""
+
+    def _reply(self, status, body, content_type='text/plain; version=0.0.4'):
+        data = body.encode()
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_POST(self):
+        if self.path != '/push':
+            return self._reply(404, 'not found\n')
+        try:
+            length = int(self.headers.get('Content-Length', 0))
+            if length > MAX_BODY_BYTES:
+                return self._reply(413, 'payload too large\n')
+            payload = json.loads(self.rfile.read(length))
+            applied = self.server.aggregator.ingest(payload)
+        except (ValueError, KeyError, TypeError) as e:
+            return self._reply(400, f"bad payload: {e}\n")
+        self._reply(200, json.dumps({'applied': applied}), 'application/json')
+
+    def do_GET(self):
+        if self.path == '/metrics':
+            self._reply(200, self.server.aggregator.render_metrics())
+        elif self.path == '/jobs':
+            self._reply(200, json.dumps(self.server.aggregator.jobs_snapshot()), 'application/json')
+        elif self.path == '/caps':
+            aggregator = self.server.aggregator
+            body = {'budget': aggregator.power_budget, 'ready': aggregator.caps_ready(), 'caps': aggregator.caps()}
+            self._reply(200, json.dumps(body), 'application/json')
+        else:
+            self._reply(404, 'not found\n')
+
+    def log_message(self, format, *args):
+        logger.debug(format % args)
+
+class AggregatorServer(ThreadingHTTPServer):
+    daemon_threads = True
+    # Every collector pushes on the same minute boundary
+    request_queue_size = 256
+
+def make_server(address=LISTEN_ADDRESS, port=LISTEN_PORT, aggregator=None):
+    server = AggregatorServer((address, port), AggregatorHandler)
+    server.aggregator = aggregator or PowerAggregator()
+    return server
+
+def main():
+    parser = argparse.ArgumentParser(description='Aggregate per-job power pushed by the node collectors')
+    parser.add_argument('--address', default=LISTEN_ADDRESS)
+    parser.add_argument('--port', type=int, default=LISTEN_PORT)
+    parser.add_argument('--node-stale', type=int, default=NODE_STALE_SECONDS)
+    parser.add_argument('--job-idle', type=int, default=JOB_IDLE_SECONDS)
+    parser.add_argument('--finished-retention', type=int, default=FINISHED_RETENTION_SECONDS)
+    parser.add_argument('--power-budget', type=float, default=None,
+                        help='Group power budget in watts to split into per-node caps')
+    parser.add_argument('--cap-floor', type=float, default=NODE_FLOOR_WATTS,
+                        help='Watts every node keeps, busy or idle')
+    parser.add_argument('--cap-ceiling', type=float, default=None,
+                        help='Largest cap handed to a single node')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    aggregator = PowerAggregator(args.node_stale, args.job_idle, args.finished_retention,
+                                 args.power_budget, args.cap_floor, args.cap_ceiling)
+    server = make_server(args.address, args.port, aggregator)
+    logger.info(f"Power aggregator listening on {args.address}:{args.port}")
+    server.serve_forever()
+
+if __name__ == "__main__":
+    main()
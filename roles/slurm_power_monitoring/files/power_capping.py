@@ -0,0 +1,250 @@
+#!/usr/bin/env python3
+"""
+RAPL Power Capping for Slurm Nodes
+Keeps a node, or a node group via the power aggregator, under a power budget
+by adjusting the package power limits under /sys/class/powercap/intel-rapl
+"""
+
+import json
+import logging
+import os
+import re
+import time
+import urllib.request
+
+logger = logging.getLogger('power_capping')
+
+# Configuration
+RAPL_PATH = '/sys/class/powercap/intel-rapl'
+CAP_MIN_WATTS = 40  # Never cap a package below this
+CAP_HYSTERESIS_WATTS = 5  # Differences smaller than this are left alone
+CAP_MAX_STEP_WATTS = 20  # Largest change per package per adjustment
+CAP_MIN_INTERVAL = 30  # seconds between adjustments
+NODE_FLOOR_WATTS = 100  # Share every node of a group keeps, busy or idle
+CAPS_TIMEOUT = 5  # seconds
+# Limits found before capping, written back on exit or by the next run with capping off
+CAP_STATE_FILE = '/var/lib/power_metrics/power_cap_limits.json'
+PACKAGE_ZONE = re.compile(r'^intel-rapl:\d+$')
+
+def _read_int(path):
+    with open(path, 'r') as f:
+        return int(f.read().strip())
+
+class PowercapZone:
+    """One RAPL package zone and the constraint used for capping"""
+
+    def __init__(self, path):
+        self.path = path
+        with open(os.path.join(path, 'name'), 'r') as f:
+            self.name = f.read().strip()
+        # Cap the long_term (PL1) constraint; fall back to the first one
+        self.constraint = 0
+        index = 0
+        while os.path.exists(os.path.join(path, f'constraint_{index}_power_limit_uw')):
+            try:
+                with open(os.path.join(path, f'constraint_{index}_name'), 'r') as f:
+                    if f.read().strip() == 'long_term':
+                        self.constraint = index
+                        break
+            except OSError:
+                pass
+            index += 1
+        try:
+            self.max_uw = _read_int(self._constraint_file('max_power_uw'))
+        except OSError:
+            self.max_uw = 0
+
+    def _constraint_file(self, suffix):
+        return os.path.join(self.path, f'constraint_{self.constraint}_{suffix}')
+
+    def read_limit(self):
+        return _read_int(self._constraint_file('power_limit_uw'))
+
+    def write_limit(self, uw):
+        with open(self._constraint_file('power_limit_uw'), 'w') as f:
+            f.write(str(int(uw)))
+
+def discover_zones(root=RAPL_PATH):
+    """Package-level zones that can be capped"""
+    zones = []
+    if not os.path.isdir(root):
+        return zones
+    for name in sorted(os.listdir(root)):
+        path = os.path.join(root, name)
+        if PACKAGE_ZONE.match(name) and os.path.exists(os.path.join(path, 'constraint_0_power_limit_uw')):
+            try:
+                zones.append(PowercapZone(path))
+            except OSError as e:
+                logger.warning(f"Skipping powercap zone {name}: {e}")
+    return zones
+
+def save_original_limits(zones, path=CAP_STATE_FILE):
+    """Record the package limits before capping; a file left by an unclean exit already holds them"""
+    try:
+        with open(path, 'r') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        pass
+    limits = {zone.path: zone.read_limit() for zone in zones}
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump(limits, f)
+    os.replace(tmp_path, path)
+    return limits
+
+def restore_limits(zones, path=CAP_STATE_FILE):
+    """Write back the limits saved before capping and forget them; returns the restored zone names
+
+    Does nothing unless a capping run left the state file. Zones missing
+    from an unreadable file are lifted to their maximum.
+    """
+    if not os.path.exists(path):
+        return []
+    try:
+        with open(path, 'r') as f:
+            limits = json.load(f)
+    except (OSError, ValueError) as e:
+        logger.warning(f"Unreadable power cap state {path}, lifting limits to the maximum: {e}")
+        limits = {}
+    restored = []
+    for zone in zones:
+        uw = limits.get(zone.path) or zone.max_uw
+        if uw and zone.read_limit() != uw:
+            zone.write_limit(uw)
+            logger.info(f"Restored {zone.name} limit to {uw / 1e6:.1f} W")
+            restored.append(zone.name)
+    os.remove(path)
+    return restored
+
+def allocate_budget(budget_watts, nodes, floor_watts=NODE_FLOOR_WATTS, ceiling_watts=None):
+    """Split a group budget into per-node caps
+
+    nodes maps hostname -> {'busy': bool}. Every node gets the floor; the rest goes
+    to nodes running jobs, equally up to the ceiling, and only what busy nodes
+    cannot use goes to idle ones.
+    """
+    if not nodes:
+        return {}
+    if budget_watts <= floor_watts * len(nodes):
+        share = budget_watts / len(nodes)
+        return {host: share for host in nodes}
+
+    caps = {host: float(floor_watts) for host in nodes}
+    remaining = budget_watts - floor_watts * len(nodes)
+    busy = [host for host, node in nodes.items() if node.get('busy')]
+    idle = [host for host in nodes if host not in busy]
+    for group in (busy, idle):
+        # Water-fill: nodes reaching the ceiling pass their excess to the others
+        open_hosts = list(group)
+        while open_hosts and remaining > 1e-9:
+            share = remaining / len(open_hosts)
+            still_open = []
+            for host in open_hosts:
+                room = share if ceiling_watts is None else min(share, ceiling_watts - caps[host])
+                caps[host] += room
+                remaining -= room
+                if ceiling_watts is None or caps[host] < ceiling_watts - 1e-9:
+                    still_open.append(host)
+            if len(still_open) == len(open_hosts):
+                break
+            open_hosts = still_open
+    return caps
+
+class CapUnavailable(LookupError):
+    """The aggregator has a budget but no cap for this node (restarted, or our pushes are stale)"""
+
+def fetch_group_cap(url, hostname, timeout=CAPS_TIMEOUT):
+    """This node's cap in watts from the aggregator's /caps, or None without a budget"""
+    with urllib.request.urlopen(url, timeout=timeout) as response:
+        body = json.load(response)
+    if body.get('budget') is None:
+        return None
+    caps = body.get('caps') or {}
+    if hostname not in caps:
+        # Not the same as no budget: lifting the limits here would overrun the group
+        raise CapUnavailable(f"aggregator has no cap for {hostname}")
+    return caps[hostname]
+
+class PowerCapController:
+    """Moves the package limits toward a node target, rate-limited and hysteresis-damped"""
+
+    def __init__(self, zones, min_watts=CAP_MIN_WATTS, hysteresis_watts=CAP_HYSTERESIS_WATTS,
+                 max_step_watts=CAP_MAX_STEP_WATTS, min_interval=CAP_MIN_INTERVAL,
+                 dry_run=False, clock=time.monotonic, state_file=None):
+        self.zones = zones
+        self.min_watts = min_watts
+        self.hysteresis_watts = hysteresis_watts
+        self.max_step_watts = max_step_watts
+        self.min_interval = min_interval
+        self.dry_run = dry_run
+        self.clock = clock
+        self.last_change = None
+        # Dry runs never write, so there is nothing to restore
+        self.state_file = state_file if not dry_run else None
+        if self.state_file:
+            save_original_limits(zones, self.state_file)
+        # Dry runs track the limits they would have written
+        self.limits = {zone.path: zone.read_limit() for zone in zones}
+
+    def restore(self):
+        """Put back the limits found before capping started"""
+        if self.state_file:
+            restore_limits(self.zones, self.state_file)
+            self.limits = {zone.path: zone.read_limit() for zone in self.zones}
+
+    def max_watts(self):
+        return sum(zone.max_uw for zone in self.zones) / 1e6
+
+    def current_watts(self):
+        return sum(self.limits.values()) / 1e6
+
+    def zone_targets(self, node_watts):
+        """Per-zone limits in uW: the node target split by each package's maximum"""
+        if node_watts is None:
+            # Zones without a known maximum are left where they are
+            return {zone.path: zone.max_uw for zone in self.zones if zone.max_uw}
+        total_max = sum(zone.max_uw for zone in self.zones)
+        targets = {}
+        for zone in self.zones:
+            weight = zone.max_uw / total_max if total_max else 1 / len(self.zones)
+            uw = node_watts * 1e6 * weight
+            uw = max(uw, self.min_watts * 1e6)
+            if zone.max_uw:
+                uw = min(uw, zone.max_uw)
+            targets[zone.path] = int(uw)
+        return targets
+
+    def apply(self, node_watts):
+        """One adjustment toward node_watts (None lifts the caps); returns the changes made"""
+        if not self.zones:
+            return []
+        now = self.clock()
+        if self.last_change is not None and now - self.last_change < self.min_interval:
+            return []
+
+        changes = []
+        targets = self.zone_targets(node_watts)
+        for zone in self.zones:
+            target = targets.get(zone.path)
+            if target is None:
+                continue
+            if not self.dry_run:
+                self.limits[zone.path] = zone.read_limit()
+            current = self.limits[zone.path]
+            delta = target - current
+            if abs(delta) < self.hysteresis_watts * 1e6:
+                continue
+            step = self.max_step_watts * 1e6
+            new = int(current + max(-step, min(step, delta)))
+            if self.dry_run:
+                logger.info(f"Dry run: would set {zone.name} limit {current / 1e6:.1f} W -> {new / 1e6:.1f} W")
+            else:
+                zone.write_limit(new)
+                logger.info(f"Set {zone.name} limit {current / 1e6:.1f} W -> {new / 1e6:.1f} W")
+            self.limits[zone.path] = new
+            changes.append((zone.name, current, new))
+
+        if changes:
+            self.last_change = now
+        return changes
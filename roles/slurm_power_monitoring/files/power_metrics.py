@@ -7,11 +7,26 @@ Collects power data and writes it to a file for node_exporter textfile collector
 import subprocess
 import time
 import os
+import sys
 import logging
 import json
 import re
+import signal
+import socket
+import socketserver
+import threading
+import urllib.request
 from datetime import datetime
 
+from power_capping import CAP_STATE_FILE, PowerCapController, discover_zones, fetch_group_cap, restore_limits
+from nfs_io import CGROUP_ROOT as JOB_CGROUP_ROOT, NfsIoCollector, find_job_cgroups
+from nfs_io import write_metrics as write_nfs_io_metrics
+
+try:
+    import pynvml
+except ImportError:
+    pynvml = None
+
 # Configure logging
 logging.basicConfig(
     level=logging.INFO,
@@ -25,6 +40,31 @@ METRICS_FILE = '/var/lib/node_exporter/textfile_collector/power_metrics.prom'
 COLLECTION_INTERVAL = 60  # seconds
 HOSTNAME = os.uname().nodename
 
+# Job energy checkpoints (prolog/epilog -> local socket)
+RAPL_PATH = '/sys/class/powercap/intel-rapl'
+ENERGY_SOCKET = '/run/power_metrics.sock'
+ENERGY_STATE_DIR = '/var/lib/power_metrics'
+OPEN_JOBS_FILE = os.path.join(ENERGY_STATE_DIR, 'open_jobs.json')
+JOB_ENERGY_LOG = os.path.join(ENERGY_STATE_DIR, 'job_energy.jsonl')
+JOB_ENERGY_METRICS_FILE = '/var/lib/node_exporter/textfile_collector/slurm_job_energy.prom'
+JOB_ENERGY_RETENTION = 6 * 3600  # seconds a finished job stays in the textfile
+NOTIFY_TIMEOUT = 1.0  # seconds; the hook gives up rather than delay the job
+OPEN_JOB_GRACE = 300  # seconds a job may run its prolog before its cgroup exists
+OPEN_JOB_MAX_AGE = 8 * 86400  # seconds; open jobs are dropped after this without a cgroup listing
+
+# Optional cluster aggregator (e.g. http://slurm01:9095/push); empty disables pushing
+AGGREGATOR_URL = os.environ.get('POWER_AGGREGATOR_URL', '')
+AGGREGATOR_TIMEOUT = 5  # seconds
+AGGREGATOR_MAX_PENDING = 60  # unacknowledged batches kept for retry
+
+# Optional RAPL power capping: '' (off), 'node' (POWER_CAP_NODE_WATTS) or 'group' (caps from the aggregator)
+POWER_CAP_MODE = os.environ.get('POWER_CAP_MODE', '')
+POWER_CAP_NODE_WATTS = float(os.environ.get('POWER_CAP_NODE_WATTS', '0') or 0)
+POWER_CAP_DRY_RUN = os.environ.get('POWER_CAP_DRY_RUN', '1') != '0'  # Log intended limits without writing them
+
+# Per-mount NFS and per-job I/O rates (nfs_io.py); NFS_IO_METRICS=0 disables them
+NFS_IO_METRICS = os.environ.get('NFS_IO_METRICS', '1') != '0'
+
 def get_cpu_info():
     """Get CPU information"""
     try:
@@ -182,7 +222,259 @@ def get_slurm_job_info():
         logger.error(f"Error getting Slurm job info: {e}")
         return []
 
-def collect_power_data():
+def read_energy_counters():
+    """Snapshot cumulative RAPL (uJ) and NVML (mJ) energy counters"""
+    counters = {}
+    try:
+        if os.path.exists(RAPL_PATH):
+            for domain in os.listdir(RAPL_PATH):
+                if not domain.startswith('intel-rapl:'):
+                    continue
+                domain_path = os.path.join(RAPL_PATH, domain)
+                with open(os.path.join(domain_path, 'energy_uj'), 'r') as f:
+                    energy = int(f.read().strip())
+                try:
+                    with open(os.path.join(domain_path, 'max_energy_range_uj'), 'r') as f:
+                        max_range = int(f.read().strip())
+                except OSError:
+                    max_range = 0
+                counters[f"rapl:{domain}"] = [energy, max_range, 1e-6]
+    except Exception as e:
+        logger.error(f"Error reading RAPL counters: {e}")
+
+    if pynvml is not None:
+        try:
+            pynvml.nvmlInit()
+            for index in range(pynvml.nvmlDeviceGetCount()):
+                handle = pynvml.nvmlDeviceGetHandleByIndex(index)
+                energy = pynvml.nvmlDeviceGetTotalEnergyConsumption(handle)
+                counters[f"nvml:{index}"] = [energy, 0, 1e-3]
+        except Exception as e:
+            logger.debug(f"NVML energy counters unavailable: {e}")
+
+    return counters
+
+def energy_delta(start, end):
+    """Joules per source between two counter snapshots, handling RAPL wraparound"""
+    joules = {'cpu': 0.0, 'gpu': 0.0}
+    for name, (end_value, max_range, scale) in end.items():
+        if name not in start:
+            continue
+        delta = end_value - start[name][0]
+        if delta < 0:
+            # RAPL counters wrap at max_energy_range_uj
+            delta += max_range if max_range else 0
+        if delta < 0:
+            continue
+        joules['gpu' if name.startswith('nvml:') else 'cpu'] += delta * scale
+    return joules
+
+class JobEnergyTracker:
+    """Open job checkpoints and finished job energy records"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.open_jobs = {}
+        self.finished = []
+        try:
+            with open(OPEN_JOBS_FILE, 'r') as f:
+                self.open_jobs = json.load(f)
+        except (OSError, ValueError):
+            pass
+
+    def _save_open_jobs(self):
+        os.makedirs(ENERGY_STATE_DIR, exist_ok=True)
+        tmp_path = OPEN_JOBS_FILE + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(self.open_jobs, f)
+        os.replace(tmp_path, OPEN_JOBS_FILE)
+
+    def start(self, job_id):
+        counters = read_energy_counters()
+        now = time.time()
+        with self.lock:
+            self.open_jobs[job_id] = {'start': now, 'counters': counters, 'max_concurrent': 1}
+            # Node counters are shared; remember the overlap so consumers can apportion
+            for job in self.open_jobs.values():
+                job['max_concurrent'] = max(job['max_concurrent'], len(self.open_jobs))
+            self._save_open_jobs()
+        return 'ok'
+
+    def end(self, job_id):
+        counters = read_energy_counters()
+        now = time.time()
+        with self.lock:
+            job = self.open_jobs.pop(job_id, None)
+            if job is None:
+                return 'unknown job'
+            joules = energy_delta(job['counters'], counters)
+            record = {
+                'job_id': job_id,
+                'hostname': HOSTNAME,
+                'start': job['start'],
+                'end': now,
+                'duration': now - job['start'],
+                'cpu_joules': round(joules['cpu'], 3),
+                'gpu_joules': round(joules['gpu'], 3),
+                'energy_joules': round(joules['cpu'] + joules['gpu'], 3),
+                'max_concurrent_jobs': job['max_concurrent'],
+            }
+            self.finished.append(record)
+            self._save_open_jobs()
+            with open(JOB_ENERGY_LOG, 'a') as f:
+                f.write(json.dumps(record) + '\n')
+            self.write_metrics(now)
+        return 'ok'
+
+    def expire(self, active_job_ids=None, now=None):
+        """Drop open jobs whose epilog never arrived
+
+        A job past the prolog grace period is dropped when it has no cgroup on
+        the node any more (active_job_ids). Without a cgroup listing only jobs
+        older than OPEN_JOB_MAX_AGE are dropped.
+        """
+        now = now or time.time()
+        with self.lock:
+            stale = sorted(job_id for job_id, job in self.open_jobs.items()
+                           if now - job['start'] > OPEN_JOB_MAX_AGE
+                           or (active_job_ids is not None and job_id not in active_job_ids
+                               and now - job['start'] > OPEN_JOB_GRACE))
+            for job_id in stale:
+                del self.open_jobs[job_id]
+            if stale:
+                logger.warning(f"Dropped open jobs without an epilog: {', '.join(stale)}")
+                self._save_open_jobs()
+        return stale
+
+    def records(self, since=0):
+        with self.lock:
+            return [record for record in self.finished if record['end'] >= since]
+
+    def write_metrics(self, now=None):
+        """Write recently finished jobs to the textfile collector (lock held)"""
+        now = now or time.time()
+        self.finished = [r for r in self.finished if now - r['end'] < JOB_ENERGY_RETENTION]
+        lines = []
+        for name, description, value in [
+            ('slurm_job_energy_joules', 'Node energy between the job prolog and epilog',
+             lambda record: record['energy_joules']),
+            ('slurm_job_energy_duration_seconds', 'Time between the job prolog and epilog',
+             lambda record: round(record['duration'], 3)),
+            ('slurm_job_energy_concurrent_jobs', 'Most jobs running on the node at once during the job',
+             lambda record: record['max_concurrent_jobs']),
+        ]:
+            lines += [f'# HELP {name} {description}', f'# TYPE {name} gauge']
+            for record in self.finished:
+                labels = 'hostname="' + HOSTNAME + '",job_id="' + record['job_id'] + '"'
+                lines.append(name + '{' + labels + '} ' + str(value(record)))
+        try:
+            tmp_path = JOB_ENERGY_METRICS_FILE + '.tmp'
+            with open(tmp_path, 'w') as f:
+                f.write('\n'.join(lines) + '\n')
+            os.replace(tmp_path, JOB_ENERGY_METRICS_FILE)
+        except Exception as e:
+            logger.error(f"Error writing job energy metrics: {e}")
+
+class EnergySocketHandler(socketserver.StreamRequestHandler):
+    """Handle 'start <jobid>', 'end <jobid>' and 'records [since]' requests"""
+
+    def handle(self):
+        try:
+            request = self.rfile.readline(256).decode().split()
+            tracker = self.server.tracker
+            if len(request) == 2 and request[0] in ('start', 'end') and request[1].isdigit():
+                response = getattr(tracker, request[0])(request[1])
+            elif request and request[0] == 'records':
+                since = float(request[1]) if len(request) > 1 else 0
+                response = json.dumps(tracker.records(since))
+            else:
+                response = 'error: expected start|end <jobid> or records [since]'
+            self.wfile.write((response + '\n').encode())
+        except Exception as e:
+            logger.error(f"Error handling energy checkpoint: {e}")
+
+class EnergySocketServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+def start_energy_socket(tracker):
+    """Serve job energy checkpoints on the local Unix socket in a background thread"""
+    try:
+        if os.path.exists(ENERGY_SOCKET):
+            os.unlink(ENERGY_SOCKET)
+        server = EnergySocketServer(ENERGY_SOCKET, EnergySocketHandler)
+        os.chmod(ENERGY_SOCKET, 0o600)
+        server.tracker = tracker
+        threading.Thread(target=server.serve_forever, name='energy-socket', daemon=True).start()
+        logger.info(f"Listening for job energy checkpoints on {ENERGY_SOCKET}")
+        return server
+    except Exception as e:
+        logger.error(f"Error starting energy checkpoint socket: {e}")
+        return None
+
+def running_job_ids():
+    """Job IDs with a cgroup on this node, or None when job cgroups are not tracked"""
+    if not os.path.isdir(JOB_CGROUP_ROOT):
+        return None
+    return set(find_job_cgroups(JOB_CGROUP_ROOT))
+
+def notify(action, job_id):
+    """Send a checkpoint request to the running collector (used by prolog/epilog)"""
+    try:
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as client:
+            client.settimeout(NOTIFY_TIMEOUT)
+            client.connect(ENERGY_SOCKET)
+            client.sendall(f"{action} {job_id}\n".encode())
+            return 0 if client.recv(256).startswith(b'ok') else 1
+    except OSError:
+        return 1
+
+class AggregatorPusher:
+    """Batches per-job power deltas and pushes them to the cluster aggregator"""
+
+    def __init__(self, url):
+        self.url = url
+        # Sequence numbers restart with the collector; the boot id tells the aggregator
+        self.boot = f"{HOSTNAME}-{int(time.time())}"
+        self.seq = 0
+        self.pending = []
+        self.samples = {}
+        self.reported = set()
+        self.last_flush = time.time()
+
+    def record(self, job_id, user, account, watts):
+        self.samples[job_id] = (user, account, watts)
+
+    def flush(self):
+        now = time.time()
+        interval = now - self.last_flush
+        self.last_flush = now
+
+        self.seq += 1
+        self.pending.append({
+            'seq': self.seq,
+            'ts': now,
+            'jobs': [{'job_id': job_id, 'user': user, 'account': account,
+                      'watts': round(watts, 3), 'joules': round(watts * interval, 3)}
+                     for job_id, (user, account, watts) in self.samples.items()],
+            'finished': sorted(self.reported - set(self.samples)),
+        })
+        self.reported = set(self.samples)
+        self.samples = {}
+        if len(self.pending) > AGGREGATOR_MAX_PENDING:
+            logger.warning(f"Aggregator unreachable, dropping {len(self.pending) - AGGREGATOR_MAX_PENDING} old batches")
+            self.pending = self.pending[-AGGREGATOR_MAX_PENDING:]
+
+        # Unacknowledged batches are resent; the aggregator skips sequence numbers it has seen
+        body = json.dumps({'hostname': HOSTNAME, 'boot': self.boot, 'batches': self.pending}).encode()
+        request = urllib.request.Request(self.url, data=body, headers={'Content-Type': 'application/json'})
+        try:
+            with urllib.request.urlopen(request, timeout=AGGREGATOR_TIMEOUT) as response:
+                response.read()
+            self.pending = []
+        except Exception as e:
+            logger.warning(f"Error pushing to power aggregator: {e}")
+
+def collect_power_data(pusher=None):
     """Collect all power data and return metrics"""
     try:
         # Get power data from different components
@@ -218,6 +510,9 @@ def collect_power_data():
                     if os.cpu_count() > 0:
                         job_power = total_power * (alloc_cpus / os.cpu_count())
                         metrics.append(f'slurm_job_power_watts{{hostname="{HOSTNAME}",job_id="{job_id}",user="{job.get("UserId", "unknown")}"}} {job_power}')
+                        if pusher is not None:
+                            user = re.sub(r'\(\d+\)$', '', job.get('UserId', 'unknown'))
+                            pusher.record(job_id, user, job.get('Account', 'unknown'), job_power)
         
         # Add timestamp
         metrics.append(f'node_power_metrics_timestamp{{hostname="{HOSTNAME}"}} {int(time.time())}')
@@ -227,6 +522,52 @@ def collect_power_data():
         logger.error(f"Error collecting power data: {e}")
         return []
 
+def setup_power_capping():
+    """Controller for the configured capping mode, or None when capping is off"""
+    zones = discover_zones(RAPL_PATH)
+    enabled = POWER_CAP_MODE in ('node', 'group')
+    if enabled and POWER_CAP_MODE == 'group' and not AGGREGATOR_URL:
+        logger.warning("Group power capping needs POWER_AGGREGATOR_URL; capping disabled")
+        enabled = False
+    if enabled and not zones:
+        logger.warning("No RAPL powercap zones found; capping disabled")
+        enabled = False
+    if not enabled or POWER_CAP_DRY_RUN:
+        # Undo limits left behind by an earlier capping run that did not exit cleanly
+        try:
+            restore_limits(zones, CAP_STATE_FILE)
+        except OSError as e:
+            logger.error(f"Error restoring RAPL power limits: {e}")
+    if not enabled:
+        return None
+    logger.info(f"Power capping in {POWER_CAP_MODE} mode over {len(zones)} package(s)"
+                f"{' (dry run)' if POWER_CAP_DRY_RUN else ''}")
+    return PowerCapController(zones, dry_run=POWER_CAP_DRY_RUN, state_file=CAP_STATE_FILE)
+
+def update_power_cap(controller):
+    """Move the package limits toward this node's budget and return the cap metrics"""
+    if POWER_CAP_MODE == 'group':
+        try:
+            target = fetch_group_cap(re.sub(r'/push$', '/caps', AGGREGATOR_URL), HOSTNAME)
+        except Exception as e:
+            # Keep the current limits rather than lifting them while the aggregator is away
+            # or has no cap for this node yet
+            logger.warning(f"Error fetching power cap from aggregator: {e}")
+            target = controller.current_watts()
+    else:
+        target = POWER_CAP_NODE_WATTS or None
+
+    try:
+        controller.apply(target)
+    except OSError as e:
+        logger.error(f"Error writing RAPL power limit: {e}")
+
+    metrics = [f'node_power_cap_watts{{hostname="{HOSTNAME}"}} {controller.current_watts()}',
+               f'node_power_cap_dry_run{{hostname="{HOSTNAME}"}} {int(controller.dry_run)}']
+    if target is not None:
+        metrics.append(f'node_power_cap_target_watts{{hostname="{HOSTNAME}"}} {target}')
+    return metrics
+
 def write_metrics_to_file(metrics):
     """Write metrics to file for node_exporter textfile collector"""
     try:
@@ -241,14 +582,54 @@ def write_metrics_to_file(metrics):
 def main():
     logger.info("Starting power metrics collector")
     
+    # Exact job boundaries come from prolog/epilog checkpoints
+    tracker = JobEnergyTracker()
+    start_energy_socket(tracker)
+    pusher = AggregatorPusher(AGGREGATOR_URL) if AGGREGATOR_URL else None
+    capper = setup_power_capping()
+    nfs_io = NfsIoCollector(HOSTNAME) if NFS_IO_METRICS else None
+    # systemd stops the service with SIGTERM; exit through the finally below
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    
+    try:
+        run_collection_loop(tracker, pusher, capper, nfs_io)
+    finally:
+        if capper is not None:
+            try:
+                capper.restore()
+            except OSError as e:
+                logger.error(f"Error restoring RAPL power limits: {e}")
+
+def run_collection_loop(tracker, pusher, capper, nfs_io):
+    """Collect, cap and write metrics every COLLECTION_INTERVAL until the process exits"""
     while True:
         try:
             # Collect power data
-            metrics = collect_power_data()
+            metrics = collect_power_data(pusher)
+            
+            # Keep the packages under this node's share of the power budget
+            if capper is not None:
+                metrics += update_power_cap(capper)
             
             # Write metrics to file
             if metrics:
                 write_metrics_to_file(metrics)
+            if pusher is not None:
+                pusher.flush()
+            
+            # NFS and per-job I/O rates over the same interval
+            if nfs_io is not None:
+                try:
+                    nfs_lines = nfs_io.collect()
+                    if nfs_lines:
+                        write_nfs_io_metrics(nfs_lines)
+                except Exception as e:
+                    logger.error(f"Error collecting NFS I/O metrics: {e}")
+            
+            # Drop open jobs whose epilog was lost, then expire finished records from the textfile
+            tracker.expire(running_job_ids())
+            with tracker.lock:
+                tracker.write_metrics()
             
             # Wait for next collection cycle
             time.sleep(COLLECTION_INTERVAL)
@@ -257,4 +638,6 @@ def main():
             time.sleep(10)  # Wait a bit before retrying
 
 if __name__ == "__main__":
+    if len(sys.argv) == 3 and sys.argv[1] in ('start', 'end'):
+        sys.exit(notify(sys.argv[1], sys.argv[2]))
     main()
\ No newline at end of file
@@ -0,0 +1,329 @@
+#!/usr/bin/env python3
+"""
+Dashboard Query Analyzer
+Extracts the PromQL of every Grafana panel we ship, ranks the expressions by
+estimated evaluation cost and turns the expensive aggregated range functions
+into Prometheus recording rules, optionally rewriting the dashboards to read
+the recorded series instead
+"""
+
+import os
+import re
+import sys
+import json
+import hashlib
+import argparse
+import urllib.parse
+import urllib.request
+
+REPO_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+MONITORING = os.path.join(REPO_ROOT, 'roles', 'monitoring')
+
+# Configuration
+DASHBOARDS = [
+    os.path.join(MONITORING, 'files', 'node_exporter.json'),
+    os.path.join(MONITORING, 'files', 'proxmox_power_dashboard.json'),
+    os.path.join(MONITORING, 'templates', 'node_exporter.json'),
+    os.path.join(MONITORING, 'templates', 'proxmox_power_dashboard.json'),
+    os.path.join(MONITORING, 'templates', 'slurm-dashboard.json.j2'),
+    os.path.join(MONITORING, 'templates', 'slurm_power_dashboard.json.j2'),
+]
+RULES_FILE = os.path.join(MONITORING, 'templates', 'recording_rules.yml.j2')
+RULE_GROUP = 'dashboard_recording_rules'
+SCRAPE_INTERVAL = 15  # seconds; prometheus.yml.j2 global scrape_interval
+RATE_INTERVAL = '1m'  # Fixed range recorded for [$__rate_interval] (Grafana's 4x scrape minimum)
+DEFAULT_SERIES = 100  # Assumed series per metric without --cardinality/--prometheus
+MAX_RULES = 40
+
+RECORDABLE = ('rate', 'irate', 'increase', 'deriv', 'delta', 'idelta')
+# Aggregations that give the same result when applied again to their own output,
+# so a panel can re-aggregate a rule recorded by a superset of its labels
+REAGGREGATABLE = ('sum', 'min', 'max')
+AGGREGATIONS = ('sum', 'avg', 'min', 'max', 'count', 'count_values', 'stddev', 'stdvar',
+                'topk', 'bottomk', 'quantile', 'group')
+# Rough share of a metric's series left after one matcher
+SELECTIVITY = {'=': 0.1, '=~': 0.5, '!=': 0.9, '!~': 0.9}
+
+STRING = r'"(?:\\.|[^"\\])*"|\'(?:\\.|[^\'\\])*\'|`[^`]*`'
+METRIC = r'[a-zA-Z_:][a-zA-Z0-9_:]*'
+BRACE_SELECTOR_RE = re.compile(rf'(?<![\w:$])({METRIC})?\s*\{{((?:[^}}"\'`]|{STRING})*)\}}')
+BARE_SELECTOR_RE = re.compile(rf'(?<![\w:$])({METRIC})(?![\w:])(?!\s*\()')
+GROUPING_RE = re.compile(r'\b(by|without|on|ignoring|group_left|group_right)\s*\([^)]*\)')
+MATCHER_RE = re.compile(rf'([a-zA-Z_][a-zA-Z0-9_]*)\s*(=~|!~|!=|=)\s*({STRING})')
+RANGE_CALL = (rf'(?P<call>\b(?P<function>{"|".join(RECORDABLE)})\s*\(\s*(?P<metric>{METRIC})\s*'
+              rf'(?:\{{(?P<matchers>(?:[^}}"\'`]|{STRING})*)\}})?\s*\[(?P<range>[^\]:]+)\]\s*\))')
+AGGREGATED_CALL_RE = re.compile(
+    rf'\b(?P<aggregation>{"|".join(AGGREGATIONS)})\s*(?:(?P<pre>by|without)\s*\((?P<pre_labels>[^)]*)\)\s*)?'
+    rf'\(\s*{RANGE_CALL}\s*\)(?:\s*(?P<post>by|without)\s*\((?P<post_labels>[^)]*)\))?')
+RANGE_RE = re.compile(r'\[([^\]]+)\]')
+DURATION_RE = re.compile(r'(\d+)(ms|s|m|h|d|w|y)')
+DURATION_SECONDS = {'ms': 0.001, 's': 1, 'm': 60, 'h': 3600, 'd': 86400, 'w': 604800, 'y': 31536000}
+EXPR_RE = re.compile(r'("expr"\s*:\s*)("(?:\\.|[^"\\])*")')
+KEYWORDS = set(AGGREGATIONS) | {'by', 'without', 'on', 'ignoring', 'group_left', 'group_right', 'bool',
+                                'and', 'or', 'unless', 'offset', 'inf', 'nan'}
+
+def parse_duration(value):
+    """Seconds in a PromQL duration such as 1h30m, or None for variables"""
+    value = value.strip()
+    if value == '$__rate_interval':
+        value = RATE_INTERVAL
+    parts = DURATION_RE.findall(value)
+    if not parts or ''.join(n + u for n, u in parts) != value:
+        return None
+    return sum(int(n) * DURATION_SECONDS[u] for n, u in parts)
+
+def parse_matchers(text):
+    """(label, operator, quoted value) triples; None when the text holds anything else"""
+    matchers = MATCHER_RE.findall(text or '')
+    if MATCHER_RE.sub('', text or '').replace(',', '').strip():
+        return None
+    return matchers
+
+def format_matchers(matchers):
+    if not matchers:
+        return ''
+    return '{' + ','.join(f'{label}{op}{value}' for label, op, value in matchers) + '}'
+
+def normalize(expr):
+    """Collapse whitespace outside strings and sort the matchers of every selector"""
+    parts = re.split(rf'({STRING})', expr.strip())
+    for i in range(0, len(parts), 2):
+        text = re.sub(r'\s+', ' ', parts[i])
+        text = re.sub(r'([({\[])\s+', r'\1', text)
+        text = re.sub(r'\s+([)}\]])', r'\1', text)
+        text = re.sub(r'\s*,\s*', ',', text)
+        parts[i] = re.sub(r'\s*(=~|!~|!=|==|=)\s*', r'\1', text)
+    expr = ''.join(parts)
+    return re.sub(rf'\{{((?:[^}}"\'`]|{STRING})*)\}}',
+                  lambda m: format_matchers(sorted(parse_matchers(m.group(1)) or [])) or m.group(0), expr)
+
+def extract_queries(dashboard, source):
+    """Yield (source, panel title, expr) for every panel target, nested rows included"""
+    def walk(panels):
+        for panel in panels or []:
+            for target in panel.get('targets') or []:
+                if isinstance(target.get('expr'), str) and target['expr'].strip():
+                    yield source, panel.get('title', ''), target['expr']
+            yield from walk(panel.get('panels'))
+    yield from walk(dashboard.get('panels'))
+    for row in dashboard.get('rows') or []:
+        yield from walk(row.get('panels'))
+
+def _blank(match):
+    return ' ' * len(match.group(0))
+
+def _range_after(text, position):
+    following = RANGE_RE.match(text[position:].lstrip())
+    if not following:
+        return None
+    # Ranges we cannot resolve ($__range, $__interval) are costed like the rate interval
+    return parse_duration(following.group(1).split(':')[0]) or parse_duration(RATE_INTERVAL)
+
+def selectors(expr):
+    """(metric, matchers, range seconds) for each vector selector in the expression"""
+    found = []
+    for match in BRACE_SELECTOR_RE.finditer(expr):
+        metric, matchers = match.group(1), parse_matchers(match.group(2)) or []
+        metric = metric or next((value[1:-1] for label, op, value in matchers
+                                 if label == '__name__' and op == '='), None)
+        if metric:
+            found.append((metric, matchers, _range_after(expr, match.end())))
+
+    # Blank out everything that is not a bare metric name, keeping offsets
+    bare = BRACE_SELECTOR_RE.sub(_blank, expr)
+    bare = re.sub(STRING, _blank, bare)
+    bare = GROUPING_RE.sub(_blank, bare)
+    for match in BARE_SELECTOR_RE.finditer(bare):
+        metric = match.group(1)
+        if metric.lower() not in KEYWORDS:
+            found.append((metric, [], _range_after(bare, match.end())))
+    return found
+
+def estimate_cost(expr, cardinality, scrape_interval=SCRAPE_INTERVAL):
+    """Samples touched per evaluation: series left after matchers x samples per range"""
+    cost = 0.0
+    for metric, matchers, range_seconds in selectors(expr):
+        series = float(cardinality.get(metric, DEFAULT_SERIES))
+        for label, op, _ in matchers:
+            if label != '__name__':
+                series *= SELECTIVITY[op]
+        samples = max(series, 1.0) * (max(range_seconds / scrape_interval, 1.0) if range_seconds else 1.0)
+        cost += samples
+    # Every aggregation and binary operator walks its input once more
+    aggregations = len(re.findall(rf'\b({"|".join(AGGREGATIONS)})\b', expr))
+    return cost * (1 + 0.1 * aggregations)
+
+def rule_name(aggregation, labels, function, metric, range_text):
+    """level:metric:operations naming, the level being the labels the rule keeps"""
+    base = metric[:-len('_total')] if metric.endswith('_total') else metric
+    operation = f"{function}{range_text}" if aggregation == 'sum' else f"{aggregation}_{function}{range_text}"
+    return f"{'_'.join(labels) or 'cluster'}:{base}:{operation}"
+
+def recording_candidates(expr):
+    """Yield (span, rule name, rule expr, kept matchers) for range calls inside a re-aggregatable aggregation
+
+    The rule aggregates by the panel's grouping labels plus every label it
+    filters on, so the panel's matchers and aggregation still apply to the
+    much smaller recorded series. Bare range calls are not recorded: a
+    per-series rule stores as many series as its input and saves nothing.
+    """
+    for match in AGGREGATED_CALL_RE.finditer(expr):
+        if match.group('aggregation') not in REAGGREGATABLE:
+            continue  # avg, count, topk, ... change meaning when applied to pre-aggregated series
+        if 'without' in (match.group('pre'), match.group('post')):
+            continue  # The kept labels depend on the input series
+        range_text = match.group('range').strip()
+        if range_text == '$__rate_interval':
+            range_text = RATE_INTERVAL
+        if parse_duration(range_text) is None:
+            continue  # $__range, $__interval and friends follow the panel and cannot be recorded
+        matchers = parse_matchers(match.group('matchers'))
+        if matchers is None or any(label == '__name__' for label, _, _ in matchers):
+            continue  # Leave selectors we cannot parse untouched
+        grouping = (match.group('pre_labels') or '') + ',' + (match.group('post_labels') or '')
+        labels = sorted({label.strip() for label in grouping.split(',') if label.strip()}
+                        | {label for label, _, _ in matchers})
+        aggregation, function, metric = match.group('aggregation', 'function', 'metric')
+        yield (match.span('call'), rule_name(aggregation, labels, function, metric, range_text),
+               f"{aggregation} by ({', '.join(labels)}) ({function}({metric}[{range_text}]))", matchers)
+
+def rewrite_expr(expr, rules):
+    """Replace recordable range calls with the recorded series they map to"""
+    pieces, position = [], 0
+    for (start, end), name, _, matchers in recording_candidates(expr):
+        if name not in rules:
+            continue
+        pieces.append(expr[position:start])
+        pieces.append(name + format_matchers(matchers))
+        position = end
+    return ''.join(pieces) + expr[position:]
+
+def load_rules(path):
+    """{record: expr} from a rules file written by render_rules"""
+    rules, name = {}, None
+    try:
+        with open(path) as f:
+            for line in f:
+                line = line.strip()
+                if line.startswith('- record:'):
+                    name = line.split(':', 1)[1].strip()
+                elif line.startswith('expr:') and name:
+                    rules[name] = line.split(':', 1)[1].strip()
+                    name = None
+    except OSError:
+        pass
+    return rules
+
+def analyze(paths, cardinality, max_rules=MAX_RULES, existing=None):
+    """Return (ranked query rows, {rule name: rule expr}) for the dashboards"""
+    queries, seen = {}, set()
+    for path in paths:
+        with open(path, 'rb') as f:
+            content = f.read()
+        digest = hashlib.sha1(content).hexdigest()
+        if digest in seen:
+            continue  # The same dashboard is kept under files/ and templates/
+        seen.add(digest)
+        for source, title, expr in extract_queries(json.loads(content), os.path.basename(path)):
+            normalized = normalize(expr)
+            entry = queries.setdefault(normalized, {'expr': normalized, 'uses': 0, 'panels': []})
+            entry['uses'] += 1
+            entry['panels'].append(f"{source}: {title}")
+
+    savings, rules = {}, {}
+    for entry in queries.values():
+        entry['cost'] = estimate_cost(entry['expr'], cardinality)
+        for _, name, rule_expr, _ in recording_candidates(entry['expr']):
+            rules[name] = rule_expr
+            savings[name] = savings.get(name, 0.0) + entry['cost'] * entry['uses']
+    # Series that rewritten dashboards already read must keep being recorded
+    referenced = {metric: (existing or {})[metric] for entry in queries.values()
+                  for metric, _, _ in selectors(entry['expr']) if metric in (existing or {})}
+    ranked = sorted(queries.values(), key=lambda entry: entry['cost'] * entry['uses'], reverse=True)
+    candidates = [name for name in sorted(rules, key=lambda name: (-savings[name], name)) if name not in referenced]
+    kept = dict(referenced)
+    kept.update({name: rules[name] for name in candidates[:max(max_rules - len(referenced), 0)]})
+    return ranked, dict(sorted(kept.items()))
+
+def render_rules(rules):
+    lines = [
+        '# Generated by scripts/dashboard_rules.py from the Grafana dashboards; regenerate instead of editing',
+        'groups:',
+        f'- name: {RULE_GROUP}',
+        '  rules:',
+    ]
+    for name, expr in rules.items():
+        lines.append(f'  - record: {name}')
+        lines.append(f'    expr: {expr}')
+    return '\n'.join(lines) + '\n'
+
+def rewrite_dashboard(path, rules):
+    """Rewrite panel expressions in place, keeping the rest of the file byte for byte"""
+    with open(path, 'r', encoding='utf-8') as f:
+        content = f.read()
+    changed = 0
+
+    def replace(match):
+        nonlocal changed
+        expr = json.loads(match.group(2))
+        rewritten = rewrite_expr(expr, rules)
+        if rewritten == expr:
+            return match.group(0)
+        changed += 1
+        return match.group(1) + json.dumps(rewritten, ensure_ascii=False)
+
+    content = EXPR_RE.sub(replace, content)
+    if changed:
+        with open(path, 'w', encoding='utf-8') as f:
+            f.write(content)
+    return changed
+
+def fetch_cardinality(url, metrics):
+    """Live series count per metric from a Prometheus server"""
+    query = 'count by (__name__) ({__name__=~"' + '|'.join(sorted(metrics)) + '"})'
+    with urllib.request.urlopen(f"{url.rstrip('/')}/api/v1/query?{urllib.parse.urlencode({'query': query})}",
+                                timeout=60) as response:
+        payload = json.load(response)
+    return {series['metric']['__name__']: int(float(series['value'][1])) for series in payload['data']['result']}
+
+def main():
+    parser = argparse.ArgumentParser(description='Rank dashboard PromQL by cost and generate recording rules')
+    parser.add_argument('dashboards', nargs='*', default=DASHBOARDS)
+    parser.add_argument('--rules-file', default=RULES_FILE)
+    parser.add_argument('--max-rules', type=int, default=MAX_RULES)
+    parser.add_argument('--cardinality', help='JSON file mapping metric name to series count')
+    parser.add_argument('--prometheus', help='Prometheus URL to read live series counts from')
+    parser.add_argument('--top', type=int, default=20, help='Expensive queries to list')
+    parser.add_argument('--rewrite', action='store_true', help='Rewrite the dashboards to use the recorded series')
+    args = parser.parse_args()
+
+    cardinality = {}
+    if args.cardinality:
+        with open(args.cardinality) as f:
+            cardinality = json.load(f)
+    if args.prometheus:
+        metrics = set()
+        for path in args.dashboards:
+            with open(path) as f:
+                for _, _, expr in extract_queries(json.load(f), path):
+                    metrics.update(metric for metric, _, _ in selectors(normalize(expr)))
+        try:
+            cardinality.update(fetch_cardinality(args.prometheus, metrics))
+        except Exception as e:
+            print(f"Error reading series counts from {args.prometheus}: {e}", file=sys.stderr)
+
+    ranked, rules = analyze(args.dashboards, cardinality, args.max_rules, load_rules(args.rules_file))
+    print(f"{'Cost':>12} {'Uses':>4}  Expression")
+    for entry in ranked[:args.top]:
+        print(f"{entry['cost'] * entry['uses']:>12.0f} {entry['uses']:>4}  {entry['expr']}")
+
+    with open(args.rules_file, 'w') as f:
+        f.write(render_rules(rules))
+    print(f"\nWrote {len(rules)} recording rules to {args.rules_file}")
+
+    if args.rewrite:
+        for path in args.dashboards:
+            print(f"Rewrote {rewrite_dashboard(path, rules)} expressions in {path}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,594 @@
+#!/usr/bin/env python3
+"""
+Template Render and Validation Engine
+Renders every role template (roles/*/templates/**/*.j2) against the inventory,
+group_vars, role defaults and play vars without running Ansible, syntax-checks
+the output by file type and caches results by a hash of template plus variables
+"""
+
+import os
+import re
+import sys
+import glob
+import json
+import hashlib
+import argparse
+import functools
+import ipaddress
+from concurrent.futures import ProcessPoolExecutor
+
+import yaml
+import jinja2
+
+SafeLoader = getattr(yaml, 'CSafeLoader', yaml.SafeLoader)
+
+REPO_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+
+# Configuration
+INVENTORY = os.path.join(REPO_ROOT, 'inventory', 'hosts')
+CACHE_FILE = os.path.join(REPO_ROOT, '.cache', 'render_templates.json')
+ENGINE_VERSION = '1'  # Bump to invalidate every cached result
+MAX_CACHE_ENTRIES = 5000  # Older entries are dropped past this
+# Stand-ins for facts Ansible would gather from each host
+DEFAULT_FACTS = {
+    'ansible_architecture': 'x86_64',
+    'ansible_distribution': 'Rocky',
+    'ansible_distribution_major_version': '9',
+    'ansible_distribution_release': 'Blue Onyx',
+    'ansible_os_family': 'RedHat',
+    'ansible_processor_vcpus': 4,
+    'ansible_memtotal_mb': 16384,
+    'ansible_date_time': {'epoch': '1700000000', 'date': '2023-11-14', 'time': '22:13:20',
+                          'iso8601': '2023-11-14T22:13:20Z'},
+    'ansible_managed': 'Ansible managed',
+}
+
+SLURM_CONF_KEYS = {key.lower() for key in """
+AccountingStorageBackupHost AccountingStorageEnforce AccountingStorageExternalHost AccountingStorageHost
+AccountingStorageParameters AccountingStoragePass AccountingStoragePort AccountingStorageTRES
+AccountingStorageType AccountingStorageUser AccountingStoreFlags AcctGatherEnergyType
+AcctGatherFilesystemType AcctGatherInterconnectType AcctGatherNodeFreq AcctGatherProfileType
+AllowSpecResourcesUsage AuthAltParameters AuthAltTypes AuthInfo AuthType BatchStartTimeout
+BcastExclude BcastParameters BurstBufferType CliFilterPlugins ClusterName CommunicationParameters
+CompleteWait CoreSpecPlugin CpuFreqDef CpuFreqGovernors CredType CryptoType DebugFlags DefCpuPerGPU
+DefMemPerCPU DefMemPerGPU DefMemPerNode DependencyParameters DisableRootJobs EioTimeout
+EnforcePartLimits Epilog EpilogMsgTime EpilogSlurmctld ExtSensorsFreq ExtSensorsType FairShareDampeningFactor
+FederationParameters FirstJobId GetEnvTimeout GresTypes GroupUpdateForce GroupUpdateTime
+GpuFreqDef HealthCheckInterval HealthCheckNodeState HealthCheckProgram InactiveLimit InteractiveStepOptions
+JobAcctGatherFrequency JobAcctGatherType JobAcctGatherParams JobCompHost JobCompLoc JobCompParams
+JobCompPass JobCompPort JobCompType JobCompUser JobContainerType JobCredentialPrivateKey
+JobCredentialPublicCertificate JobDefaults JobFileAppend JobRequeue JobSubmitPlugins KillOnBadExit
+KillWait LaunchParameters LaunchType Licenses LogTimeFormat MailDomain MailProg MaxArraySize
+MaxBatchRequeue MaxDBDMsgs MaxJobCount MaxJobId MaxMemPerCPU MaxMemPerNode MaxNodeCount MaxStepCount
+MaxTasksPerNode MCSParameters MCSPlugin MessageTimeout MinJobAge MpiDefault MpiParams OverTimeLimit
+PluginDir PlugStackConfig PowerParameters PowerPlugin PreemptExemptTime PreemptMode PreemptParameters
+PreemptType PrEpParameters PrEpPlugins PriorityCalcPeriod PriorityDecayHalfLife PriorityFavorSmall
+PriorityFlags PriorityMaxAge PriorityParameters PrioritySiteFactorParameters PrioritySiteFactorPlugin
+PriorityType PriorityUsageResetPeriod PriorityWeightAge PriorityWeightAssoc PriorityWeightFairshare
+PriorityWeightJobSize PriorityWeightPartition PriorityWeightQOS PriorityWeightTRES PrivateData
+ProctrackType Prolog PrologEpilogTimeout PrologFlags PrologSlurmctld PropagatePrioProcess
+PropagateResourceLimits PropagateResourceLimitsExcept RebootProgram ReconfigFlags RequeueExit
+RequeueExitHold ResumeFailProgram ResumeProgram ResumeRate ResumeTimeout ResvEpilog ResvOverRun
+ResvProlog ReturnToService RoutePlugin SchedulerParameters SchedulerTimeSlice SchedulerType
+ScronParameters SelectType SelectTypeParameters SlurmctldAddr SlurmctldDebug SlurmctldHost
+SlurmctldLogFile SlurmctldParameters SlurmctldPidFile SlurmctldPort SlurmctldPrimaryOffProg
+SlurmctldPrimaryOnProg SlurmctldSyslogDebug SlurmctldTimeout SlurmdDebug SlurmdLogFile SlurmdParameters
+SlurmdPidFile SlurmdPort SlurmdSpoolDir SlurmdSyslogDebug SlurmdTimeout SlurmdUser SlurmSchedLogFile
+SlurmSchedLogLevel SlurmUser SrunEpilog SrunPortRange SrunProlog StateSaveLocation SuspendExcNodes
+SuspendExcParts SuspendExcStates SuspendProgram SuspendRate SuspendTime SuspendTimeout SwitchParameters
+SwitchType TaskEpilog TaskPlugin TaskPluginParam TaskProlog TCPTimeout TmpFS TopologyParam TopologyPlugin
+TrackWCKey TreeWidth UnkillableStepProgram UnkillableStepTimeout UsePAM VSizeFactor WaitTime X11Parameters
+ControlMachine ControlAddr BackupController BackupAddr FastSchedule
+""".split()}
+# Lines that start with these keys describe one entity with its own parameters
+SLURM_CONF_ENTITIES = {'nodename', 'partitionname', 'nodeset', 'downnodes', 'frontendname', 'switchname'}
+SLURM_CONF_REQUIRED = ('clustername',)
+
+class RecordingUndefined(jinja2.ChainableUndefined):
+    """Renders as an empty string and remembers which names were missing"""
+    missing = set()
+
+    def __str__(self):
+        RecordingUndefined.missing.add(self._undefined_name or '?')
+        return ''
+
+def _regex_replace(value, pattern='', replacement='', ignorecase=False, multiline=False):
+    flags = (re.I if ignorecase else 0) | (re.M if multiline else 0)
+    return re.sub(pattern, replacement, str(value), flags=flags)
+
+def _regex_search(value, pattern, *args):
+    match = re.search(pattern, str(value))
+    return match.group(0) if match else None
+
+def _ipaddr(value, query=''):
+    """The subset of Ansible's ipaddr filter our templates use"""
+    try:
+        interface = ipaddress.ip_interface(str(value))
+    except ValueError:
+        return False
+    if query == 'address':
+        return str(interface.ip)
+    if query == 'network':
+        return str(interface.network.network_address)
+    if query == 'prefix':
+        return interface.network.prefixlen
+    if query == 'revdns':
+        return interface.ip.reverse_pointer + '.'
+    return str(value)
+
+def _bool(value):
+    return str(value).strip().lower() in ('yes', 'on', '1', 'true', 'y')
+
+def _combine(*dicts, recursive=False):
+    result = {}
+    for item in dicts:
+        result.update(item)
+    return result
+
+def _ternary(value, true_value, false_value, none_value=None):
+    if value is None and none_value is not None:
+        return none_value
+    return true_value if value else false_value
+
+ANSIBLE_FILTERS = {
+    'regex_replace': _regex_replace,
+    'regex_search': _regex_search,
+    'ipaddr': _ipaddr,
+    'ansible.utils.ipaddr': _ipaddr,
+    'bool': _bool,
+    'combine': _combine,
+    'ternary': _ternary,
+    'to_json': lambda value, **kwargs: json.dumps(value, **kwargs),
+    'to_nice_json': lambda value, indent=4, **kwargs: json.dumps(value, indent=indent, sort_keys=True),
+    'to_yaml': lambda value, **kwargs: yaml.safe_dump(value, **kwargs),
+    'to_nice_yaml': lambda value, indent=2, **kwargs: yaml.safe_dump(value, indent=indent, default_flow_style=False),
+    'from_json': json.loads,
+    'from_yaml': yaml.safe_load,
+    'basename': os.path.basename,
+    'dirname': os.path.dirname,
+    'quote': lambda value: "'" + str(value).replace("'", "'\"'\"'") + "'",
+    'mandatory': lambda value, msg=None: value,
+    'password_hash': lambda value, *args, **kwargs: '$6$rendered$' + hashlib.sha256(str(value).encode()).hexdigest(),
+    'b64encode': lambda value: __import__('base64').b64encode(str(value).encode()).decode(),
+    'hash': lambda value, algorithm='sha1': hashlib.new(algorithm, str(value).encode()).hexdigest(),
+}
+
+def make_environment(search_path=None):
+    """A Jinja environment configured the way Ansible's templar is"""
+    env = jinja2.Environment(
+        loader=jinja2.FileSystemLoader(search_path or REPO_ROOT),
+        undefined=RecordingUndefined,
+        trim_blocks=True,
+        keep_trailing_newline=True,
+    )
+    env.filters.update(ANSIBLE_FILTERS)
+    env.tests['match'] = lambda value, pattern: re.match(pattern, str(value)) is not None
+    env.tests['search'] = lambda value, pattern: re.search(pattern, str(value)) is not None
+    return env
+
+@functools.lru_cache(maxsize=None)
+def _load_yaml(path):
+    """Parsed vars file, read once per run; callers must not mutate the result"""
+    with open(path) as f:
+        content = f.read()
+    if content.startswith('$ANSIBLE_VAULT'):
+        return {}  # Encrypted; secrets stay undefined
+    return yaml.load(content, Loader=SafeLoader) or {}
+
+def _var_files(directory, name):
+    """Files Ansible reads for a group_vars/host_vars entry (name.yml or name/*.yml)"""
+    paths = [os.path.join(directory, f"{name}{ext}") for ext in ('', '.yml', '.yaml')]
+    paths += sorted(glob.glob(os.path.join(directory, name, '*.yml')) + glob.glob(os.path.join(directory, name, '*.yaml')))
+    return [path for path in paths if os.path.isfile(path)]
+
+def load_inventory(path=INVENTORY):
+    """Parse an INI inventory into ({group: [hosts]}, {host: vars})"""
+    groups, hostvars, children = {}, {}, {}
+    section = None
+    with open(path) as f:
+        for raw in f:
+            line = raw.split('#', 1)[0].strip() if not raw.lstrip().startswith(';') else ''
+            if not line:
+                continue
+            if line.startswith('['):
+                section = line.strip('[]')
+                if section.endswith(':children'):
+                    children.setdefault(section[:-len(':children')], [])
+                elif not section.endswith(':vars'):
+                    groups.setdefault(section, [])
+                continue
+            if section and section.endswith(':children'):
+                children[section[:-len(':children')]].append(line)
+            elif section and section.endswith(':vars'):
+                key, _, value = line.partition('=')
+                group = section[:-len(':vars')]
+                for host in groups.get(group, []):
+                    hostvars.setdefault(host, {}).setdefault(key.strip(), value.strip())
+            else:
+                host, *assignments = line.split()
+                groups.setdefault(section or 'ungrouped', [])
+                if host not in groups[section or 'ungrouped']:
+                    groups[section or 'ungrouped'].append(host)
+                variables = hostvars.setdefault(host, {})
+                for assignment in assignments:
+                    key, _, value = assignment.partition('=')
+                    variables[key] = value
+
+    def members(group, seen=()):
+        hosts = list(groups.get(group, []))
+        for child in children.get(group, []):
+            if child not in seen:
+                hosts += [host for host in members(child, seen + (group,)) if host not in hosts]
+        return hosts
+
+    resolved = {group: members(group) for group in set(groups) | set(children)}
+    resolved['all'] = list(hostvars)
+    return resolved, hostvars
+
+def role_plays(root=REPO_ROOT):
+    """{role: (host pattern, play vars)} from the first play that applies each role"""
+    plays = {}
+    paths = sorted(glob.glob(os.path.join(root, '*.yml')) + glob.glob(os.path.join(root, 'playbooks', '**', '*.yml'),
+                                                                        recursive=True))
+    for path in paths:
+        try:
+            with open(path) as f:
+                documents = yaml.safe_load(f)
+        except (yaml.YAMLError, OSError):
+            continue
+        for play in documents if isinstance(documents, list) else []:
+            if not isinstance(play, dict) or 'hosts' not in play:
+                continue
+            for role in play.get('roles') or []:
+                name = role.get('role') if isinstance(role, dict) else role
+                if isinstance(name, str):
+                    plays.setdefault(name, (str(play['hosts']), play.get('vars') or {}))
+    return plays
+
+def _resolve(value, env, context, depth=0):
+    """Template vars that reference other vars, as Ansible does lazily"""
+    if isinstance(value, str) and ('{{' in value or '{%' in value) and depth < 5:
+        try:
+            rendered = env.from_string(value).render(context)
+        except Exception:
+            return value
+        if rendered != value and re.fullmatch(r'-?\d+', rendered.strip() or 'x'):
+            return int(rendered)
+        return _resolve(rendered, env, context, depth + 1)
+    if isinstance(value, dict):
+        return {key: _resolve(item, env, context, depth) for key, item in value.items()}
+    if isinstance(value, list):
+        return [_resolve(item, env, context, depth) for item in value]
+    return value
+
+def _plain(value):
+    """Drop Undefined and other objects JSON cannot hash"""
+    if isinstance(value, dict):
+        return {str(key): _plain(item) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [_plain(item) for item in value]
+    if isinstance(value, (str, int, float, bool)) or value is None:
+        return value
+    return str(value)
+
+def build_context(host, groups, inventory_vars, role=None, play_vars=None, facts=None, root=REPO_ROOT):
+    """Variables a template sees on one host, in Ansible's precedence order"""
+    group_vars_dir = os.path.join(root, 'inventory', 'group_vars')
+    host_vars_dir = os.path.join(root, 'inventory', 'host_vars')
+    host_groups = sorted(group for group, hosts in groups.items() if host in hosts and group != 'all')
+
+    def host_context(name):
+        variables = dict(DEFAULT_FACTS)
+        variables.update(facts or {})
+        address = inventory_vars.get(name, {}).get('ansible_host', name)
+        variables.update({
+            'inventory_hostname': name,
+            'inventory_hostname_short': name.split('.')[0],
+            'ansible_hostname': name.split('.')[0],
+            'ansible_fqdn': name,
+            'ansible_host': address,
+            'ansible_default_ipv4': {'address': address},
+            'group_names': sorted(g for g, hosts in groups.items() if name in hosts and g != 'all'),
+        })
+        for path in _var_files(group_vars_dir, 'all'):
+            variables.update(_load_yaml(path))
+        for group in variables['group_names']:
+            for path in _var_files(group_vars_dir, group):
+                variables.update(_load_yaml(path))
+        for path in _var_files(host_vars_dir, name):
+            variables.update(_load_yaml(path))
+        variables.update(inventory_vars.get(name, {}))
+        return variables
+
+    context = {}
+    if role:
+        role_dir = os.path.join(root, 'roles', role)
+        context.update(_load_yaml(os.path.join(role_dir, 'defaults', 'main.yml'))
+                       if os.path.isfile(os.path.join(role_dir, 'defaults', 'main.yml')) else {})
+        context['role_path'] = role_dir
+        context['role_name'] = role
+    context.update(host_context(host))
+    context['group_names'] = host_groups
+    if role and os.path.isfile(os.path.join(root, 'roles', role, 'vars', 'main.yml')):
+        context.update(_load_yaml(os.path.join(root, 'roles', role, 'vars', 'main.yml')))
+    context.update(play_vars or {})
+    context['groups'] = groups
+    context['hostvars'] = {name: host_context(name) for name in inventory_vars}
+    context['playbook_dir'] = root
+
+    env = make_environment()
+    for _ in range(2):
+        context = {key: (value if key in ('groups', 'hostvars') else _resolve(value, env, context))
+                   for key, value in context.items()}
+    return _plain(context)
+
+def pick_host(pattern, groups):
+    """First inventory host matched by a play's hosts pattern"""
+    for term in re.split(r'[:,]', pattern):
+        term = term.strip().lstrip('&')
+        if not term or term.startswith('!'):
+            continue
+        if term in groups and groups[term]:
+            return groups[term][0]
+        if term in groups.get('all', []):
+            return term
+    return groups['all'][0] if groups.get('all') else 'localhost'
+
+# Output validation by rendered file type
+
+def check_python(text, name):
+    compile(text, name, 'exec')
+
+def check_yaml(text, name):
+    list(yaml.safe_load_all(text))
+
+def check_json(text, name):
+    json.loads(text)
+
+def check_slurm_conf(text, name):
+    """Every line is Key=Value pairs with known keys; ClusterName is present"""
+    seen = {}
+    for number, raw in enumerate(text.splitlines(), 1):
+        line = raw.split('#', 1)[0].strip()
+        if not line:
+            continue
+        tokens = line.split()
+        pairs = [token.partition('=') for token in tokens]
+        for key, separator, value in pairs:
+            if not separator or not key:
+                raise ValueError(f"line {number}: expected Key=Value, got {key!r}")
+            if '\\' in value:
+                raise ValueError(f"line {number}: stray escape in {key}={value}")
+        key = pairs[0][0].lower()
+        if key in SLURM_CONF_ENTITIES:
+            if not pairs[0][2]:
+                raise ValueError(f"line {number}: {pairs[0][0]} needs a value")
+            continue
+        if key not in SLURM_CONF_KEYS:
+            raise ValueError(f"line {number}: unknown parameter {pairs[0][0]}")
+        if len(pairs) > 1:
+            raise ValueError(f"line {number}: {pairs[0][0]} takes a single value")
+        if key in seen and key not in ('slurmctldhost', 'include'):
+            raise ValueError(f"line {number}: {pairs[0][0]} already set on line {seen[key]}")
+        seen[key] = number
+    for key in SLURM_CONF_REQUIRED:
+        if key not in seen:
+            raise ValueError(f"missing required parameter {key}")
+    if 'slurmctldhost' not in seen and 'controlmachine' not in seen:
+        raise ValueError("missing SlurmctldHost")
+
+def validator_for(output_name):
+    base = os.path.basename(output_name)
+    if base == 'slurm.conf':
+        return 'slurm.conf', check_slurm_conf
+    extension = os.path.splitext(base)[1]
+    return {
+        '.py': ('python', check_python),
+        '.yml': ('yaml', check_yaml),
+        '.yaml': ('yaml', check_yaml),
+        '.json': ('json', check_json),
+    }.get(extension, (None, None))
+
+# Rendering
+
+_WORKER_CONTEXTS = {}
+
+def _init_worker(contexts):
+    global _WORKER_CONTEXTS
+    _WORKER_CONTEXTS = contexts
+
+def _output_name(path):
+    return path[:-len('.j2')] if path.endswith('.j2') else path
+
+def render_one(path, context_key, output_path=None, verbatim=False):
+    """Render and validate one template; returns a result dict"""
+    context = _WORKER_CONTEXTS[context_key]
+    RecordingUndefined.missing = set()
+    env = make_environment(os.path.dirname(path))
+    result = {'path': os.path.relpath(path, REPO_ROOT), 'host': context.get('inventory_hostname'),
+              'undefined': []}
+    kind, check = validator_for(_output_name(path))
+    result['kind'] = kind
+    try:
+        with open(path) as f:
+            text = f.read()
+        # Files deployed with copy keep their Jinja for the script to render at run time
+        if not verbatim:
+            text = env.from_string(text).render(context)
+    except jinja2.TemplateSyntaxError as e:
+        result.update(status='failed', message=f"template syntax error on line {e.lineno}: {e.message}")
+        return result
+    except jinja2.UndefinedError as e:
+        result.update(status='undefined', message=f"render needs {e.message}")
+        return result
+    except Exception as e:
+        status = 'undefined' if RecordingUndefined.missing else 'failed'
+        result.update(status=status, message=f"render error: {type(e).__name__}: {e}",
+                      undefined=sorted(RecordingUndefined.missing))
+        return result
+
+    result['output_digest'] = hashlib.sha256(text.encode()).hexdigest()
+    result['undefined'] = sorted(RecordingUndefined.missing)
+    if output_path:
+        os.makedirs(os.path.dirname(output_path), exist_ok=True)
+        with open(output_path, 'w') as f:
+            f.write(text)
+    if check:
+        try:
+            check(text, result['path'])
+        except Exception as e:
+            # Output that only breaks because a runtime variable was blank is not a template bug
+            status = 'undefined' if result['undefined'] else 'failed'
+            note = ' (deployed with copy, so its Jinja is never rendered)' if verbatim else ''
+            result.update(status=status, message=f"invalid {kind}{note}: {type(e).__name__}: {e}")
+            return result
+    result['status'] = 'ok'
+    return result
+
+def copied_templates(root=REPO_ROOT):
+    """Templates that role tasks deploy with copy, i.e. without rendering them"""
+    copied = set()
+    for tasks_file in glob.glob(os.path.join(root, 'roles', '*', 'tasks', '*.yml')):
+        files_dir = os.path.join(os.path.dirname(os.path.dirname(tasks_file)), 'files')
+        try:
+            with open(tasks_file) as f:
+                tasks = yaml.safe_load(f) or []
+        except (yaml.YAMLError, OSError):
+            continue
+        pending = list(tasks) if isinstance(tasks, list) else []
+        while pending:
+            task = pending.pop()
+            if not isinstance(task, dict):
+                continue
+            pending += [item for key in ('block', 'rescue', 'always') for item in task.get(key) or []]
+            module = task.get('copy') or task.get('ansible.builtin.copy')
+            if not isinstance(module, dict) or not module.get('src'):
+                continue
+            items = task.get('loop') or task.get('with_items') or [None]
+            for item in items if isinstance(items, list) else [None]:
+                src = re.sub(r'\{\{\s*item\s*\}\}', str(item), str(module['src']))
+                src = re.sub(r'\{\{\s*playbook_dir\s*\}\}', root, src)
+                if src.endswith('.j2'):
+                    copied.add(os.path.normpath(os.path.join(files_dir, src)))
+    return copied
+
+def discover_templates(root=REPO_ROOT, roles=None):
+    paths = sorted(glob.glob(os.path.join(root, 'roles', '*', 'templates', '**', '*.j2'), recursive=True))
+    if roles:
+        paths = [path for path in paths if os.path.relpath(path, root).split(os.sep)[1] in roles]
+    return paths
+
+def _digest(*parts):
+    digest = hashlib.sha256(ENGINE_VERSION.encode())
+    for part in parts:
+        digest.update(b'\0' + (part if isinstance(part, bytes) else part.encode()))
+    return digest.hexdigest()
+
+def load_cache(path):
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+def save_cache(path, cache):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump(cache, f, sort_keys=True)
+    os.replace(tmp_path, path)
+
+def run(templates, root=REPO_ROOT, inventory=INVENTORY, host=None, facts=None, cache_file=CACHE_FILE,
+        workers=None, output_dir=None):
+    """Render and validate templates; returns the list of result dicts"""
+    groups, inventory_vars = load_inventory(inventory)
+    plays = role_plays(root)
+
+    # One variable context per (role, host); templates of a role share it
+    contexts, jobs = {}, []
+    for path in templates:
+        role = os.path.relpath(path, root).split(os.sep)[1]
+        pattern, play_vars = plays.get(role, ('all', {}))
+        target = host or pick_host(pattern, groups)
+        context_key = f"{role}@{target}"
+        if context_key not in contexts:
+            contexts[context_key] = build_context(target, groups, inventory_vars, role, play_vars, facts, root)
+        jobs.append((path, context_key))
+
+    context_digests = {key: _digest(json.dumps(context, sort_keys=True)) for key, context in contexts.items()}
+    cache = load_cache(cache_file) if cache_file else {}
+    copied = copied_templates(root)
+    results, pending, used = [], [], set()
+    for path, context_key in jobs:
+        with open(path, 'rb') as f:
+            key = _digest(os.path.relpath(path, root), f.read(), context_digests[context_key],
+                          str(os.path.normpath(path) in copied))
+        used.add(key)
+        output_path = (os.path.join(output_dir, _output_name(os.path.relpath(path, os.path.join(root, 'roles'))))
+                       if output_dir else None)
+        cached = cache.get(key)
+        if cached and (not output_path or _file_digest(output_path) == cached.get('output_digest')):
+            results.append(dict(cached, cached=True))
+        else:
+            pending.append((key, path, context_key, output_path))
+
+    if pending:
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(contexts,)) as pool:
+            futures = [(key, pool.submit(render_one, path, context_key, output_path,
+                                         os.path.normpath(path) in copied))
+                       for key, path, context_key, output_path in pending]
+            for key, future in futures:
+                result = future.result()
+                cache[key] = result
+                results.append(dict(result, cached=False))
+
+    if cache_file:
+        if len(cache) > MAX_CACHE_ENTRIES:
+            cache = {key: cache[key] for key in used}
+        save_cache(cache_file, cache)
+    return sorted(results, key=lambda result: result['path'])
+
+def _file_digest(path):
+    try:
+        with open(path, 'rb') as f:
+            return hashlib.sha256(f.read()).hexdigest()
+    except OSError:
+        return None
+
+def main():
+    parser = argparse.ArgumentParser(description='Render and validate role templates without running Ansible')
+    parser.add_argument('templates', nargs='*', help='Templates to check (default: every role template)')
+    parser.add_argument('--role', action='append', help='Only check templates of this role')
+    parser.add_argument('--inventory', default=INVENTORY)
+    parser.add_argument('--host', help='Render every template for this host instead of its play target')
+    parser.add_argument('--facts', help='YAML file overriding the stand-in host facts')
+    parser.add_argument('--cache', default=CACHE_FILE)
+    parser.add_argument('--no-cache', action='store_true')
+    parser.add_argument('--workers', type=int, help='Render processes (default: CPU count)')
+    parser.add_argument('--output-dir', help='Also write rendered files here')
+    parser.add_argument('--strict', action='store_true', help='Also fail templates that need undefined variables')
+    parser.add_argument('-v', '--verbose', action='store_true', help='List undefined variables per template')
+    args = parser.parse_args()
+
+    templates = [os.path.abspath(path) for path in args.templates] or discover_templates(REPO_ROOT, args.role)
+    facts = _load_yaml(args.facts) if args.facts else None
+    results = run(templates, REPO_ROOT, args.inventory, args.host, facts,
+                  None if args.no_cache else args.cache, args.workers, args.output_dir)
+
+    failing = ('failed', 'undefined') if args.strict else ('failed',)
+    failed = [result for result in results if result['status'] in failing]
+    for result in results:
+        if result['status'] in failing:
+            print(f"FAIL {result['path']} ({result['host']}): {result['message']}")
+        elif result['status'] == 'undefined' or (args.verbose and result.get('undefined')):
+            detail = result.get('message') or 'renders with blank values'
+            missing = ', '.join(result.get('undefined') or [])
+            print(f"WARN {result['path']} ({result['host']}): {detail}" + (f" [undefined: {missing}]" if missing else ''))
+    cached = sum(1 for result in results if result['cached'])
+    checked = sum(1 for result in results if result.get('kind') and result['status'] == 'ok')
+    print(f"{len(results)} templates: {sum(r['status'] == 'ok' for r in results)} ok, {len(failed)} failed, "
+          f"{checked} syntax-checked, {cached} from cache")
+    sys.exit(1 if failed else 0)
+
+if __name__ == "__main__":
+    main()
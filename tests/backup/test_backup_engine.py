@@ -0,0 +1,98 @@
+#!/usr/bin/env python3
+# Tests for the incremental hardlink backup engine
+
+import os
+import sys
+import shutil
+from datetime import datetime, timedelta
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', '..', 'roles', 'backup', 'files'))
+
+from backup_engine import BackupEngine, dest_names, run_rsync
+
+def copy_transfer(calls):
+    """Stand-in for rsync -a that records which trees it was asked to copy"""
+    def transfer(source, dest, link_dest=None, options=None, top_level_only=False):
+        calls.append((source, link_dest))
+        for name in os.listdir(source):
+            path = os.path.join(source, name)
+            if os.path.isdir(path) and not os.path.islink(path):
+                if not top_level_only:
+                    shutil.copytree(path, os.path.join(dest, name), symlinks=True, dirs_exist_ok=True)
+            else:
+                shutil.copy2(path, os.path.join(dest, name), follow_symlinks=False)
+        shutil.copystat(source, dest)
+    return transfer
+
+@pytest.fixture
+def home(tmp_path):
+    home = tmp_path / 'home'
+    for user, files in {'alice': {'notes.txt': 'a1', 'data/run.csv': '1,2'}, 'bob': {'job.sh': 'echo'}}.items():
+        for name, content in files.items():
+            path = home / user / name
+            path.parent.mkdir(parents=True, exist_ok=True)
+            path.write_text(content)
+    (home / 'README').write_text('shared')
+    return home
+
+def test_unchanged_units_are_linked_without_transfer(tmp_path, home):
+    calls = []
+    engine = BackupEngine(str(tmp_path / 'backups'), jobs=2, transfer=copy_transfer(calls))
+    first = engine.snapshot([str(home)], now=datetime(2026, 1, 1, 1, 0, 0))
+    assert len(calls) == 3  # alice, bob and the loose files
+    assert open(os.path.join(first, 'home', 'alice', 'data', 'run.csv')).read() == '1,2'
+    assert os.path.realpath(os.path.join(tmp_path, 'backups', 'latest')) == first
+
+    os.utime(home / 'bob' / 'job.sh', (0, 1_000_000_000))
+    calls.clear()
+    second = engine.snapshot([str(home)], now=datetime(2026, 1, 2, 1, 0, 0))
+    assert [source for source, _ in calls] == [str(home / 'bob')]
+    assert calls[0][1] == os.path.join(first, 'home', 'bob')
+    old, new = (os.stat(os.path.join(path, 'home', 'alice', 'notes.txt')) for path in (first, second))
+    assert old.st_ino == new.st_ino
+    assert os.path.exists(os.path.join(second, 'home', 'README'))
+    assert not [name for name in os.listdir(tmp_path / 'backups') if name.endswith('.partial')]
+
+def test_find_lists_each_version(tmp_path, home):
+    engine = BackupEngine(str(tmp_path / 'backups'), transfer=copy_transfer([]))
+    engine.snapshot([str(home)], now=datetime(2026, 1, 1, 1, 0, 0))
+    engine.snapshot([str(home)], now=datetime(2026, 1, 2, 1, 0, 0))
+    (home / 'alice' / 'notes.txt').write_text('a2 longer')
+    engine.snapshot([str(home)], now=datetime(2026, 1, 3, 1, 0, 0))
+
+    rows = engine.index.find(str(home / 'alice' / 'notes.txt'))
+    assert [row[0] for row in rows] == ['20260101_010000', '20260102_010000', '20260103_010000']
+    assert rows[0][5] == rows[1][5] != rows[2][5]
+    assert rows[2][3] == len('a2 longer')
+    manifest = dict((path, sha256) for path, kind, size, mtime, sha256 in engine.index.manifest('20260103_010000'))
+    assert set(manifest) >= {'home', 'home/README', 'home/alice/data/run.csv', 'home/bob/job.sh'}
+
+def test_prune_keeps_latest_and_index(tmp_path, home):
+    engine = BackupEngine(str(tmp_path / 'backups'), transfer=copy_transfer([]))
+    start = datetime(2026, 1, 1, 1, 0, 0)
+    for day in range(3):
+        engine.snapshot([str(home)], now=start + timedelta(days=day))
+    (home / 'bob' / 'job.sh').write_text('echo changed')
+    engine.snapshot([str(home)], now=start + timedelta(days=10))
+
+    removed = engine.prune(retention_days=7, now=start + timedelta(days=10))
+    assert removed == ['20260101_010000', '20260102_010000', '20260103_010000']
+    rows = engine.index.find('home/bob/job.sh')
+    assert [row[0] for row in rows] == ['20260111_010000']
+    assert [row[0] for row in engine.index.find('home/alice/notes.txt')] == ['20260111_010000']
+
+def test_dest_names_disambiguate_shared_basenames():
+    assert dest_names(['/home', '/export/home', '/scratch']) == {
+        '/home': 'home', '/export/home': 'export_home', '/scratch': 'scratch'}
+
+@pytest.mark.skipif(not shutil.which('rsync'), reason='rsync not installed')
+def test_rsync_links_unchanged_files(tmp_path, home):
+    engine = BackupEngine(str(tmp_path / 'backups'), transfer=run_rsync)
+    first = engine.snapshot([str(home)], now=datetime(2026, 1, 1, 1, 0, 0))
+    (home / 'alice' / 'new.txt').write_text('new')
+    second = engine.snapshot([str(home)], now=datetime(2026, 1, 2, 1, 0, 0))
+    old, new = (os.stat(os.path.join(path, 'home', 'alice', 'notes.txt')) for path in (first, second))
+    assert old.st_ino == new.st_ino
+    assert os.path.exists(os.path.join(second, 'home', 'alice', 'new.txt'))
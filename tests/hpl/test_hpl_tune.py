@@ -0,0 +1,94 @@
+#!/usr/bin/env python3
+# Tests for the HPL autotuner, output parser and regression tracking
+
+import os
+import sys
+import json
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', '..', 'roles', 'hpl', 'files'))
+
+from hpl_tune import (find_regressions, parse_hpl_output, problem_size, process_grids, render_hpl_dat,
+                      tune, update_history)
+
+HPL_OUT = """================================================================================
+T/V                N    NB     P     Q               Time                 Gflops
+--------------------------------------------------------------------------------
+WR01C2R4        2048   128     2     4               0.41             1.3972e+01
+HPL_pdgesv() start time Mon Jan  5 10:00:00 2026
+
+--------------------------------------------------------------------------------
+||Ax-b||_oo/(eps*(||A||_oo*||x||_oo+||b||_oo)*N)=   3.99e-03 ...... PASSED
+================================================================================
+T/V                N    NB     P     Q               Time                 Gflops
+--------------------------------------------------------------------------------
+WR04C2R4        2048   256     2     4               0.32             1.7896e+01
+--------------------------------------------------------------------------------
+||Ax-b||_oo/(eps*(||A||_oo*||x||_oo+||b||_oo)*N)=   2.11e+01 ...... FAILED
+"""
+
+def test_parse_hpl_output():
+    results = parse_hpl_output(HPL_OUT)
+    assert [(r['nb'], r['bcast'], r['passed']) for r in results] == [(128, 1, True), (256, 4, False)]
+    assert results[0]['gflops'] == pytest.approx(13.972)
+    assert results[0]['n'] == 2048 and results[0]['p'] == 2 and results[0]['q'] == 4
+
+def test_search_space_shapes():
+    assert process_grids(16) == [(4, 4), (2, 8)]
+    assert process_grids(13) == [(1, 13)]
+    assert problem_size(64 * 1024, 0.8, 256) % 256 == 0
+    dat = render_hpl_dat([4096], [128, 256], [(2, 4), (1, 8)], [1, 4])
+    lines = dat.splitlines()
+    assert lines[7].split()[:2] == ['128', '256']
+    assert lines[10].split()[:2] == ['2', '1'] and lines[11].split()[:2] == ['4', '8']
+    with pytest.raises(ValueError):
+        render_hpl_dat([], [128], [(1, 1)], [1])
+
+def fake_runner(runs):
+    """Stand-in for xhpl: NB 192 with the square grid is fastest"""
+    def runner(dat, work_dir, ranks, xhpl, mpirun):
+        lines = dat.splitlines()
+        ns, nbs = lines[5].split(), lines[7].split()
+        grids = list(zip(lines[10].split(), lines[11].split()))[:int(lines[9].split()[0])]
+        bcasts = lines[22].split()[:int(lines[21].split()[0])]
+        runs.append(os.path.basename(work_dir))
+        output = []
+        for n in ns[:int(lines[4].split()[0])]:
+            for nb in nbs[:int(lines[6].split()[0])]:
+                for p, q in grids:
+                    for bcast in bcasts:
+                        gflops = 100 - abs(int(nb) - 192) / 10 - abs(int(p) - int(q)) - int(bcast)
+                        output.append(f"WR0{bcast}C2R4 {n:>10} {nb:>5} {p:>5} {q:>5}   1.00   {gflops:.4e}")
+                        output.append("||Ax-b||_oo/(eps*(||A||_oo*||x||_oo+||b||_oo)*N)=   3.99e-03 ...... PASSED")
+        return '\n'.join(output)
+    return runner
+
+def test_tune_prunes_before_full_runs(tmp_path):
+    runs = []
+    result = tune(16, 8192, str(tmp_path), 'xhpl', runner=fake_runner(runs), nbs=(128, 192, 256),
+                  bcasts=(1, 4), keep=2)
+    assert runs == ['coarse_0', 'fine_0_80', 'fine_1_80']
+    assert len(result['coarse']) == result['candidates'] == 3 * 2 * 2
+    assert result['promoted'][0] == {'nb': 192, 'p': 4, 'q': 4, 'bcast': 1}
+    assert result['best']['n'] == problem_size(8192, 0.8, 192)
+
+def test_history_flags_regressed_node(tmp_path):
+    def write(node, timestamp, gflops):
+        path = tmp_path / f"{node}_hpl_tune.json"
+        path.write_text(json.dumps({'node': node, 'timestamp': timestamp, 'cores': 16,
+                                    'best': {'n': 1, 'nb': 192, 'p': 4, 'q': 4, 'bcast': 1, 'gflops': gflops}}))
+
+    for day, (good, bad) in enumerate([(500, 505), (502, 498), (499, 420)]):
+        write('node01', day, good)
+        write('node02', day, bad)
+        write('node03', day, good + 1)
+        records = update_history(str(tmp_path))
+    assert len(records) == 9
+    assert len(update_history(str(tmp_path))) == 9  # Re-ingesting the same files adds nothing
+
+    rows = {row['node']: row for row in find_regressions(records)}
+    assert not rows['node01']['regressed']
+    assert rows['node02']['regressed']
+    assert 'history' in rows['node02']['reasons'][0] and 'peers' in rows['node02']['reasons'][1]
+    assert rows['node02']['baseline'] == pytest.approx(501.5)
@@ -0,0 +1,75 @@
+#!/usr/bin/env python3
+# Tests for the dashboard PromQL analyzer and recording rule generator
+
+import os
+import sys
+import json
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', '..', 'scripts'))
+
+from dashboard_rules import (analyze, estimate_cost, load_rules, normalize, recording_candidates, render_rules,
+                             rewrite_dashboard, rewrite_expr, selectors)
+
+DASHBOARD = {'panels': [
+    {'title': 'CPU', 'targets': [
+        {'expr': 'sum(irate(node_cpu_seconds_total{instance="$node", mode="user"}[$__rate_interval]))'},
+        {'expr': "sum(irate(node_cpu_seconds_total{mode!='idle',instance=\"$node\"}[$__rate_interval]))"},
+    ]},
+    {'title': 'Row', 'panels': [
+        {'title': 'Memory', 'targets': [{'expr': 'node_memory_MemTotal_bytes{instance="$node"}'}]},
+        {'title': 'Window', 'targets': [{'expr': 'sum(increase(slurm_jobs_total[$__range]))'}]},
+        {'title': 'Network', 'targets': [{'expr': 'irate(node_network_receive_bytes_total{instance="$node"}[5m])*8'}]},
+    ]},
+]}
+
+
+def test_normalize_sorts_matchers_and_whitespace():
+    assert (normalize('sum( rate(x{b="2",  a="1"}[5m]) )')
+            == normalize('sum(rate(x{a = "1",b="2"}[5m]))')
+            == 'sum(rate(x{a="1",b="2"}[5m]))')
+
+
+def test_selectors_skip_functions_and_grouping_labels():
+    found = selectors('count(count(node_cpu_seconds_total{instance="$node"}) by (cpu)) / up')
+    assert [(metric, seconds) for metric, _, seconds in found] == [('node_cpu_seconds_total', None), ('up', None)]
+
+
+def test_cost_grows_with_range_and_cardinality():
+    cardinality = {'x': 1000}
+    assert estimate_cost('rate(x[10m])', cardinality) > estimate_cost('rate(x[1m])', cardinality)
+    assert estimate_cost('x', cardinality) > estimate_cost('x{instance="a"}', cardinality)
+
+
+def test_rules_and_rewrite(tmp_path):
+    path = tmp_path / 'dashboard.json'
+    path.write_text(json.dumps(DASHBOARD, indent=2))
+    rules_file = tmp_path / 'recording_rules.yml.j2'
+
+    _, rules = analyze([str(path)], {})
+    # Both CPU panels share one rule aggregated by the labels they filter on; $__range follows
+    # the panel and a bare irate would record as many series as it reads, so both are left alone
+    assert rules == {'instance_mode:node_cpu_seconds:irate1m':
+                     'sum by (instance, mode) (irate(node_cpu_seconds_total[1m]))'}
+    assert (rewrite_expr("max by (a) (rate(y{b='1'}[5m])) + 1", {'a_b:y:max_rate5m': ''})
+            == "max by (a) (a_b:y:max_rate5m{b='1'}) + 1")
+
+    rules_file.write_text(render_rules(rules))
+    assert rewrite_dashboard(str(path), rules) == 2
+    exprs = [t['expr'] for t in json.loads(path.read_text())['panels'][0]['targets']]
+    assert exprs == ['sum(instance_mode:node_cpu_seconds:irate1m{instance="$node",mode="user"})',
+                     "sum(instance_mode:node_cpu_seconds:irate1m{mode!='idle',instance=\"$node\"})"]
+
+    # Regenerating from the rewritten dashboard keeps the rules it now depends on
+    _, regenerated = analyze([str(path)], {}, existing=load_rules(str(rules_file)))
+    assert regenerated == rules
+
+
+def test_only_reaggregatable_aggregations_are_recorded():
+    names = lambda expr: [name for _, name, _, _ in recording_candidates(expr)]
+    assert names('rate(x_total{job="a"}[5m])') == []
+    assert names('avg(rate(x_total{job="a"}[5m]))') == []
+    assert names('topk(5, rate(x_total[5m]))') == []
+    assert names('sum without (cpu) (rate(x_total[5m]))') == []
+    assert names('sum(rate(x_total[5m])) by (instance)') == ['instance:x:rate5m']
+    assert names('max by (instance) (irate(x_total{mode="idle"}[1m]))') == ['instance_mode:x:max_irate1m']
+    assert names('sum(rate(x_total[5m]))') == ['cluster:x:rate5m']
@@ -0,0 +1,167 @@
+#!/usr/bin/env python3
+# Tests for the caching Slurm state exporter against fake squeue/sinfo/sdiag commands
+
+import os
+import sys
+import json
+import shlex
+import threading
+import urllib.request
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', '..', 'roles', 'monitoring', 'files'))
+
+from slurm_state_exporter import SlurmSnapshot, make_server, parse_tres
+
+SQUEUE = {'jobs': [
+    {'job_id': 1, 'partition': 'cpu', 'account': 'phys', 'user_name': 'alice', 'job_state': ['RUNNING'],
+     'state_reason': 'None', 'tres_alloc_str': 'cpu=8,mem=16G,node=1', 'cpus': {'set': True, 'number': 8}},
+    {'job_id': 2, 'partition': 'cpu', 'account': 'phys', 'user_name': 'bob', 'job_state': ['PENDING'],
+     'state_reason': 'Resources', 'tres_req_str': 'cpu=4,mem=4000M,node=1'},
+    {'job_id': 3, 'partition': 'gpu', 'account': 'chem', 'user_name': 'bob', 'job_state': 'PENDING',
+     'state_reason': 'Priority', 'cpus': 2},
+]}
+SINFO = {'sinfo': [
+    {'partition': {'name': 'cpu'}, 'node': {'state': ['MIXED']},
+     'nodes': {'total': 2, 'nodes': ['nodo01', 'nodo02']},
+     'cpus': {'total': 16, 'allocated': 8, 'idle': 8, 'other': 0},
+     'memory': {'maximum': 32000, 'allocated': 16384, 'free': {'maximum': {'set': True, 'number': 20000}}},
+     'cpu': {'load': {'maximum': 400}}},
+    # nodo02 is shared with the gpu partition and must not be counted twice
+    {'partition': {'name': 'gpu'}, 'node': {'state': ['MIXED']},
+     'nodes': {'total': 2, 'nodes': ['nodo01', 'nodo02']},
+     'cpus': {'total': 16, 'allocated': 8, 'idle': 8, 'other': 0},
+     'memory': {'maximum': 32000, 'allocated': 16384, 'free': {'maximum': {'set': True, 'number': 20000}}},
+     'cpu': {'load': {'maximum': 400}}},
+    {'partition': {'name': 'cpu'}, 'node': {'state': ['DOWN', 'NOT_RESPONDING']},
+     'nodes': {'total': 1, 'nodes': ['nodo03']},
+     'cpus': {'total': 8, 'allocated': 0, 'idle': 0, 'other': 8},
+     'memory': {'maximum': 32000, 'allocated': 0, 'free': {'maximum': {'set': False}}}},
+]}
+SDIAG = {'statistics': {
+    'server_thread_count': 3, 'agent_queue_size': 0,
+    'schedule_cycle_last': 1200, 'schedule_cycle_mean': 900,
+    'bf_cycle_last': {'set': True, 'number': 45000}, 'bf_cycle_mean': 30000,
+    'rpcs_by_message_type': [
+        {'message_type': 'REQUEST_JOB_INFO', 'type_id': 2003, 'count': 1500,
+         'average_time': {'set': True, 'number': 250}, 'total_time': 375000},
+        {'message_type': 'REQUEST_NODE_INFO', 'type_id': 2007, 'count': 300, 'average_time': 120, 'total_time': 36000},
+    ],
+    'rpcs_by_user': [
+        {'user': 'root', 'user_id': 0, 'count': 1700, 'average_time': 200, 'total_time': 340000},
+        {'user': 'alice', 'user_id': 1001, 'count': 100, 'average_time': 710, 'total_time': 71000},
+    ],
+}}
+
+FAKE_COMMAND = """
+import json, sys
+with open(sys.argv[2], 'a') as f:
+    f.write(sys.argv[1] + '\\n')
+with open(sys.argv[3]) as f:
+    sys.stdout.write(f.read())
+"""
+
+
+@pytest.fixture
+def snapshot(tmp_path):
+    script = tmp_path / 'fake_slurm.py'
+    script.write_text(FAKE_COMMAND)
+    calls = tmp_path / 'calls.log'
+    commands = {}
+    for name, payload in [('squeue', SQUEUE), ('sinfo', SINFO), ('sdiag', SDIAG)]:
+        fixture = tmp_path / f'{name}.json'
+        fixture.write_text(json.dumps(payload))
+        commands[name] = ' '.join(shlex.quote(str(part)) for part in
+                                  [sys.executable, script, name, calls, fixture])
+    snapshot = SlurmSnapshot(commands['squeue'], commands['sinfo'], commands['sdiag'])
+    snapshot.calls = calls
+    return snapshot
+
+
+def metric_values(text):
+    values = {}
+    for line in text.splitlines():
+        if line and not line.startswith('#'):
+            name, value = line.rsplit(' ', 1)
+            values[name] = float(value)
+    return values
+
+
+def test_parse_tres():
+    assert parse_tres('cpu=4,mem=16G,node=1') == (4.0, 16384.0)
+    assert parse_tres('cpu=2,mem=512M') == (2.0, 512.0)
+    assert parse_tres(None) == (0.0, 0.0)
+
+
+def test_snapshot_metrics(snapshot):
+    snapshot.refresh()
+    values = metric_values(snapshot.render())
+
+    assert values['slurm_partition_job_state_total{partition="cpu",state="running"}'] == 1
+    assert values['slurm_account_job_state_total{account="phys",state="pending"}'] == 1
+    assert values['slurm_partition_pending_reason_total{partition="cpu",reason="Resources"}'] == 1
+    assert values['slurm_partition_pending_reason_total{partition="gpu",reason="Priority"}'] == 1
+    assert values['slurm_user_cpus_pending{username="bob"}'] == 6
+    assert values['slurm_account_job_state_mem_alloc{account="phys",state="running"}'] == 16384
+    assert values['slurm_job_cpu_alloc{jobid="1",partition="cpu",username="alice"}'] == 8
+
+    assert values['slurm_partition_total_cpus{partition="cpu"}'] == 24
+    assert values['slurm_partition_cpu_load{partition="gpu"}'] == 4
+    assert values['slurm_cpus_total'] == 24
+    assert values['slurm_node_count_per_state{state="mixed"}'] == 2
+    assert values['slurm_node_count_per_state{state="down"}'] == 1
+    assert values['slurm_job_scrape_error'] == 0
+
+
+def test_sdiag_rpc_metrics(snapshot):
+    snapshot.refresh()
+    values = metric_values(snapshot.render())
+
+    assert values['slurm_rpc_msg_type_count{type="REQUEST_JOB_INFO"}'] == 1500
+    assert values['slurm_rpc_msg_type_avg_time{type="REQUEST_JOB_INFO"}'] == 250
+    assert values['slurm_rpc_msg_type_total_time{type="REQUEST_NODE_INFO"}'] == 36000
+    assert values['slurm_rpc_user_count{user="alice"}'] == 100
+    assert values['slurm_rpc_user_total_time{user="root"}'] == 340000
+    assert values['slurm_bf_cycle_last'] == 45000
+    assert values['slurm_server_thread_count'] == 3
+    assert values['slurm_diag_scrape_error'] == 0
+    assert 'slurm_diag_scrape_duration' in values
+
+
+def test_failed_command_keeps_last_snapshot(snapshot):
+    snapshot.refresh()
+    snapshot.commands['job'] = (['false'],) + snapshot.commands['job'][1:]
+    snapshot.refresh()
+    values = metric_values(snapshot.render())
+    assert values['slurm_job_scrape_error'] == 1
+    assert values['slurm_partition_job_state_total{partition="cpu",state="running"}'] == 1
+
+
+def test_scrapes_share_one_snapshot(snapshot):
+    snapshot.refresh()
+    server = make_server(snapshot, '127.0.0.1', 0)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    url = f"http://127.0.0.1:{server.server_address[1]}/metrics"
+
+    bodies = []
+
+    def scrape():
+        # Failures inside the thread would be lost; collect the body and assert below
+        try:
+            with urllib.request.urlopen(url, timeout=10) as response:
+                bodies.append(response.read())
+        except Exception as e:
+            bodies.append(e)
+
+    scrapers = [threading.Thread(target=scrape) for _ in range(32)]
+    for thread in scrapers:
+        thread.start()
+    for thread in scrapers:
+        thread.join()
+    server.shutdown()
+
+    assert len(bodies) == 32
+    assert all(isinstance(body, bytes) and b'slurm_cpus_total 24' in body for body in bodies)
+    # 32 concurrent scrapers, still one squeue, one sinfo and one sdiag call
+    assert sorted(snapshot.calls.read_text().split()) == ['sdiag', 'sinfo', 'squeue']
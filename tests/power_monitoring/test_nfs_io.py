@@ -0,0 +1,132 @@
+#!/usr/bin/env python3
+# Tests for the NFS I/O collector against recorded mountstats and a fake cgroup/proc tree
+
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', '..', 'roles', 'slurm_power_monitoring', 'files'))
+
+from nfs_io import NfsIoCollector, mountstats_rates, parse_io_stat, read_mountstats
+
+FIXTURES = os.path.join(os.path.dirname(__file__), 'fixtures')
+
+
+def fixture(name):
+    return os.path.join(FIXTURES, name)
+
+
+def test_parses_only_nfs_mounts():
+    mounts = read_mountstats(fixture('mountstats_t0.txt'))
+    assert sorted(mounts) == ['/apps', '/home']
+    home = mounts['/home']
+    assert home['export'] == 'nfs01:/export/home'
+    assert home['age'] == 86400
+    assert home['bytes']['normal_read'] == 1048576000
+    assert home['ops']['GETATTR']['ops'] == 20000
+    assert home['ops']['WRITE']['transmissions'] == 502
+
+
+def test_rates_between_recorded_snapshots():
+    rates = mountstats_rates(read_mountstats(fixture('mountstats_t0.txt')),
+                             read_mountstats(fixture('mountstats_t1.txt')), 60)
+    home = rates['/home']
+    assert home['read_bytes_per_second'] == pytest.approx(100000)
+    assert home['write_bytes_per_second'] == pytest.approx(20000)
+
+    getattr_rates = home['ops']['GETATTR']
+    assert getattr_rates['ops_per_second'] == pytest.approx(1000)
+    assert getattr_rates['avg_rtt_ms'] == pytest.approx(1.0)
+    assert getattr_rates['avg_exec_ms'] == pytest.approx(66000 / 60000)
+    assert home['ops']['WRITE']['retransmissions_per_second'] == pytest.approx(1 / 60)
+    # Operations without new calls are left out
+    assert 'CLOSE' not in home['ops']
+    assert set(rates['/apps']['ops']) == {'GETATTR'}
+
+
+def test_remount_has_no_rates_until_next_cycle():
+    before = read_mountstats(fixture('mountstats_t1.txt'))
+    after = read_mountstats(fixture('mountstats_t0.txt'))
+    assert mountstats_rates(before, after, 60) == {}
+
+
+def test_io_stat_sums_devices():
+    text = ("8:0 rbytes=4096 wbytes=8192 rios=1 wios=2 dbytes=0 dios=0\n"
+            "259:0 rbytes=1024 wbytes=0 rios=1 wios=0 dbytes=0 dios=0\n")
+    assert parse_io_stat(text) == {'rbytes': 5120, 'wbytes': 8192, 'rios': 2, 'wios': 2}
+
+
+class FakeNode:
+    """Cgroup v2 job tree and /proc io files that the test advances between cycles"""
+
+    def __init__(self, root):
+        self.cgroups = os.path.join(root, 'slurmstepd.scope')
+        self.proc = os.path.join(root, 'proc')
+        self.mountstats = os.path.join(root, 'mountstats')
+
+    def job(self, job_id, pids, io_stat=''):
+        step = os.path.join(self.cgroups, f'job_{job_id}', 'step_0', 'user', 'task_0')
+        os.makedirs(step, exist_ok=True)
+        with open(os.path.join(self.cgroups, f'job_{job_id}', 'io.stat'), 'w') as f:
+            f.write(io_stat)
+        with open(os.path.join(step, 'cgroup.procs'), 'w') as f:
+            f.write('\n'.join(str(pid) for pid in pids) + '\n')
+
+    def proc_io(self, pid, rchar, wchar, syscr, syscw):
+        os.makedirs(os.path.join(self.proc, str(pid)), exist_ok=True)
+        with open(os.path.join(self.proc, str(pid), 'io'), 'w') as f:
+            f.write(f"rchar: {rchar}\nwchar: {wchar}\nsyscr: {syscr}\nsyscw: {syscw}\n"
+                    f"read_bytes: 0\nwrite_bytes: 0\ncancelled_write_bytes: 0\n")
+
+    def use_mountstats(self, name):
+        with open(fixture(name)) as src, open(self.mountstats, 'w') as dst:
+            dst.write(src.read())
+
+
+def test_collector_attributes_io_to_jobs(tmp_path):
+    node = FakeNode(str(tmp_path))
+    clock = iter([1000.0, 1060.0])
+    collector = NfsIoCollector('c01', node.mountstats, node.cgroups, node.proc, clock=lambda: next(clock))
+
+    node.use_mountstats('mountstats_t0.txt')
+    node.job(101, [2001, 2002], "8:0 rbytes=0 wbytes=0 rios=0 wios=0\n")
+    node.job(102, [3001], "8:0 rbytes=0 wbytes=0 rios=0 wios=0\n")
+    node.proc_io(2001, 0, 0, 0, 0)
+    node.proc_io(2002, 0, 0, 0, 0)
+    node.proc_io(3001, 0, 0, 0, 0)
+    assert collector.collect() == []
+
+    # Job 101 does small-file I/O on /home; job 102 writes to local scratch
+    node.use_mountstats('mountstats_t1.txt')
+    node.proc_io(2001, 4_800_000, 1_200_000, 60_000, 1_200)
+    node.proc_io(2002, 1_200_000, 0, 30_000, 0)
+    node.job(102, [3001], "8:0 rbytes=0 wbytes=60000000 rios=0 wios=600\n")
+    node.proc_io(3001, 0, 6_000_000, 0, 600)
+    text = '\n'.join(collector.collect()) + '\n'
+
+    assert 'node_nfs_rpc_ops_per_second{hostname="c01",mountpoint="/home",op="GETATTR"} 1000\n' in text
+    assert 'node_nfs_rpc_rtt_milliseconds{hostname="c01",mountpoint="/home",op="GETATTR"} 1\n' in text
+    assert ('node_nfs_read_bytes_per_second{hostname="c01",mountpoint="/home",export="nfs01:/export/home"} 100000\n'
+            in text)
+    assert 'slurm_job_read_syscalls_per_second{hostname="c01",job_id="101"} 1500\n' in text
+    assert 'slurm_job_block_write_bytes_per_second{hostname="c01",job_id="102"} 1e+06\n' in text
+    assert 'slurm_job_block_write_bytes_per_second{hostname="c01",job_id="101"} 0\n' in text
+    # 120 kB/s of NFS split by syscall bytes: 101 moved 7.2 MB, 102 moved 6 MB
+    assert 'slurm_job_nfs_bytes_per_second_estimate{hostname="c01",job_id="101"} 65454.5\n' in text
+
+
+def test_exited_processes_do_not_go_negative(tmp_path):
+    node = FakeNode(str(tmp_path))
+    clock = iter([0.0, 60.0])
+    collector = NfsIoCollector('c01', node.mountstats, node.cgroups, node.proc, clock=lambda: next(clock))
+    node.use_mountstats('mountstats_t0.txt')
+    node.job(7, [10, 11])
+    node.proc_io(10, 600, 0, 6, 0)
+    node.proc_io(11, 6000, 0, 60, 0)
+    collector.collect()
+
+    os.remove(os.path.join(node.proc, '11', 'io'))
+    node.proc_io(10, 1200, 0, 12, 0)
+    text = '\n'.join(collector.collect())
+    assert 'slurm_job_read_bytes_per_second{hostname="c01",job_id="7"} 0' in text
@@ -0,0 +1,103 @@
+#!/usr/bin/env python3
+# Tests for the cluster power aggregator with many simulated collectors on localhost
+
+import os
+import sys
+import json
+import threading
+import urllib.request
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', '..', 'roles', 'slurm_power_monitoring', 'files'))
+
+from power_aggregator import PowerAggregator, make_server
+
+COLLECTORS = 64
+INTERVALS = 5
+
+
+@pytest.fixture
+def server():
+    server = make_server('127.0.0.1', 0)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+
+
+def push(url, payload):
+    request = urllib.request.Request(url + '/push', data=json.dumps(payload).encode(),
+                                     headers={'Content-Type': 'application/json'})
+    with urllib.request.urlopen(request, timeout=5) as response:
+        return json.load(response)
+
+
+def simulate_collector(url, node, errors):
+    """One node running its share of the 64-node MPI job and a small local job"""
+    try:
+        pending = []
+        for seq in range(1, INTERVALS + 1):
+            jobs = [{'job_id': '1000', 'user': 'alice', 'account': 'phys', 'watts': 100.0, 'joules': 6000.0}]
+            if node % 8 == 0:
+                jobs.append({'job_id': f'2{node:03d}', 'user': 'bob', 'account': 'chem',
+                             'watts': 50.0, 'joules': 3000.0})
+            pending.append({'seq': seq, 'ts': seq * 60, 'jobs': jobs, 'finished': []})
+            payload = {'hostname': f'nodo{node:02d}', 'boot': 'b1', 'batches': pending}
+            # Every collector loses one acknowledgement and resends the batch
+            push(url, payload)
+            if seq != 3:
+                pending = []
+    except Exception as e:
+        errors.append(e)
+
+
+def test_many_collectors_aggregate_without_double_counting(server):
+    url = f"http://127.0.0.1:{server.server_address[1]}"
+    errors = []
+    threads = [threading.Thread(target=simulate_collector, args=(url, node, errors)) for node in range(COLLECTORS)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert errors == []
+
+    jobs = {job['job_id']: job for job in json.load(urllib.request.urlopen(url + '/jobs'))}
+    assert jobs['1000']['energy_joules'] == pytest.approx(COLLECTORS * INTERVALS * 6000.0)
+    assert jobs['1000']['power_watts'] == pytest.approx(COLLECTORS * 100.0)
+    assert len(jobs['1000']['nodes']) == COLLECTORS
+
+    metrics = urllib.request.urlopen(url + '/metrics').read().decode()
+    assert 'slurm_user_power_watts{user="alice"} 6400.000' in metrics
+    assert 'slurm_account_power_watts{account="chem"} 400.000' in metrics
+    assert f'slurm_account_energy_joules_total{{account="phys"}} {COLLECTORS * INTERVALS * 6000.0:.3f}' in metrics
+    assert f'slurm_power_aggregator_batches_total{{outcome="duplicate"}} {COLLECTORS}' in metrics
+    # One series per job, not one per job and node
+    assert metrics.count('slurm_job_cluster_power_watts{') == 1 + COLLECTORS // 8
+
+
+def test_finished_and_idle_jobs_expire():
+    aggregator = PowerAggregator(node_stale=180, job_idle=300, finished_retention=600)
+    for host in ['nodo01', 'nodo02']:
+        aggregator.ingest({'hostname': host, 'boot': 'b1', 'batches': [
+            {'seq': 1, 'jobs': [{'job_id': '7', 'user': 'u', 'account': 'a', 'watts': 10, 'joules': 600},
+                                {'job_id': '8', 'user': 'u', 'account': 'a', 'watts': 20, 'joules': 1200}]}]}, now=0)
+
+    # Job 7 ends on both nodes; job 8's nodes simply stop reporting
+    for host in ['nodo01', 'nodo02']:
+        aggregator.ingest({'hostname': host, 'boot': 'b1', 'batches': [{'seq': 2, 'jobs': [], 'finished': ['7']}]},
+                          now=60)
+    assert [job['state'] for job in aggregator.jobs_snapshot(now=60) if job['job_id'] == '7'] == ['finished']
+
+    metrics = aggregator.render_metrics(now=400)
+    assert 'job_id="8"' not in metrics
+    assert 'slurm_user_energy_joules_total{user="u"} 3600.000' in metrics
+    assert aggregator.jobs_snapshot(now=1000) == []
+
+
+def test_collector_restart_resets_sequence():
+    aggregator = PowerAggregator()
+    batch = {'seq': 1, 'jobs': [{'job_id': '9', 'user': 'u', 'account': 'a', 'watts': 5, 'joules': 300}]}
+    assert aggregator.ingest({'hostname': 'nodo01', 'boot': 'b1', 'batches': [batch]}, now=0) == 1
+    assert aggregator.ingest({'hostname': 'nodo01', 'boot': 'b1', 'batches': [batch]}, now=1) == 0
+    assert aggregator.ingest({'hostname': 'nodo01', 'boot': 'b2', 'batches': [batch]}, now=2) == 1
@@ -0,0 +1,233 @@
+#!/usr/bin/env python3
+# Tests for RAPL power capping against a fake powercap sysfs tree with a simulated load
+
+import os
+import sys
+import time
+import threading
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', '..', 'roles', 'slurm_power_monitoring', 'files'))
+
+from power_capping import (CapUnavailable, PowerCapController, allocate_budget, discover_zones, fetch_group_cap,
+                           restore_limits)
+from power_aggregator import PowerAggregator, make_server
+
+
+class Clock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+class FakeNode:
+    """A node's powercap tree; each package draws min(demand, limit) watts"""
+
+    def __init__(self, root, packages=2, max_watts=200, limit_watts=200):
+        self.root = root
+        self.demand = {}
+        for index in range(packages):
+            zone = os.path.join(root, f'intel-rapl:{index}')
+            os.makedirs(os.path.join(zone, f'intel-rapl:{index}:0'))
+            self._write(zone, 'name', f'package-{index}')
+            self._write(zone, 'energy_uj', 0)
+            for constraint, name in enumerate(['long_term', 'short_term']):
+                self._write(zone, f'constraint_{constraint}_name', name)
+                self._write(zone, f'constraint_{constraint}_power_limit_uw', limit_watts * 10**6)
+                self._write(zone, f'constraint_{constraint}_max_power_uw', max_watts * 10**6)
+            self.demand[zone] = 0.0
+        # Subzones (core/uncore) are not capped
+        self._write(os.path.join(root, 'intel-rapl:0', 'intel-rapl:0:0'), 'constraint_0_power_limit_uw', 0)
+
+    @staticmethod
+    def _write(path, name, value):
+        with open(os.path.join(path, name), 'w') as f:
+            f.write(f"{value}\n")
+
+    def limit(self, zone):
+        with open(os.path.join(zone, 'constraint_0_power_limit_uw')) as f:
+            return int(f.read()) / 1e6
+
+    def set_load(self, watts_per_package):
+        self.demand = {zone: watts_per_package for zone in self.demand}
+
+    def power(self):
+        return sum(min(demand, self.limit(zone)) for zone, demand in self.demand.items())
+
+    def tick(self, seconds):
+        for zone, demand in self.demand.items():
+            with open(os.path.join(zone, 'energy_uj')) as f:
+                energy = int(f.read())
+            self._write(zone, 'energy_uj', energy + int(min(demand, self.limit(zone)) * seconds * 1e6))
+
+
+def test_discovers_packages_and_long_term_constraint(tmp_path):
+    FakeNode(str(tmp_path))
+    zones = discover_zones(str(tmp_path))
+    assert [zone.name for zone in zones] == ['package-0', 'package-1']
+    assert all(zone.constraint == 0 and zone.max_uw == 200 * 10**6 for zone in zones)
+
+
+def test_rate_limited_and_hysteresis_damped(tmp_path):
+    node = FakeNode(str(tmp_path))
+    clock = Clock()
+    controller = PowerCapController(discover_zones(str(tmp_path)), min_watts=40, hysteresis_watts=5,
+                                    max_step_watts=20, min_interval=30, clock=clock)
+
+    # 400 W -> 300 W node target moves each package 20 W per adjustment, no faster than every 30 s
+    assert len(controller.apply(300)) == 2
+    assert controller.current_watts() == 360
+    assert controller.apply(300) == []
+    clock.now += 30
+    controller.apply(300)
+    clock.now += 30
+    controller.apply(300)
+    assert controller.current_watts() == 300
+    assert node.limit(os.path.join(str(tmp_path), 'intel-rapl:0')) == 150
+
+    # A target within the hysteresis band leaves the limits alone
+    clock.now += 30
+    assert controller.apply(306) == []
+
+    # Lifting the cap walks back up to the package maximum
+    for _ in range(10):
+        clock.now += 30
+        controller.apply(None)
+    assert controller.current_watts() == 400
+
+
+def test_dry_run_leaves_sysfs_untouched(tmp_path):
+    node = FakeNode(str(tmp_path))
+    controller = PowerCapController(discover_zones(str(tmp_path)), max_step_watts=100, min_interval=0, dry_run=True)
+    changes = controller.apply(200)
+    assert [new for _, _, new in changes] == [100 * 10**6, 100 * 10**6]
+    assert controller.current_watts() == 200
+    assert all(node.limit(zone) == 200 for zone in node.demand)
+
+
+def test_original_limits_restored_on_exit(tmp_path):
+    node = FakeNode(str(tmp_path / 'rapl'), limit_watts=180)
+    state_file = str(tmp_path / 'state' / 'power_cap_limits.json')
+    controller = PowerCapController(discover_zones(node.root), max_step_watts=100, min_interval=0,
+                                    state_file=state_file)
+    controller.apply(200)
+    assert all(node.limit(zone) == 100 for zone in node.demand)
+
+    controller.restore()
+    assert all(node.limit(zone) == 180 for zone in node.demand)
+    assert not os.path.exists(state_file)
+
+
+def test_limits_left_by_unclean_exit_are_reset(tmp_path):
+    node = FakeNode(str(tmp_path / 'rapl'), limit_watts=180)
+    state_file = str(tmp_path / 'power_cap_limits.json')
+    PowerCapController(discover_zones(node.root), max_step_watts=100, min_interval=0,
+                       state_file=state_file).apply(200)
+
+    # A restarted capping run keeps the limits found before the first one
+    restarted = PowerCapController(discover_zones(node.root), max_step_watts=100, min_interval=0,
+                                   state_file=state_file)
+    restarted.apply(300)
+    restarted.restore()
+    assert all(node.limit(zone) == 180 for zone in node.demand)
+
+    # With capping switched off, the next start puts the original limits back
+    PowerCapController(discover_zones(node.root), max_step_watts=100, min_interval=0,
+                       state_file=state_file).apply(200)
+    assert restore_limits(discover_zones(node.root), state_file) == ['package-0', 'package-1']
+    assert all(node.limit(zone) == 180 for zone in node.demand)
+    # Without a state file the limits are not ours to touch
+    assert restore_limits(discover_zones(node.root), state_file) == []
+
+    # An unreadable state file lifts the limits to the package maximum
+    with open(state_file, 'w') as f:
+        f.write('{')
+    assert restore_limits(discover_zones(node.root), state_file) == ['package-0', 'package-1']
+    assert all(node.limit(zone) == 200 for zone in node.demand)
+
+
+def test_allocation_favours_busy_nodes():
+    nodes = {'n1': {'busy': True}, 'n2': {'busy': True}, 'n3': {'busy': False}, 'n4': {'busy': False}}
+    caps = allocate_budget(1000, nodes, floor_watts=100, ceiling_watts=400)
+    assert caps == {'n1': 400, 'n2': 400, 'n3': 100, 'n4': 100}
+    assert sum(caps.values()) == 1000
+
+    # Busy nodes at the ceiling pass the rest to the idle ones
+    caps = allocate_budget(1200, nodes, floor_watts=100, ceiling_watts=400)
+    assert caps == {'n1': 400, 'n2': 400, 'n3': 200, 'n4': 200}
+
+    # A budget below the floors is shared equally
+    assert allocate_budget(200, nodes, floor_watts=100) == {host: 50 for host in nodes}
+
+
+def test_group_stays_under_budget_with_simulated_load(tmp_path):
+    clock = Clock()
+    aggregator = PowerAggregator(power_budget=800, cap_floor=100, cap_ceiling=400)
+    fakes, controllers = {}, {}
+    for host in ['n1', 'n2', 'n3']:
+        root = os.path.join(str(tmp_path), host)
+        fakes[host] = FakeNode(root, packages=2, max_watts=200, limit_watts=200)
+        controllers[host] = PowerCapController(discover_zones(root), min_watts=40, hysteresis_watts=5,
+                                               max_step_watts=50, min_interval=60, clock=clock)
+    fakes['n1'].set_load(190)
+    fakes['n2'].set_load(190)
+    fakes['n3'].set_load(30)
+
+    for minute in range(10):
+        now = 1000.0 + minute * 60
+        clock.now = now
+        for host in fakes:
+            jobs = [{'job_id': f'job-{host}', 'user': 'alice', 'account': 'physics',
+                     'watts': fakes[host].power(), 'joules': fakes[host].power() * 60}] if host != 'n3' else []
+            aggregator.ingest({'hostname': host, 'boot': host, 'batches': [{'seq': minute, 'jobs': jobs}]}, now=now)
+        caps = aggregator.caps(now=now)
+        for host, controller in controllers.items():
+            # No caps until the aggregator has seen the whole group; the limits stay put
+            if host in caps:
+                controller.apply(caps[host])
+            fakes[host].tick(60)
+
+    assert caps == {'n1': 350, 'n2': 350, 'n3': 100}
+    assert sum(fake.power() for fake in fakes.values()) <= 800
+    assert fakes['n1'].power() == 350
+    assert fakes['n3'].power() == 60
+    assert 'slurm_node_power_cap_watts{hostname="n3"} 100.000' in aggregator.render_metrics(now=now)
+
+
+def test_caps_wait_for_the_node_set_after_restart():
+    aggregator = PowerAggregator(power_budget=900, cap_floor=100, node_stale=180)
+    assert aggregator.caps(now=1000) == {}
+
+    # n1 reports first; giving it the whole budget would starve n2 and n3 once they push
+    aggregator.ingest({'hostname': 'n1', 'boot': 'a', 'batches': []}, now=1000)
+    assert aggregator.caps(now=1000) == {}
+    aggregator.ingest({'hostname': 'n2', 'boot': 'b', 'batches': []}, now=1060)
+    aggregator.ingest({'hostname': 'n3', 'boot': 'c', 'batches': []}, now=1120)
+    assert aggregator.caps(now=1179) == {}
+    aggregator.ingest({'hostname': 'n1', 'boot': 'a', 'batches': []}, now=1180)
+    assert aggregator.caps(now=1180) == {'n1': 300, 'n2': 300, 'n3': 300}
+
+
+def test_missing_host_is_not_uncapped():
+    aggregator = PowerAggregator(power_budget=400, cap_floor=100, node_stale=180)
+    # n1's last push is older than the stale window, so it has dropped out of the caps
+    aggregator.ingest({'hostname': 'n1', 'boot': 'a', 'batches': []}, now=time.time() - 200)
+    server = make_server('127.0.0.1', 0, aggregator)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    url = f"http://127.0.0.1:{server.server_address[1]}/caps"
+    try:
+        with pytest.raises(CapUnavailable):
+            fetch_group_cap(url, 'n1')
+        with pytest.raises(CapUnavailable):
+            fetch_group_cap(url, 'n9')
+        aggregator.ingest({'hostname': 'n1', 'boot': 'a', 'batches': []})
+        assert fetch_group_cap(url, 'n1') == 400
+        # Without a group budget there is nothing to cap to
+        aggregator.power_budget = None
+        assert fetch_group_cap(url, 'n1') is None
+    finally:
+        server.shutdown()
+        server.server_close()
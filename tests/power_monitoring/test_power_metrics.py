@@ -0,0 +1,89 @@
+#!/usr/bin/env python3
+# Tests for the prolog/epilog job energy checkpoints of the power metrics collector
+
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', '..', 'roles', 'slurm_power_monitoring', 'files'))
+
+import power_metrics
+from power_metrics import JobEnergyTracker
+
+
+def make_tracker(tmp_path, monkeypatch):
+    monkeypatch.setattr(power_metrics, 'ENERGY_STATE_DIR', str(tmp_path))
+    monkeypatch.setattr(power_metrics, 'OPEN_JOBS_FILE', str(tmp_path / 'open_jobs.json'))
+    monkeypatch.setattr(power_metrics, 'JOB_ENERGY_LOG', str(tmp_path / 'job_energy.jsonl'))
+    monkeypatch.setattr(power_metrics, 'JOB_ENERGY_METRICS_FILE', str(tmp_path / 'slurm_job_energy.prom'))
+    monkeypatch.setattr(power_metrics, 'read_energy_counters', lambda: {'rapl:package-0': [0, 0, 1e-6]})
+    return JobEnergyTracker()
+
+
+def test_lost_epilog_is_expired(tmp_path, monkeypatch):
+    tracker = make_tracker(tmp_path, monkeypatch)
+    tracker.start('100')
+    tracker.start('101')
+    # Job 100's epilog never arrives; job 101 ends normally
+    assert tracker.end('101') == 'ok'
+    started = tracker.open_jobs['100']['start']
+
+    # Still inside the prolog grace period, a missing cgroup is not enough
+    assert tracker.expire(set(), now=started + 60) == []
+    assert tracker.expire(set(), now=started + power_metrics.OPEN_JOB_GRACE + 1) == ['100']
+    assert tracker.open_jobs == {}
+
+    # The state file is rewritten, so a restart does not bring the job back
+    assert JobEnergyTracker().open_jobs == {}
+
+    # The next job on the node is not counted as sharing it with the lost one
+    tracker.start('102')
+    assert tracker.open_jobs['102']['max_concurrent'] == 1
+
+
+def test_running_jobs_are_kept(tmp_path, monkeypatch):
+    tracker = make_tracker(tmp_path, monkeypatch)
+    tracker.start('200')
+    started = tracker.open_jobs['200']['start']
+    assert tracker.expire({'200'}, now=started + 3600) == []
+    # Without cgroup tracking only the age cap applies
+    assert tracker.expire(None, now=started + 3600) == []
+    assert tracker.expire(None, now=started + power_metrics.OPEN_JOB_MAX_AGE + 1) == ['200']
+
+
+def test_group_cap_unavailable_keeps_current_limit(monkeypatch):
+    from power_capping import CapUnavailable
+
+    class Controller:
+        dry_run = False
+        targets = []
+
+        def current_watts(self):
+            return 300.0
+
+        def apply(self, watts):
+            self.targets.append(watts)
+
+    def no_cap(url, hostname):
+        raise CapUnavailable(hostname)
+
+    monkeypatch.setattr(power_metrics, 'POWER_CAP_MODE', 'group')
+    monkeypatch.setattr(power_metrics, 'AGGREGATOR_URL', 'http://aggregator:9095/push')
+    monkeypatch.setattr(power_metrics, 'fetch_group_cap', no_cap)
+    controller = Controller()
+    metrics = power_metrics.update_power_cap(controller)
+    # Holding the limit, not lifting it to the package maximum
+    assert controller.targets == [300.0]
+    assert f'node_power_cap_target_watts{{hostname="{power_metrics.HOSTNAME}"}} 300.0' in metrics
+
+
+def test_energy_metrics_have_help_and_type(tmp_path, monkeypatch):
+    tracker = make_tracker(tmp_path, monkeypatch)
+    tracker.start('200')
+    tracker.end('200')
+    with open(power_metrics.JOB_ENERGY_METRICS_FILE) as f:
+        lines = f.read().splitlines()
+    for name in ('slurm_job_energy_joules', 'slurm_job_energy_duration_seconds', 'slurm_job_energy_concurrent_jobs'):
+        # Each family's HELP/TYPE header comes right before its samples
+        position = lines.index(f'# TYPE {name} gauge')
+        assert lines[position - 1].startswith(f'# HELP {name} ')
+        assert lines[position + 1].startswith(name + '{') and 'job_id="200"' in lines[position + 1]
@@ -0,0 +1,91 @@
+#!/usr/bin/env python3
+# Tests for the Proxmox power exporter against a synthetic /proc tree
+
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', '..', 'roles', 'proxmox_monitoring', 'files'))
+
+import proxmox_power_exporter
+from proxmox_power_exporter import VmIndex, PowerCollector, read_vm_name
+
+
+def write_stat(proc_root, pid, utime, stime, start_time=1000):
+    os.makedirs(os.path.join(proc_root, str(pid)), exist_ok=True)
+    fields = ['S'] + ['0'] * 10 + [str(utime), str(stime)] + ['0'] * 6 + [str(start_time)] + ['0'] * 30
+    with open(os.path.join(proc_root, str(pid), 'stat'), 'w') as f:
+        f.write(f"{pid} (kvm -id {pid}) " + ' '.join(fields) + '\n')
+
+
+def add_vm(tree, vmid, pid, name):
+    with open(os.path.join(tree['run'], f"{vmid}.pid"), 'w') as f:
+        f.write(f"{pid}\n")
+    with open(os.path.join(tree['conf'], f"{vmid}.conf"), 'w') as f:
+        f.write(f"cores: 2\nname: {name}\nmemory: 2048\n\n[before-upgrade]\nname: old-{name}\n")
+
+
+@pytest.fixture
+def tree(tmp_path, monkeypatch):
+    monkeypatch.setattr(proxmox_power_exporter, 'CLOCK_TICKS', 100)
+    paths = {name: str(tmp_path / name) for name in ['proc', 'run', 'conf']}
+    for path in paths.values():
+        os.makedirs(path)
+    add_vm(paths, 100, 4100, 'web01')
+    add_vm(paths, 101, 4101, 'db"01')
+    write_stat(paths['proc'], 4100, 1000, 500)
+    write_stat(paths['proc'], 4101, 0, 0)
+    return paths
+
+
+def make_collector(tree):
+    return PowerCollector(VmIndex(tree['run'], tree['conf']), tree['proc'], power_idle=30, power_vm_base=5)
+
+
+def test_cpu_rate_is_computed_from_deltas(tree):
+    collector = make_collector(tree)
+    first = collector.collect(now=0)
+    assert 'proxmox_vm_cpu_usage{vmid="100",name="web01"} 0.00' in first
+
+    # 300 ticks (3 CPU-seconds) over 10 s = 30% of one core
+    write_stat(tree['proc'], 4100, 1200, 600)
+    write_stat(tree['proc'], 4101, 1000, 0)
+    metrics = collector.collect(now=10)
+    assert 'proxmox_vm_cpu_usage{vmid="100",name="web01"} 30.00' in metrics
+    assert 'proxmox_vm_power_usage_watts{vmid="100",name="web01"} 14.00' in metrics
+    assert 'proxmox_vm_cpu_usage{vmid="101",name="db01"} 100.00' in metrics
+    assert 'proxmox_node_vm_cpu_usage_total 130.00' in metrics
+    assert 'proxmox_node_power_usage_watts 69.00' in metrics
+    assert 'proxmox_node_vm_count 2' in metrics
+
+
+def test_index_is_rebuilt_only_when_pid_files_change(tree):
+    collector = make_collector(tree)
+    for now in range(3):
+        collector.collect(now=now)
+    assert collector.index.rebuilds == 1
+
+    add_vm(tree, 102, 4102, 'batch01')
+    write_stat(tree['proc'], 4102, 0, 0)
+    assert 'vmid="102",name="batch01"' in collector.collect(now=3)
+    assert collector.index.rebuilds == 2
+
+
+def test_restarted_and_stopped_vms(tree):
+    collector = make_collector(tree)
+    collector.collect(now=0)
+
+    # VM 100 restarted under the same pid: new start time, no bogus delta
+    write_stat(tree['proc'], 4100, 5, 5, start_time=9999)
+    # VM 101 stopped but its pid file is not yet removed
+    os.remove(os.path.join(tree['proc'], '4101', 'stat'))
+    metrics = collector.collect(now=10)
+    assert 'proxmox_vm_cpu_usage{vmid="100",name="web01"} 0.00' in metrics
+    assert 'vmid="101"' not in metrics
+    assert 'proxmox_node_vm_count 1' in metrics
+
+
+def test_vm_name_ignores_snapshot_sections(tree):
+    assert read_vm_name(os.path.join(tree['conf'], '100.conf')) == 'web01'
+    assert read_vm_name(os.path.join(tree['conf'], 'missing.conf')) == ''
@@ -0,0 +1,109 @@
+#!/usr/bin/env python3
+# Tests for the incremental, parallel per-account billing statements
+
+import os
+import sys
+
+import pytest
+
+pd = pytest.importorskip('pandas')
+pytest.importorskip('jinja2')
+pytest.importorskip('matplotlib')
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', '..', 'roles', 'reporting', 'files'))
+
+from billing_statements import generate_statements
+
+RATES = {'cpu_hour': 0.05, 'gpu_hour': 1.0, 'memory_gb_hour': 0.01}
+
+
+def costed_jobs():
+    rows = []
+    for index, (account, user) in enumerate([('physics', 'alice'), ('physics', 'bob'), ('chem', 'carol'),
+                                             ('chem', 'carol'), ('bio lab', 'dave')]):
+        cpu_hours, gpu_hours, mem_hours = 10.0 * (index + 1), float(index % 2), 4.0 * (index + 1)
+        rows.append({
+            'JobID': str(100 + index), 'User': user, 'Account': account, 'Partition': 'compute',
+            'State': 'COMPLETED', 'Start': '2026-09-01T00:00:00', 'End': '2026-09-01T01:00:00',
+            'Elapsed': '01:00:00', 'CPUHours': cpu_hours, 'GPUHours': gpu_hours, 'MemoryGBHours': mem_hours,
+            'CPUCost': cpu_hours * RATES['cpu_hour'], 'GPUCost': gpu_hours * RATES['gpu_hour'],
+            'MemoryCost': mem_hours * RATES['memory_gb_hour'],
+        })
+    df = pd.DataFrame(rows)
+    df['TotalCost'] = df['CPUCost'] + df['GPUCost'] + df['MemoryCost']
+    return df
+
+
+def read_statements(directory):
+    return {name: (directory / name).read_bytes() for name in sorted(os.listdir(directory))
+            if name.endswith('.html')}
+
+
+def test_unchanged_accounts_are_skipped(tmp_path, capsys):
+    df = costed_jobs()
+    first = generate_statements(df, '2026-09', RATES, statement_dir=str(tmp_path), workers=1)
+    assert sorted(first['accounts']) == ['bio lab', 'chem', 'physics']
+    assert first['accounts']['bio lab']['file'].startswith('bio_lab-')
+    assert first['accounts']['physics']['jobs'] == 2
+
+    # Same inputs: every statement is reused as is
+    capsys.readouterr()
+    second = generate_statements(df, '2026-09', RATES, statement_dir=str(tmp_path), workers=1)
+    assert second['accounts'] == first['accounts']
+    assert 'Billing statements: 0 rendered, 3 unchanged' in capsys.readouterr().out
+
+    # A late job for chem re-renders chem only
+    late = df[df['Account'] == 'chem'].tail(1).assign(JobID='200', TotalCost=5.0)
+    third = generate_statements(pd.concat([df, late]), '2026-09', RATES, statement_dir=str(tmp_path), workers=1)
+    assert third['accounts']['chem']['hash'] != first['accounts']['chem']['hash']
+    assert third['accounts']['chem']['jobs'] == 3
+    assert 'Billing statements: 1 rendered, 2 unchanged' in capsys.readouterr().out
+    for account in ('physics', 'bio lab'):
+        assert third['accounts'][account] == first['accounts'][account]
+
+    # Changed rates change every hash
+    fourth = generate_statements(df, '2026-09', dict(RATES, cpu_hour=0.06), statement_dir=str(tmp_path), workers=1)
+    assert all(fourth['accounts'][account]['hash'] != third['accounts'][account]['hash']
+               for account in fourth['accounts'])
+
+
+def test_removed_account_statement_is_deleted(tmp_path):
+    df = costed_jobs()
+    generate_statements(df, '2026-09', RATES, statement_dir=str(tmp_path), workers=1)
+    manifest = generate_statements(df[df['Account'] != 'chem'], '2026-09', RATES, statement_dir=str(tmp_path),
+                                   workers=1)
+    assert 'chem' not in manifest['accounts']
+    assert sorted(os.listdir(tmp_path / '2026-09')) == sorted(
+        ['manifest.json'] + [entry['file'] for entry in manifest['accounts'].values()])
+
+
+def test_similar_account_names_get_their_own_statement(tmp_path):
+    df = costed_jobs()
+    df.loc[df['Account'] == 'chem', 'Account'] = ['bio_lab', '<b>chem</b>']
+    manifest = generate_statements(df, '2026-09', RATES, statement_dir=str(tmp_path), workers=1)
+
+    files = {account: entry['file'] for account, entry in manifest['accounts'].items()}
+    assert len(set(files.values())) == len(files) == 4
+    assert (tmp_path / '2026-09' / files['bio lab']).read_text() != (tmp_path / '2026-09' / files['bio_lab']).read_text()
+    # Account names are escaped outside the pre-rendered tables
+    html = (tmp_path / '2026-09' / files['<b>chem</b>']).read_text()
+    assert '<h1>Billing Statement: &lt;b&gt;chem&lt;/b&gt;</h1>' in html
+    assert '<b>chem</b>' not in html
+
+
+def test_process_pool_matches_serial(tmp_path):
+    df = costed_jobs()
+    output = tmp_path / '2026-09'
+    serial = generate_statements(df, '2026-09', RATES, statement_dir=str(tmp_path), workers=1)
+    serial_files = read_statements(output)
+    # Start over in the same directory so nothing is reused
+    for name in os.listdir(output):
+        os.remove(output / name)
+    pooled = generate_statements(df, '2026-09', RATES, statement_dir=str(tmp_path), workers=3)
+
+    def without_times(manifest):
+        return {account: {key: value for key, value in entry.items() if key != 'generated'}
+                for account, entry in manifest['accounts'].items()}
+
+    assert without_times(pooled) == without_times(serial)
+    assert read_statements(output) == serial_files
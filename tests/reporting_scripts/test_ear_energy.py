@@ -0,0 +1,140 @@
+#!/usr/bin/env python3
+# Tests for the EAR database reader against a SQLite fixture with EAR's schema
+
+import os
+import sys
+import sqlite3
+
+import pytest
+
+pd = pytest.importorskip('pandas')
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', '..', 'roles', 'reporting', 'files'))
+
+from ear_energy import EarDatabase, BATCH_STEP, add_ear_columns, summarize_energy
+
+# Subset of mysql_ear_schema.sql used by the reader
+SCHEMA = """
+CREATE TABLE Jobs (
+    id INT NOT NULL, step_id INT NOT NULL, user_id VARCHAR(128), app_id VARCHAR(128),
+    start_time INT NOT NULL, end_time INT NOT NULL, start_mpi_time INT, end_mpi_time INT,
+    policy VARCHAR(256), threshold FLOAT, procs INT, job_type SMALLINT, def_f INT,
+    user_acc VARCHAR(256), user_group VARCHAR(256), e_tag VARCHAR(256),
+    PRIMARY KEY (id, step_id)
+);
+CREATE TABLE Applications (
+    job_id INT NOT NULL, step_id INT NOT NULL, node_id VARCHAR(64),
+    signature_id INT, power_signature_id INT,
+    PRIMARY KEY (job_id, step_id, node_id)
+);
+CREATE TABLE Power_signatures (
+    id INTEGER PRIMARY KEY, DC_power FLOAT, DRAM_power FLOAT, PCK_power FLOAT, EDP FLOAT,
+    max_DC_power FLOAT, min_DC_power FLOAT, time FLOAT, avg_f INT, def_f INT
+);
+CREATE TABLE Signatures (
+    id INTEGER PRIMARY KEY, DC_power FLOAT, DRAM_power FLOAT, PCK_power FLOAT, EDP FLOAT,
+    GBS FLOAT, TPI FLOAT, CPI FLOAT, Gflops FLOAT, time FLOAT, avg_f INT, def_f INT
+);
+"""
+
+T0 = 1740787200
+
+
+def build_fixture(path):
+    connection = sqlite3.connect(path)
+    connection.executescript(SCHEMA)
+    power_id = iter(range(1, 100))
+
+    def add_node(job_id, step_id, node, watts, seconds, freq_khz, sig_freq_khz=None):
+        pid = next(power_id)
+        connection.execute("INSERT INTO Power_signatures (id, DC_power, time, avg_f) VALUES (?, ?, ?, ?)",
+                           (pid, watts, seconds, freq_khz))
+        sid = None
+        if sig_freq_khz:
+            sid = pid
+            connection.execute("INSERT INTO Signatures (id, DC_power, time, avg_f) VALUES (?, ?, ?, ?)",
+                               (sid, watts, seconds, sig_freq_khz))
+        connection.execute("INSERT INTO Applications VALUES (?, ?, ?, ?, ?)", (job_id, step_id, node, sid, pid))
+
+    def add_step(job_id, step_id, user, account, start, end):
+        connection.execute("INSERT INTO Jobs (id, step_id, user_id, user_acc, start_time, end_time) "
+                           "VALUES (?, ?, ?, ?, ?, ?)", (job_id, step_id, user, account, start, end))
+
+    # Job 10: batch step wrapping one two-node MPI step
+    add_step(10, BATCH_STEP, 'alice', 'phys', T0, T0 + 3600)
+    add_node(10, BATCH_STEP, 'nodo01', 300.0, 3600, 2000000)
+    add_step(10, 0, 'alice', 'phys', T0 + 60, T0 + 3660)
+    add_node(10, 0, 'nodo01', 250.0, 3600, 2000000, sig_freq_khz=2400000)
+    add_node(10, 0, 'nodo02', 250.0, 3600, 2000000, sig_freq_khz=2200000)
+    # Job 11: batch-only job
+    add_step(11, BATCH_STEP, 'bob', 'chem', T0, T0 + 1800)
+    add_node(11, BATCH_STEP, 'nodo02', 200.0, 1800, 1800000)
+    # Job 12: outside the window
+    add_step(12, BATCH_STEP, 'bob', 'chem', T0 - 86400, T0 - 80000)
+    add_node(12, BATCH_STEP, 'nodo02', 200.0, 6400, 1800000)
+    connection.commit()
+    connection.close()
+
+
+@pytest.fixture
+def database(tmp_path):
+    path = str(tmp_path / 'ear.db')
+    build_fixture(path)
+    return EarDatabase(connection_factory=lambda: sqlite3.connect(path), placeholder='?', fetch_size=2)
+
+
+def make_sacct_frame():
+    return pd.DataFrame({
+        'JobID': ['10', '10.batch', '10.0', '11', '13'],
+        'User': ['alice', '', '', 'bob', 'carol'],
+        'Account': ['phys', '', '', 'chem', 'phys'],
+    })
+
+
+def test_job_and_step_rows_are_merged(database):
+    df = add_ear_columns(make_sacct_frame(), database, T0 - 3600, T0 + 86400)
+    energy = dict(zip(df['JobID'], df['MeasuredEnergyKWh']))
+
+    # The batch step overlaps step 0 and is excluded from the job total
+    assert energy['10'] == pytest.approx(2 * 250 * 3600 / 3.6e6)
+    assert energy['10.0'] == pytest.approx(0.5)
+    assert energy['10.batch'] == pytest.approx(0.3)
+    assert energy['11'] == pytest.approx(0.1)
+    assert pd.isna(energy['13'])
+
+    job10 = df[df['JobID'] == '10'].iloc[0]
+    assert job10['AvgPowerW'] == pytest.approx(0.5 * 3.6e6 / 3660)
+    assert job10['AvgCPUFreqGHz'] == pytest.approx(2.3)
+    assert database.queries == 2
+
+
+def test_summaries_by_user_and_account(database):
+    df = add_ear_columns(make_sacct_frame(), database, T0 - 3600, T0 + 86400)
+    jobs = df[~df['JobID'].str.contains(r'\.')]
+
+    by_account = summarize_energy(jobs, 'Account').set_index('Account')
+    assert by_account.loc['phys', 'Jobs'] == 1
+    assert by_account.loc['phys', 'Energy (kWh)'] == pytest.approx(0.5)
+    assert summarize_energy(jobs, 'User')['User'].tolist() == ['alice', 'bob']
+
+
+def test_database_errors_leave_columns_empty():
+    def broken():
+        raise OSError("connection refused")
+
+    df = add_ear_columns(make_sacct_frame(), EarDatabase(connection_factory=broken), T0, T0 + 3600)
+    assert df['MeasuredEnergyKWh'].isna().all()
+
+
+def test_other_clusters_are_not_matched(database):
+    # Job 10 on the remote cluster shares an ID with the local job 10
+    df = make_sacct_frame().assign(Cluster=['alpha', 'alpha', 'alpha', 'beta', 'alpha'])
+    df = pd.concat([df, pd.DataFrame({'JobID': ['10'], 'User': ['dave'], 'Account': ['bio'],
+                                      'Cluster': ['beta']})], ignore_index=True)
+    df = add_ear_columns(df, database, T0 - 3600, T0 + 86400, cluster='alpha')
+
+    energy = df.set_index(['Cluster', 'JobID'])['MeasuredEnergyKWh']
+    assert energy[('alpha', '10')] == pytest.approx(0.5)
+    assert pd.isna(energy[('beta', '10')])
+    assert pd.isna(energy[('beta', '11')])
+    assert df.loc[df['Cluster'] == 'beta', ['AvgPowerW', 'AvgCPUFreqGHz']].isna().all().all()
@@ -0,0 +1,168 @@
+#!/usr/bin/env python3
+# Tests for the near-real-time inefficient job watcher against a fake sacct
+
+import os
+import sys
+import json
+import importlib.util
+from datetime import datetime, timedelta
+
+import pytest
+
+pytest.importorskip('pandas')
+pytest.importorskip('numpy')
+jinja2 = pytest.importorskip('jinja2')
+
+FILES = os.path.join(os.path.dirname(__file__), '..', '..', 'roles', 'reporting', 'files')
+TEMPLATE = os.path.join(os.path.dirname(__file__), '..', '..', 'roles', 'reporting', 'templates', 'reporting',
+                        'inefficiency_watch.py.j2')
+sys.path.insert(0, FILES)
+
+from report_telemetry import RunTelemetry
+
+HEADER = ("JobID|User|Account|Partition|State|Start|End|Elapsed|TotalCPU|ReqCPUS|AllocCPUS|ReqMem|MaxRSS|"
+          "NodeList|NNodes")
+START = datetime(2026, 10, 5, 12, 0, 0)
+
+
+class Clock(datetime):
+    current = START
+
+    @classmethod
+    def now(cls, tz=None):
+        return cls.current
+
+
+class FakeSacct:
+    """Returns every job it knows, like sacct does for jobs overlapping the window"""
+
+    def __init__(self):
+        self.jobs = []
+        self.calls = []
+        self.failing = False
+
+    def add(self, job_id, user, end, total_cpu, account='phys'):
+        self.jobs.append('|'.join([job_id, user, account, 'cpu', 'COMPLETED', '', end.strftime('%Y-%m-%dT%H:%M:%S'),
+                                   '01:00:00', total_cpu, '4', '4', '4G', '3G', 'nodo01', '1']))
+
+    def __call__(self, since, until):
+        self.calls.append((since, until))
+        if self.failing:
+            return None
+        return '\n'.join([HEADER] + self.jobs) + '\n'
+
+
+@pytest.fixture
+def watch(tmp_path, monkeypatch):
+    with open(TEMPLATE) as f:
+        source = jinja2.Template(f.read()).render()
+    # The script creates its output directory on import
+    source = source.replace('"/opt/reporting/output"', repr(str(tmp_path / 'output')))
+    path = tmp_path / 'inefficiency_watch.py'
+    path.write_text(source)
+    spec = importlib.util.spec_from_file_location('inefficiency_watch', str(path))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+
+    monkeypatch.setattr(module, 'STATE_FILE', str(tmp_path / 'state' / 'inefficiency_watch.json'))
+    monkeypatch.setattr(module, 'TEXTFILE_PATH', str(tmp_path / 'slurm_inefficient_jobs.prom'))
+    monkeypatch.setattr(module, 'datetime', Clock)
+    module.sacct = FakeSacct()
+    monkeypatch.setattr(module, 'get_finished_jobs', module.sacct)
+    Clock.current = START
+    return module
+
+
+def run(watch, tmp_path, at):
+    Clock.current = at
+    telemetry = RunTelemetry('inefficiency_watch', telemetry_log=str(tmp_path / 'telemetry.jsonl'),
+                             textfile_dir=None, trace_memory=False)
+    watch.main(telemetry)
+    with open(watch.STATE_FILE) as f:
+        return json.load(f)
+
+
+def metrics(watch):
+    with open(watch.TEXTFILE_PATH) as f:
+        return [line for line in f.read().splitlines() if not line.startswith('#')]
+
+
+def test_watermark_trails_now_by_settle_window(watch, tmp_path):
+    state = run(watch, tmp_path, START)
+    until = START - timedelta(seconds=watch.SETTLE_SECONDS)
+    # First run looks back a short window; later runs start at the watermark
+    assert watch.sacct.calls == [(until - timedelta(minutes=watch.INITIAL_LOOKBACK_MINUTES), until)]
+    assert state['watermark'] == until.strftime(watch.TIME_FORMAT)
+
+    run(watch, tmp_path, START + timedelta(minutes=5))
+    assert watch.sacct.calls[1] == (until, until + timedelta(minutes=5))
+
+
+def test_overlapping_windows_count_each_job_once(watch, tmp_path):
+    watch.sacct.add('1', 'alice', START - timedelta(minutes=10), '00:30:00')
+    watch.sacct.add('2', 'bob', START - timedelta(minutes=5), '04:00:00', account='chem')
+    # Ends inside the settle window; left for the next run
+    watch.sacct.add('3', 'alice', START - timedelta(minutes=1), '00:30:00')
+    run(watch, tmp_path, START)
+    assert 'slurm_finished_jobs{user="alice"} 1' in metrics(watch)
+
+    # sacct returns jobs 1 and 2 again; only job 3 is new
+    run(watch, tmp_path, START + timedelta(minutes=5))
+    lines = metrics(watch)
+    assert 'slurm_finished_jobs{user="alice"} 2' in lines
+    assert 'slurm_finished_jobs{user="bob"} 1' in lines
+    assert 'slurm_inefficient_jobs{user="alice"} 2' in lines
+    assert 'slurm_inefficient_jobs{account="chem"} 0' in lines
+    # 4 CPUs x 1 h with 0.5 h used, per alice job
+    assert 'slurm_wasted_cpu_hours{user="alice"} 7.0' in lines
+    # Below MIN_JOBS nobody is flagged yet
+    assert 'slurm_inefficiency_flagged{user="alice"} 0' in lines
+    watermark = START + timedelta(minutes=5) - timedelta(seconds=watch.SETTLE_SECONDS)
+    assert f"slurm_inefficiency_watch_watermark_timestamp_seconds {int(watermark.timestamp())}" in lines
+
+    with open(os.path.join(watch.OUTPUT_DIR, 'inefficient_jobs_2026-10-05.jsonl')) as f:
+        assert [json.loads(line)['job_id'] for line in f] == ['1', '3']
+
+
+def test_user_is_flagged_over_threshold(watch, tmp_path):
+    for index in range(watch.MIN_JOBS):
+        watch.sacct.add(str(index), 'carol', START - timedelta(minutes=10), '00:10:00')
+    run(watch, tmp_path, START)
+    assert 'slurm_inefficiency_flagged{user="carol"} 1' in metrics(watch)
+
+
+def test_failed_sacct_keeps_watermark(watch, tmp_path):
+    run(watch, tmp_path, START)
+    with open(watch.STATE_FILE) as f:
+        before = f.read()
+
+    watch.sacct.failing = True
+    with pytest.raises(SystemExit):
+        run(watch, tmp_path, START + timedelta(minutes=5))
+    with open(watch.STATE_FILE) as f:
+        assert f.read() == before
+
+    # The next good run retries the whole missed window
+    watch.sacct.failing = False
+    run(watch, tmp_path, START + timedelta(minutes=10))
+    assert watch.sacct.calls[-1][0] == watch.sacct.calls[-2][0]
+
+
+def test_buckets_expire_after_window(watch, tmp_path):
+    watch.sacct.add('1', 'alice', START - timedelta(minutes=10), '00:30:00')
+    state = run(watch, tmp_path, START)
+    assert list(state['buckets']) == ['2026-10-05T12']
+
+    # A quiet run past the window still ages the old bucket out
+    later = START + timedelta(hours=watch.WINDOW_HOURS + 1)
+    state = run(watch, tmp_path, later)
+    assert state['buckets'] == {}
+    assert not any(line.startswith('slurm_finished_jobs{') for line in metrics(watch))
+
+    later += timedelta(minutes=5)
+    watch.sacct.add('2', 'bob', later - timedelta(minutes=3), '04:00:00')
+    state = run(watch, tmp_path, later)
+    assert list(state['buckets']) == [later.strftime('%Y-%m-%dT%H')]
+    lines = metrics(watch)
+    assert 'slurm_finished_jobs{user="bob"} 1' in lines
+    assert not any('alice' in line for line in lines)
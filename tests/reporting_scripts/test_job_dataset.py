@@ -0,0 +1,71 @@
+#!/usr/bin/env python3
+# Tests for the Parquet job dataset written by the report runs
+
+import os
+import sys
+
+import pytest
+
+pd = pytest.importorskip('pandas')
+pytest.importorskip('pyarrow')
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', '..', 'roles', 'reporting', 'files'))
+
+from job_dataset import export_job_frame, list_partitions, load_jobs
+
+
+def jobs(*rows):
+    return pd.DataFrame([{'JobID': job_id, 'User': 'alice', 'State': state, 'Start': start, 'End': end}
+                         for job_id, state, start, end in rows])
+
+
+def test_consecutive_daily_runs_keep_earlier_rows(tmp_path):
+    dataset = str(tmp_path)
+    # 2026-10-01: three jobs finish, job 4 starts and is still running
+    export_job_frame(jobs(('1', 'COMPLETED', '2026-10-01T01:00:00', '2026-10-01T02:00:00'),
+                          ('2', 'COMPLETED', '2026-10-01T03:00:00', '2026-10-01T05:00:00'),
+                          ('3', 'FAILED', '2026-10-01T06:00:00', '2026-10-01T06:10:00'),
+                          ('4', 'RUNNING', '2026-10-01T22:00:00', 'Unknown')),
+                     'daily_usage', dataset)
+    # 2026-10-02: job 4 is still running, job 5 finishes
+    export_job_frame(jobs(('4', 'RUNNING', '2026-10-01T22:00:00', 'Unknown'),
+                          ('5', 'COMPLETED', '2026-10-02T08:00:00', '2026-10-02T09:00:00')),
+                     'daily_usage', dataset)
+    # 2026-10-03: job 4 ends; a late sacct record re-reports job 3
+    export_job_frame(jobs(('4', 'COMPLETED', '2026-10-01T22:00:00', '2026-10-03T04:00:00'),
+                          ('3', 'FAILED', '2026-10-01T06:00:00', '2026-10-01T06:10:00')),
+                     'daily_usage', dataset)
+
+    df = load_jobs(report='daily_usage', dataset_dir=dataset)
+    assert sorted(df['JobID']) == ['1', '2', '3', '4', '5']
+    assert list_partitions('daily_usage', dataset) == ['2026-10-01', '2026-10-02', '2026-10-03']
+    assert df.set_index('JobID').loc['4', 'State'] == 'COMPLETED'
+
+
+def test_overlapping_weekly_windows_do_not_drop_edge_day(tmp_path):
+    dataset = str(tmp_path)
+    # Both runs see part of 2026-10-05: before and after the 07:00 window edge
+    export_job_frame(jobs(('10', 'COMPLETED', '2026-10-05T01:00:00', '2026-10-05T03:00:00')),
+                     'weekly_efficiency', dataset)
+    export_job_frame(jobs(('11', 'COMPLETED', '2026-10-05T07:30:00', '2026-10-05T09:00:00')),
+                     'weekly_efficiency', dataset)
+
+    df = load_jobs('2026-10-05', '2026-10-05', report='weekly_efficiency', dataset_dir=dataset)
+    assert sorted(df['JobID']) == ['10', '11']
+
+
+def test_columns_added_later_are_loaded(tmp_path):
+    dataset = str(tmp_path)
+    # Energy columns only exist from the second day on
+    export_job_frame(jobs(('20', 'COMPLETED', '2026-10-01T01:00:00', '2026-10-01T02:00:00')),
+                     'monthly_billing', dataset)
+    export_job_frame(jobs(('21', 'COMPLETED', '2026-10-02T01:00:00', '2026-10-02T02:00:00'))
+                     .assign(EnergyKWh=1.5), 'monthly_billing', dataset)
+
+    df = load_jobs(dataset_dir=dataset).set_index('JobID')
+    assert df.loc['21', 'EnergyKWh'] == 1.5
+    assert pd.isna(df.loc['20', 'EnergyKWh'])
+
+    df = load_jobs(columns=['JobID', 'EnergyKWh'], dataset_dir=dataset)
+    assert list(df.columns) == ['JobID', 'EnergyKWh']
+    assert len(df) == 2
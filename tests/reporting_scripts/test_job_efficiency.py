@@ -0,0 +1,67 @@
+#!/usr/bin/env python3
+# Tests for the efficiency logic shared by the weekly report and the inefficiency watcher
+
+import os
+import sys
+
+import pytest
+
+pd = pytest.importorskip('pandas')
+pytest.importorskip('numpy')
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', '..', 'roles', 'reporting', 'files'))
+
+from job_efficiency import flag_inefficient_jobs, parse_elapsed, parse_mem, process_efficiency_data
+
+HEADER = "JobID|User|Account|State|Elapsed|TotalCPU|AllocCPUS|ReqMem|MaxRSS"
+
+
+def sacct(*rows, header=HEADER):
+    return '\n'.join([header] + ['|'.join(row) for row in rows]) + '\n'
+
+
+def test_parse_elapsed_and_mem():
+    assert parse_elapsed('1-02:00:00') == 93600
+    assert parse_elapsed('05:30.500') == 330
+    assert parse_elapsed('') == 0
+    assert parse_mem('4000K') == pytest.approx(4000 / 1024)
+    assert parse_mem('16G') == 16384
+    assert parse_mem('') == 0
+
+
+def test_efficiency_uses_step_maxrss():
+    df = process_efficiency_data(sacct(
+        ('10', 'alice', 'phys', 'COMPLETED', '01:00:00', '01:00:00', '4', '8G', ''),
+        ('10.batch', '', 'phys', 'COMPLETED', '01:00:00', '00:10:00', '4', '', '2G'),
+        ('10.0', '', 'phys', 'COMPLETED', '00:50:00', '00:50:00', '4', '', '6G'),
+        ('11', 'bob', 'chem', 'COMPLETED', '00:30:00', '02:00:00', '4', '1000M', '900M'),
+    ))
+    # Steps are folded into their job
+    assert list(df['JobID']) == ['10', '11']
+    jobs = df.set_index('JobID')
+    assert jobs.loc['10', 'CPUEfficiency'] == pytest.approx(25)
+    assert jobs.loc['11', 'CPUEfficiency'] == pytest.approx(100)
+    # The job line has no MaxRSS; the peak step does
+    assert jobs.loc['10', 'MaxRSSMB'] == 6144
+    assert jobs.loc['10', 'MemEfficiency'] == pytest.approx(75)
+    assert jobs.loc['11', 'MemEfficiency'] == pytest.approx(90)
+
+    inefficient_cpu, inefficient_mem = flag_inefficient_jobs(df, cpu_threshold=50, mem_threshold=80)
+    assert list(inefficient_cpu) == [True, False]
+    assert list(inefficient_mem) == [True, False]
+
+
+def test_step_maxrss_is_kept_per_cluster():
+    header = "Cluster|" + HEADER
+    df = process_efficiency_data(sacct(
+        ('east', '7', 'alice', 'phys', 'COMPLETED', '01:00:00', '01:00:00', '1', '4G', ''),
+        ('east', '7.0', '', 'phys', 'COMPLETED', '01:00:00', '01:00:00', '1', '', '1G'),
+        ('west', '7', 'bob', 'chem', 'COMPLETED', '01:00:00', '01:00:00', '1', '4G', ''),
+        ('west', '7.0', '', 'chem', 'COMPLETED', '01:00:00', '01:00:00', '1', '', '3G'),
+        header=header))
+    assert dict(zip(df['Cluster'], df['MemEfficiency'])) == {'east': 25, 'west': 75}
+
+
+def test_empty_output():
+    assert process_efficiency_data('') is None
+    assert process_efficiency_data(HEADER + '\n').empty
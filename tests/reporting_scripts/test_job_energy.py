@@ -0,0 +1,163 @@
+#!/usr/bin/env python3
+# Tests for energy accounting against a local Prometheus HTTP API stand-in
+
+import os
+import re
+import sys
+import json
+import socket
+import threading
+import urllib.parse
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+pd = pytest.importorskip('pandas')
+pytest.importorskip('numpy')
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', '..', 'roles', 'reporting', 'files'))
+
+from job_energy import PrometheusClient, expand_hostlist, add_energy_columns, fetch_checkpoint_energy
+
+# Constant power drawn by each (job, node) while the job runs
+JOB_POWER = {
+    ('101', 'nodo01'): 200.0,
+    ('102', 'nodo01'): 50.0,
+    ('102', 'nodo02'): 50.0,
+    ('103', 'nodo02'): 100.0,
+}
+# Epoch seconds for 2025-03-01 00:00:00 UTC, aligned to the 6h query window
+T0 = 1740787200
+
+JOB_INTERVALS = {
+    '101': (T0 + 600, T0 + 600 + 2 * 3600),       # 2h on one node
+    '102': (T0 + 3600, T0 + 3600 + 8 * 3600),     # 8h on two nodes, spans two windows
+    '103': (T0 + 4 * 3600, T0 + 5 * 3600),        # 1h
+}
+
+
+# Prolog/epilog checkpoints: (job, node) -> (joules, concurrent jobs)
+CHECKPOINTS = {
+    ('103', 'nodo02'): (540000.0, 1),   # exact 0.15 kWh, preferred over the series
+    ('101', 'nodo01'): (9000000.0, 2),  # shared node, ignored
+}
+
+
+class FakePrometheus(BaseHTTPRequestHandler):
+    queries = []
+
+    def do_GET(self):
+        url = urllib.parse.urlparse(self.path)
+        params = {k: v[0] for k, v in urllib.parse.parse_qs(url.query).items()}
+        FakePrometheus.queries.append(params)
+        if url.path == '/api/v1/query':
+            self.reply('vector', [
+                {'metric': {'job_id': job_id, 'hostname': node},
+                 'value': [params['time'], str(joules if 'energy_joules' in params['query'] else concurrent)]}
+                for (job_id, node), (joules, concurrent) in CHECKPOINTS.items()
+            ])
+            return
+
+        node = re.search(r'hostname=~"([^(]+)\(', params['query']).group(1).replace('\\\\', '')
+        start, end, step = float(params['start']), float(params['end']), float(params['step'])
+
+        result = []
+        for (job_id, job_node), watts in JOB_POWER.items():
+            job_start, job_end = JOB_INTERVALS[job_id]
+            if job_node != node:
+                continue
+            values = [[t, str(watts)] for t in range(int(start), int(end) + 1, int(step))
+                      if job_start <= t <= job_end]
+            if values:
+                result.append({'metric': {'job_id': job_id, 'hostname': node}, 'values': values})
+
+        self.reply('matrix', result)
+
+    def reply(self, result_type, result):
+        body = json.dumps({'status': 'success', 'data': {'resultType': result_type, 'result': result}}).encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def prometheus():
+    FakePrometheus.queries = []
+    server = ThreadingHTTPServer(('127.0.0.1', 0), FakePrometheus)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield PrometheusClient(f"http://127.0.0.1:{server.server_address[1]}")
+    server.shutdown()
+
+
+def make_jobs():
+    rows = []
+    for job_id, nodelist in [('101', 'nodo01'), ('102', 'nodo[01-02]'), ('103', 'nodo02'), ('104', 'None assigned')]:
+        start, end = JOB_INTERVALS.get(job_id, (T0, T0 + 60))
+        rows.append({
+            'JobID': job_id,
+            'Start': datetime.fromtimestamp(start).strftime('%Y-%m-%dT%H:%M:%S'),
+            'End': datetime.fromtimestamp(end).strftime('%Y-%m-%dT%H:%M:%S'),
+            'NodeList': nodelist,
+        })
+    return pd.DataFrame(rows)
+
+
+def test_expand_hostlist():
+    assert expand_hostlist('nodo[01-03,07],gpu1') == ['nodo01', 'nodo02', 'nodo03', 'nodo07', 'gpu1']
+    assert expand_hostlist('None assigned') == []
+
+
+def test_energy_integrated_per_job(prometheus):
+    df = add_energy_columns(make_jobs(), prometheus, kwh_rate=0.25)
+    energy = dict(zip(df['JobID'], df['EnergyKWh']))
+
+    assert energy['101'] == pytest.approx(0.4)        # 200 W x 2 h
+    assert energy['102'] == pytest.approx(0.8)        # 2 x 50 W x 8 h
+    assert energy['103'] == pytest.approx(0.15)       # checkpoint, not 100 W x 1 h
+    assert pd.isna(energy['104'])
+    assert df.loc[df['JobID'] == '101', 'EnergyCost'].iloc[0] == pytest.approx(0.1)
+
+
+def test_one_query_per_window_and_node(prometheus):
+    add_energy_columns(make_jobs(), prometheus, kwh_rate=0.25)
+    # Three jobs share window 0 on two nodes; only job 102 reaches window 1
+    range_queries = [q for q in FakePrometheus.queries if 'step' in q]
+    assert len(range_queries) == 4
+    assert len({(q['query'], q['start']) for q in range_queries}) == 4
+    # Plus one instant query each for checkpoint energy and concurrency
+    assert prometheus.queries == 6
+
+
+def test_unreachable_prometheus_stops_after_first_error(capsys):
+    # A port nothing listens on refuses every connection
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        port = sock.getsockname()[1]
+    client = PrometheusClient(f"http://127.0.0.1:{port}", timeout=1)
+    df = add_energy_columns(make_jobs(), client, kwh_rate=0.25, max_parallel=1)
+
+    assert df['EnergyKWh'].isna().all()
+    assert client.queries == 1
+    # One summary line, and no checkpoint queries after it
+    out = capsys.readouterr().out.strip().split('\n')
+    assert len(out) == 1 and out[0].startswith('Prometheus unavailable')
+
+
+def test_checkpoints_are_queried_per_day(prometheus):
+    start = T0
+    end = T0 + 3 * 24 * 3600
+    energy = fetch_checkpoint_energy(prometheus, start, end)
+    assert energy == {'103': pytest.approx(0.15)}
+    instant = [q for q in FakePrometheus.queries if 'step' not in q]
+    # Three days plus the epilog lag, for energy and concurrency
+    assert len(instant) == 8
+    assert {q['query'] for q in instant} == {'max_over_time(slurm_job_energy_joules[86400s])',
+                                             'max_over_time(slurm_job_energy_concurrent_jobs[86400s])',
+                                             'max_over_time(slurm_job_energy_joules[3600s])',
+                                             'max_over_time(slurm_job_energy_concurrent_jobs[3600s])'}
@@ -0,0 +1,70 @@
+#!/usr/bin/env python3
+# Tests for the wait/runtime quantile sketches used by the reporting scripts
+
+import os
+import sys
+import random
+from datetime import datetime
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', '..', 'roles', 'reporting', 'files'))
+
+from job_sketches import (TDigest, build_daily_sketches, save_daily_sketches,
+                          load_sketches, summarize_sketches)
+
+
+def exact_quantile(values, q):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+def test_quantiles_are_close_to_exact():
+    rng = random.Random(42)
+    values = [rng.expovariate(1 / 600) for _ in range(20000)]
+    digest = TDigest()
+    for value in values:
+        digest.add(value)
+
+    for q in (0.5, 0.9, 0.99):
+        exact = exact_quantile(values, q)
+        assert abs(digest.quantile(q) - exact) / exact < 0.03
+
+
+def test_memory_is_bounded():
+    digest = TDigest(compression=50)
+    for i in range(100000):
+        digest.add(i)
+    data = digest.to_dict()
+    assert len(data['m']) <= 2 * 50
+    assert data['n'] == 100000
+
+
+def test_merged_days_match_single_sketch():
+    rng = random.Random(7)
+    days = [[rng.uniform(0, 3600) for _ in range(5000)] for _ in range(7)]
+
+    merged = TDigest()
+    for values in days:
+        daily = TDigest()
+        for value in values:
+            daily.add(value)
+        merged.merge(TDigest.from_dict(daily.to_dict()))
+
+    all_values = [v for values in days for v in values]
+    assert merged.count == len(all_values)
+    for q in (0.5, 0.9, 0.99):
+        exact = exact_quantile(all_values, q)
+        assert abs(merged.quantile(q) - exact) / exact < 0.03
+
+
+def test_daily_files_round_trip(tmp_path):
+    observations = [('wait', 'compute', 'physics', 60.0 * i) for i in range(1, 11)]
+    observations += [('runtime', 'gpu', 'astro', 3600.0)]
+    save_daily_sketches(str(tmp_path), '2026-10-01', build_daily_sketches(observations))
+    save_daily_sketches(str(tmp_path), '2026-10-02', build_daily_sketches(observations))
+
+    sketches = load_sketches(str(tmp_path), datetime(2026, 10, 1), datetime(2026, 10, 31))
+    rows = {row['Partition']: row for row in summarize_sketches(sketches, by='partition')}
+
+    assert rows['compute']['Jobs'] == 20
+    assert rows['gpu']['Jobs'] == 0
+    assert rows['gpu']['Runtime p50 (min)'] == 60.0
@@ -0,0 +1,117 @@
+#!/usr/bin/env python3
+# Tests for batched, cached LDAP enrichment against a stub LDAP connection
+
+import os
+import re
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', '..', 'roles', 'reporting', 'files'))
+
+from ldap_enrichment import (LdapDirectory, UserAttributeCache, resolve_users,
+                             escape_filter_value)
+
+BASE_DN = "dc=example,dc=org"
+
+PEOPLE = {
+    'kfeynman': {'uid': ['kfeynman'], 'cn': ['Kip Feynman'], 'businessCategory': ['CC-101']},
+    'sbohr': {'uid': ['sbohr'], 'cn': ['Stan Bohr'], 'displayName': 'Dr. S. Bohr',
+              'departmentNumber': ['Physics']},
+    'csagan': {'uid': ['csagan'], 'cn': ['Carla Sagan']},
+}
+
+GROUPS = {
+    'quantum-physics': {'cn': ['quantum-physics'], 'description': ['Quantum Physics Research Group'],
+                        'member': [f"uid=kfeynman,ou=People,{BASE_DN}", f"uid=sbohr,ou=People,{BASE_DN}"]},
+    'astrophysics': {'cn': ['astrophysics'], 'description': ['Astrophysics Research Group'],
+                     'member': [f"uid=csagan,ou=People,{BASE_DN}"]},
+}
+
+
+class StubConnection:
+    """Implements the subset of ldap3.Connection used by LdapDirectory"""
+
+    def __init__(self):
+        self.searches = []
+        self.response = []
+        self.unbound = 0
+
+    def search(self, search_base, search_filter, attributes=None):
+        self.searches.append((search_base, search_filter))
+        if search_base.startswith('ou=People'):
+            wanted = set(re.findall(r'\(uid=([^)]+)\)', search_filter))
+            self.response = [{'type': 'searchResEntry', 'dn': f"uid={uid},ou=People,{BASE_DN}",
+                              'attributes': PEOPLE[uid]} for uid in sorted(wanted) if uid in PEOPLE]
+        else:
+            wanted = set(re.findall(r'\(member=([^)]+)\)', search_filter))
+            self.response = [{'type': 'searchResEntry', 'dn': f"cn={name},ou=Groups,{BASE_DN}",
+                              'attributes': group} for name, group in GROUPS.items()
+                             if wanted & set(group['member'])]
+        return bool(self.response)
+
+    def unbind(self):
+        self.unbound += 1
+
+
+def make_directory(connection, batch_size=2):
+    return LdapDirectory('ldap://stub', BASE_DN, batch_size=batch_size,
+                         connection_factory=lambda: connection)
+
+
+def test_users_resolved_in_batches_over_one_connection(tmp_path):
+    connection = StubConnection()
+    factory_calls = []
+
+    def factory():
+        factory_calls.append(1)
+        return connection
+
+    directory = LdapDirectory('ldap://stub', BASE_DN, batch_size=2, connection_factory=factory)
+    cache = UserAttributeCache(str(tmp_path / 'cache.json'))
+    resolved = resolve_users(['kfeynman', 'sbohr', 'csagan', 'ghost', 'sbohr'], directory, cache)
+
+    assert len(factory_calls) == 1
+    # 4 distinct users in batches of 2 -> 2 user queries, plus 1 group query
+    assert len(connection.searches) == 3
+    assert resolved['sbohr'] == {'DisplayName': 'Dr. S. Bohr', 'Department': 'Physics', 'CostCentre': None}
+    assert resolved['kfeynman']['DisplayName'] == 'Kip Feynman'
+    assert resolved['kfeynman']['Department'] == 'Quantum Physics Research Group'
+    assert resolved['kfeynman']['CostCentre'] == 'CC-101'
+    assert resolved['csagan']['Department'] == 'Astrophysics Research Group'
+    assert resolved['ghost'] is None
+
+
+def test_repeat_runs_are_served_from_cache(tmp_path):
+    cache_path = str(tmp_path / 'cache.json')
+    resolve_users(['kfeynman', 'ghost'], make_directory(StubConnection()), UserAttributeCache(cache_path))
+
+    connection = StubConnection()
+    resolved = resolve_users(['kfeynman', 'ghost'], make_directory(connection), UserAttributeCache(cache_path))
+
+    assert connection.searches == []
+    assert resolved['kfeynman']['DisplayName'] == 'Kip Feynman'
+    assert resolved['ghost'] is None
+
+
+def test_expired_entries_are_refetched(tmp_path):
+    cache_path = str(tmp_path / 'cache.json')
+    resolve_users(['sbohr'], make_directory(StubConnection()), UserAttributeCache(cache_path))
+
+    connection = StubConnection()
+    resolve_users(['sbohr'], make_directory(connection), UserAttributeCache(cache_path, ttl=0))
+    assert len(connection.searches) == 1
+
+
+def test_directory_failure_falls_back_to_cache(tmp_path):
+    cache_path = str(tmp_path / 'cache.json')
+    resolve_users(['sbohr'], make_directory(StubConnection()), UserAttributeCache(cache_path))
+
+    def broken():
+        raise OSError("connection refused")
+
+    directory = LdapDirectory('ldap://stub', BASE_DN, connection_factory=broken)
+    resolved = resolve_users(['sbohr'], directory, UserAttributeCache(cache_path, ttl=0))
+    assert resolved['sbohr']['Department'] == 'Physics'
+
+
+def test_filter_values_are_escaped():
+    assert escape_filter_value('a*(b)\\') == r'a\2a\28b\29\5c'
@@ -0,0 +1,33 @@
+#!/usr/bin/env python3
+# Tests for reading report credentials from owner-only secret files
+
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', '..', 'roles', 'reporting', 'files'))
+
+from report_secrets import read_secret
+
+
+def test_reads_secret_without_trailing_newline(tmp_path, capsys):
+    path = tmp_path / 'ldap_bind_password'
+    path.write_text('s3cret\n')
+    os.chmod(path, 0o600)
+    assert read_secret('ldap_bind_password', str(tmp_path)) == 's3cret'
+    assert capsys.readouterr().out == ''
+
+
+def test_missing_or_empty_secret_is_none(tmp_path):
+    assert read_secret('ldap_bind_password', str(tmp_path)) is None
+    path = tmp_path / 'ldap_bind_password'
+    path.write_text('')
+    os.chmod(path, 0o600)
+    assert read_secret('ldap_bind_password', str(tmp_path)) is None
+
+
+def test_warns_about_readable_secret(tmp_path, capsys):
+    path = tmp_path / 'ldap_bind_password'
+    path.write_text('s3cret')
+    os.chmod(path, 0o644)
+    assert read_secret('ldap_bind_password', str(tmp_path)) == 's3cret'
+    assert 'should be mode 0600' in capsys.readouterr().out
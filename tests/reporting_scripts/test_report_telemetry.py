@@ -0,0 +1,115 @@
+#!/usr/bin/env python3
+# Tests for per-stage report telemetry, profiling and the textfile metrics
+
+import os
+import sys
+import json
+import argparse
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', '..', 'roles', 'reporting', 'files'))
+
+from report_telemetry import EXIT_NO_DATA, RunTelemetry, add_profile_argument
+
+def run_report(tmp_path, fail_in=None, exit_code=None, profile=None, **options):
+    telemetry = RunTelemetry('daily_usage', profile=profile,
+                             telemetry_log=str(tmp_path / 'state' / 'telemetry.jsonl'),
+                             textfile_dir=str(tmp_path), profile_dir=str(tmp_path / 'profiles'), **options)
+    with telemetry:
+        with telemetry.stage('fetch'):
+            data = [str(i) * 100 for i in range(1000)]
+        with telemetry.stage('parse') as stage:
+            rows = [line.upper() for line in data]
+            stage.rows = len(rows)
+            if fail_in == 'parse':
+                raise ValueError('bad sacct output')
+        if exit_code is not None:
+            sys.exit(exit_code)
+        for _ in range(2):
+            with telemetry.stage('plot'):
+                sum(range(1000))
+    return telemetry
+
+def test_records_stages_and_appends_log(tmp_path):
+    telemetry = run_report(tmp_path)
+    run_report(tmp_path)
+
+    with open(tmp_path / 'state' / 'telemetry.jsonl') as f:
+        records = [json.loads(line) for line in f]
+    assert len(records) == 2
+    record = records[0]
+    assert record['status'] == 'success'
+    stages = {stage['stage']: stage for stage in record['stages']}
+    assert list(stages) == ['fetch', 'parse', 'plot']
+    assert stages['parse']['rows'] == 1000
+    assert stages['plot']['calls'] == 2
+    assert stages['fetch']['peak_memory_bytes'] > 100 * 1000
+    assert record['peak_memory_bytes'] >= stages['fetch']['peak_memory_bytes']
+    assert record['wall_seconds'] >= sum(stage['wall_seconds'] for stage in record['stages'])
+    assert telemetry.record['report'] == 'daily_usage'
+
+def test_textfile_metrics(tmp_path):
+    run_report(tmp_path)
+    with open(tmp_path / 'slurm_report_daily_usage.prom') as f:
+        text = f.read()
+    assert 'slurm_report_success{report="daily_usage"} 1' in text
+    assert 'slurm_report_stage_rows{report="daily_usage",stage="parse"} 1000' in text
+    assert 'slurm_report_stage_duration_seconds{report="daily_usage",stage="plot"}' in text
+    # Stages without a row count are left out of the rows metric
+    assert 'slurm_report_stage_rows{report="daily_usage",stage="fetch"}' not in text
+
+def test_failures_are_recorded(tmp_path):
+    with pytest.raises(ValueError):
+        run_report(tmp_path, fail_in='parse')
+    with pytest.raises(SystemExit):
+        run_report(tmp_path, exit_code=1)
+    with pytest.raises(SystemExit):
+        run_report(tmp_path, exit_code=0)
+
+    with open(tmp_path / 'state' / 'telemetry.jsonl') as f:
+        records = [json.loads(line) for line in f]
+    assert [(r['status'], r['failed_stage']) for r in records] == [
+        ('failed', 'parse'), ('failed', None), ('success', None)]
+
+def test_stage_marked_failed_fails_the_run(tmp_path):
+    telemetry = RunTelemetry('monthly_billing', telemetry_log=str(tmp_path / 'telemetry.jsonl'),
+                             textfile_dir=str(tmp_path), trace_memory=False)
+    with telemetry:
+        with telemetry.stage('send') as stage:
+            stage.fail('email report not sent')
+        # Later stages still run
+        with telemetry.stage('statements'):
+            pass
+
+    assert telemetry.record['status'] == 'failed'
+    assert telemetry.record['failed_stage'] == 'send'
+    assert telemetry.record['stages'][0]['error'] == 'email report not sent'
+    with open(tmp_path / 'slurm_report_monthly_billing.prom') as f:
+        assert 'slurm_report_success{report="monthly_billing"} 0' in f.read()
+
+def test_empty_period_is_not_a_failure(tmp_path):
+    with pytest.raises(SystemExit):
+        run_report(tmp_path, exit_code=EXIT_NO_DATA)
+    with open(tmp_path / 'state' / 'telemetry.jsonl') as f:
+        assert json.loads(f.readline())['status'] == 'no_data'
+    with open(tmp_path / 'slurm_report_daily_usage.prom') as f:
+        text = f.read()
+    assert 'slurm_report_success{report="daily_usage"} 1' in text
+    assert 'slurm_report_no_data{report="daily_usage"} 1' in text
+
+def test_log_is_rotated_past_size_cap(tmp_path):
+    for _ in range(3):
+        run_report(tmp_path, log_max_bytes=1)
+    # Each run finds the log over the cap and starts a new one
+    for path in (tmp_path / 'state' / 'telemetry.jsonl', tmp_path / 'state' / 'telemetry.jsonl.1'):
+        with open(path) as f:
+            assert len(f.readlines()) == 1
+
+def test_profile_writes_per_stage_output(tmp_path):
+    args = add_profile_argument(argparse.ArgumentParser()).parse_args(['--profile'])
+    assert args.profile == 'cprofile'
+    run_report(tmp_path, profile=args.profile)
+    names = sorted(os.listdir(tmp_path / 'profiles'))
+    assert any(name.endswith('-parse-1.prof') for name in names)
+    assert any(name.endswith('-plot-2.txt') for name in names)
@@ -0,0 +1,94 @@
+#!/usr/bin/env python3
+# Tests for the concurrent multi-cluster sacct fetch and per-cluster billing
+
+import os
+import sys
+import time
+import subprocess
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', '..', 'roles', 'reporting', 'files'))
+
+from sacct_fetch import ClusterFetchError, fetch_accounting_data, merge_sacct_output, sacct_command
+
+FIELDS = "JobID,User,Account,Partition,State,Start,End,Elapsed,AllocCPUS,AllocTRES,NodeList,NNodes,JobIDRaw"
+
+OUTPUT = {
+    'alpha': (f"{FIELDS.replace(',', '|')}\n"
+              "100|alice|physics|compute|COMPLETED|2026-01-01T00:00:00|2026-01-01T02:00:00|02:00:00|4|"
+              "cpu=4,mem=8G,node=1,billing=4|n01|1|100\n"
+              "100.batch||physics||COMPLETED|2026-01-01T00:00:00|2026-01-01T02:00:00|02:00:00|4|"
+              "cpu=4,mem=8G,node=1|n01|1|100.batch\n"),
+    'beta': (f"{FIELDS.replace(',', '|')}\n"
+             "100|bob|chem|gpu|COMPLETED|2026-01-01T00:00:00|2026-01-01T01:00:00|01:00:00|8|"
+             "cpu=8,mem=16G,node=1,billing=8,gres/gpu=2|g01|1|100\n"),
+}
+
+def fake_sacct(delay=0.0, failing=()):
+    def runner(cmd):
+        cluster = cmd[cmd.index('-M') + 1] if '-M' in cmd else 'alpha'
+        time.sleep(delay)
+        if cluster in failing:
+            raise subprocess.CalledProcessError(1, cmd)
+        return OUTPUT[cluster]
+    return runner
+
+def test_sacct_command_targets_cluster():
+    cmd = sacct_command(FIELDS, '2026-01-01T00:00:00', '2026-02-01T00:00:00', 'beta')
+    assert cmd[:4] == ['sacct', '-a', '-M', 'beta']
+    assert '-M' not in sacct_command(FIELDS, 'a', 'b')
+
+def test_merge_prefixes_cluster_column():
+    merged = merge_sacct_output({'alpha': OUTPUT['alpha'], 'beta': OUTPUT['beta'], 'gamma': None})
+    lines = merged.strip().split('\n')
+    assert lines[0].startswith('Cluster|JobID|')
+    assert [line.split('|')[:2] for line in lines[1:]] == [['alpha', '100'], ['alpha', '100.batch'], ['beta', '100']]
+    assert merge_sacct_output({'alpha': None}) is None
+
+def test_fetch_runs_clusters_concurrently():
+    started = time.monotonic()
+    merged = fetch_accounting_data(FIELDS, 'a', 'b', clusters=['alpha', 'beta'], runner=fake_sacct(delay=0.3))
+    assert time.monotonic() - started < 0.55
+    assert merged.count('\n') == 4
+
+def test_failing_cluster_aborts_fetch(capsys):
+    # Billing the clusters that answered would silently under-bill the one that did not
+    with pytest.raises(ClusterFetchError) as excinfo:
+        fetch_accounting_data(FIELDS, 'a', 'b', clusters=['alpha', 'beta'], runner=fake_sacct(failing={'beta'}))
+    assert list(excinfo.value.errors) == ['beta']
+    assert 'cluster beta' in capsys.readouterr().out
+
+    with pytest.raises(ClusterFetchError):
+        fetch_accounting_data(FIELDS, 'a', 'b', local_cluster='alpha', runner=fake_sacct(failing={'alpha'}))
+
+def test_local_cluster_is_labelled():
+    merged = fetch_accounting_data(FIELDS, 'a', 'b', local_cluster='alpha', runner=fake_sacct())
+    assert merged.split('\n')[1].startswith('alpha|100|')
+
+def test_billing_applies_cluster_rates():
+    pytest.importorskip('pandas')
+    import job_costing
+
+    data = merge_sacct_output(OUTPUT)
+    df = job_costing.process_billing_data(data, {'cpu': 0.05, 'gpu': 0.50, 'mem': 0.0},
+                                          {'beta': {'gpu': 1.00}})
+    costs = dict(zip(df['Cluster'], df['TotalCost']))
+    assert costs['alpha'] == pytest.approx(4 * 2 * 0.05)
+    assert costs['beta'] == pytest.approx(8 * 0.05 + 2 * 1.00)
+    table = job_costing.cluster_rates_table(['alpha', 'beta'], {'gpu': 0.50}, {'beta': {'gpu': 1.00}})
+    assert table.set_index('Cluster')['gpu'].to_dict() == {'alpha': 0.50, 'beta': 1.00}
+
+def test_step_memory_stays_within_cluster():
+    pytest.importorskip('pandas')
+    from job_efficiency import process_efficiency_data
+
+    header = "Cluster|JobID|User|Account|Partition|State|Start|End|Elapsed|TotalCPU|ReqCPUS|AllocCPUS|ReqMem|MaxRSS|NodeList|NNodes|JobIDRaw"
+    rows = [
+        "alpha|7|alice|a|c|COMPLETED|||01:00:00|01:00:00|1|1|1000M||n1|1|7",
+        "alpha|7.0||a|c|COMPLETED|||01:00:00|01:00:00|1|1||900M|n1|1|7.0",
+        "beta|7|bob|b|c|COMPLETED|||01:00:00|01:00:00|1|1|1000M||n2|1|7",
+        "beta|7.0||b|c|COMPLETED|||01:00:00|01:00:00|1|1||100M|n2|1|7.0",
+    ]
+    df = process_efficiency_data('\n'.join([header] + rows))
+    assert dict(zip(df['Cluster'], df['MaxRSSMB'])) == {'alpha': 900, 'beta': 100}
@@ -0,0 +1,136 @@
+#!/usr/bin/env python3
+# Tests for the usage query service over the daily cost rollups
+
+import os
+import sys
+import json
+import threading
+import urllib.request
+import urllib.error
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', '..', 'roles', 'reporting', 'files'))
+
+from usage_query_service import UsageIndex, QueryError, make_server
+
+def row(user, account, partition, jobs, cpu_hours, total_cost, cluster='alpha'):
+    return {'cluster': cluster, 'user': user, 'account': account, 'partition': partition,
+            'jobs': jobs, 'cpu_hours': cpu_hours, 'gpu_hours': 0, 'mem_gb_hours': 0,
+            'cpu_cost': total_cost, 'gpu_cost': 0, 'mem_cost': 0, 'total_cost': total_cost}
+
+def write_day(rollup_dir, day, rows):
+    path = os.path.join(rollup_dir, f"{day}.json")
+    with open(path, 'w') as f:
+        json.dump({'version': 1, 'day': day, 'rows': rows}, f)
+    # Make sure the change is visible even on coarse mtime filesystems
+    st = os.stat(path)
+    os.utime(path, ns=(st.st_atime_ns, st.st_mtime_ns + 1_000_000_000))
+    return path
+
+@pytest.fixture
+def index(tmp_path):
+    write_day(str(tmp_path), '2026-03-01', [
+        row('alice', 'physics', 'compute', 2, 10.0, 0.5),
+        row('bob', 'chem', 'gpu', 1, 4.0, 2.0),
+    ])
+    write_day(str(tmp_path), '2026-03-02', [
+        row('alice', 'physics', 'gpu', 1, 6.0, 3.0),
+        row('carol', 'physics', 'compute', 3, 20.0, 1.0),
+    ])
+    index = UsageIndex(str(tmp_path))
+    index.refresh()
+    return index
+
+def test_totals_filters_and_grouping(index):
+    assert index.query()['totals']['cpu_hours'] == 40.0
+    assert index.query()['totals']['jobs'] == 7
+
+    alice = index.query(filters={'user': 'alice'})
+    assert alice['totals']['total_cost'] == 3.5
+    assert alice['days'] == 2
+
+    # Two filters fall back to scanning the rows
+    assert index.query(filters={'account': 'physics', 'partition': 'gpu'})['totals']['cpu_hours'] == 6.0
+
+    grouped = index.query(start='2026-03-02', group_by='account')
+    assert grouped['days'] == 1
+    assert [g['account'] for g in grouped['groups']] == ['physics']
+
+    by_user = index.query(group_by='user', limit=1, filters={'account': 'physics'})
+    assert by_user['groups'] == [dict(by_user['groups'][0], user='alice')]
+    assert by_user['groups'][0]['total_cost'] == 3.5
+
+def test_rejects_bad_parameters(index):
+    with pytest.raises(QueryError):
+        index.query(start='yesterday')
+    with pytest.raises(QueryError):
+        index.query(start='2026-03-02', end='2026-03-01')
+    with pytest.raises(QueryError):
+        index.query(group_by='node')
+    with pytest.raises(QueryError):
+        index.query(filters={'qos': 'normal'})
+
+def test_new_day_invalidates_cache(index, tmp_path):
+    assert index.query(filters={'user': 'carol'})['totals']['jobs'] == 3
+    assert index.query(filters={'user': 'carol'})['totals']['jobs'] == 3
+    assert index.cache_hits == 1
+    assert index.refresh() is False
+
+    write_day(str(tmp_path), '2026-03-03', [row('carol', 'physics', 'compute', 2, 8.0, 0.4)])
+    assert index.refresh() is True
+    assert index.query(filters={'user': 'carol'})['totals']['jobs'] == 5
+    assert index.query()['end'] == '2026-03-03'
+
+    os.remove(tmp_path / '2026-03-01.json')
+    index.refresh()
+    assert index.query(filters={'user': 'bob'})['totals']['jobs'] == 0
+
+def test_http_round_trip(index):
+    server = make_server('127.0.0.1', 0, index)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    base = f"http://127.0.0.1:{server.server_address[1]}"
+    try:
+        with urllib.request.urlopen(f"{base}/usage?user=alice&group_by=partition") as response:
+            body = json.load(response)
+        assert {g['partition'] for g in body['groups']} == {'compute', 'gpu'}
+
+        with urllib.request.urlopen(f"{base}/days") as response:
+            assert json.load(response)['days'] == ['2026-03-01', '2026-03-02']
+
+        with pytest.raises(urllib.error.HTTPError) as excinfo:
+            urllib.request.urlopen(f"{base}/usage?group_by=node")
+        assert excinfo.value.code == 400
+
+        # Query string keys never reach the method's own arguments
+        for query in ('self=x', 'filters=x', 'user=alice&self=x'):
+            with pytest.raises(urllib.error.HTTPError) as excinfo:
+                urllib.request.urlopen(f"{base}/usage?{query}")
+            assert excinfo.value.code == 400
+            assert 'unknown filter' in json.load(excinfo.value)['error']
+    finally:
+        server.shutdown()
+        server.server_close()
+
+def test_daily_rollup_feeds_index(tmp_path):
+    pd = pytest.importorskip('pandas')
+    import job_costing
+
+    df = pd.DataFrame([
+        {'JobID': '1', 'Cluster': 'alpha', 'User': 'alice', 'Account': 'physics', 'Partition': 'compute',
+         'End': '2026-03-01T10:00:00', 'Elapsed': '02:00:00', 'AllocCPUS': '4', 'AllocTRES': 'cpu=4,mem=8G'},
+        {'JobID': '2', 'Cluster': 'alpha', 'User': 'alice', 'Account': 'physics', 'Partition': 'compute',
+         'End': '2026-03-01T23:00:00', 'Elapsed': '01:00:00', 'AllocCPUS': '2', 'AllocTRES': 'cpu=2,mem=4G'},
+        {'JobID': '3', 'Cluster': 'alpha', 'User': 'bob', 'Account': 'chem', 'Partition': 'compute',
+         'End': 'Unknown', 'Elapsed': '05:00:00', 'AllocCPUS': '8', 'AllocTRES': 'cpu=8,mem=16G'},
+    ])
+    job_costing.add_usage_columns(df)
+    job_costing.add_cost_columns(df, {'cpu': 0.1, 'gpu': 1.0, 'mem': 0.0})
+    job_costing.write_daily_rollup(df, '2026-03-01', str(tmp_path))
+
+    index = UsageIndex(str(tmp_path))
+    index.refresh()
+    result = index.query(group_by='user')
+    # The still-running job has not ended, so it is not billed to the day yet
+    assert result['groups'] == [dict(result['groups'][0], user='alice', jobs=2, cpu_hours=10.0)]
+    assert result['totals']['total_cost'] == pytest.approx(1.0)
@@ -0,0 +1,52 @@
+#!/usr/bin/env python3
+# Tests for the offline template render and validation engine
+
+import os
+import sys
+
+import pytest
+
+pytest.importorskip('jinja2')
+pytest.importorskip('yaml')
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'scripts'))
+
+import render_templates
+from render_templates import REPO_ROOT, check_slurm_conf, copied_templates, load_inventory, run
+
+def test_check_slurm_conf():
+    check_slurm_conf("ClusterName=hpc\nSlurmctldHost=slurm01\nNodeName=c[1-2] CPUs=4 State=UNKNOWN\n", 'slurm.conf')
+    with pytest.raises(ValueError, match='Key=Value'):
+        check_slurm_conf("ClusterName=hpc\nSlurmctldHost=slurm01\nNodeName=c1 CPUs=4 \\n NodeName=c2\n", 'slurm.conf')
+    with pytest.raises(ValueError, match='unknown parameter'):
+        check_slurm_conf("ClusterName=hpc\nSlurmctldHost=slurm01\nClusterNmae=x\n", 'slurm.conf')
+    with pytest.raises(ValueError, match='already set'):
+        check_slurm_conf("ClusterName=hpc\nSlurmctldHost=slurm01\nClusterName=other\n", 'slurm.conf')
+
+def test_load_inventory_children(tmp_path):
+    hosts = tmp_path / 'hosts'
+    hosts.write_text("[controllers]\nctl01 ansible_host=10.0.0.1\n\n[compute]\nc01\nc02\n\n"
+                     "[cluster:children]\ncontrollers\ncompute\n")
+    groups, inventory_vars = load_inventory(str(hosts))
+    assert groups['compute'] == ['c01', 'c02']
+    assert sorted(groups['cluster']) == ['c01', 'c02', 'ctl01']
+    assert inventory_vars['ctl01']['ansible_host'] == '10.0.0.1'
+
+def test_run_caches_results(tmp_path, monkeypatch):
+    templates = [os.path.join(REPO_ROOT, 'roles', 'slurmctld', 'templates', 'slurm.conf.j2')]
+    cache_file = str(tmp_path / 'cache.json')
+    first = run(templates, cache_file=cache_file, workers=1)
+    assert [result['status'] for result in first] == ['ok']
+    assert not first[0]['cached']
+
+    # A second run must not render anything
+    monkeypatch.setattr(render_templates, 'ProcessPoolExecutor', None)
+    second = run(templates, cache_file=cache_file, workers=1)
+    assert second[0]['cached']
+    assert second[0]['output_digest'] == first[0]['output_digest']
+
+def test_copied_templates_are_checked_verbatim():
+    copied = copied_templates()
+    report = os.path.join(REPO_ROOT, 'roles', 'reporting', 'templates', 'reporting', 'daily_usage_report.py.j2')
+    assert os.path.normpath(report) in copied
+    assert not any(path.endswith('slurm.conf.j2') for path in copied)